@@ -0,0 +1,198 @@
+import itertools
+import os
+import platform
+import random
+import shutil
+import tempfile
+from .collection import add_decks, add_media, add_note_types, \
+    create_collection
+from .config import ProjectConfig, load_project
+from .file import create_data_file, create_template_file, load_config_file
+from .package import dump_package, export_package
+from .profiling import Profiler, max_rss
+from .util import utcnow
+
+
+bench_params = {
+    'note_types': 1,
+    'card_types': 1,
+    'decks': 1,
+    'notes': 1000,
+    'fields': 2,
+    'field_size': 20,
+    'media': 0,
+    'media_size': 1024
+}
+
+
+def generate_project(
+        directory, note_types=1, card_types=1, decks=1, notes=1000, fields=2,
+        field_size=20, media=0, media_size=1024, seed=0):
+    """Generate a synthetic project for benchmarks.
+
+    The notes are spread evenly over the decks, and each deck has a note group
+    for each note type. Each field value is `field_size` characters long, and
+    if there is any media, the first field of each note references one of the
+    media files. Note data is written as it is generated, so even projects with
+    millions of notes can be generated without holding them in memory.
+    """
+    rand = random.Random(seed)
+    project = ProjectConfig(path=os.path.join(directory, 'project.json'))
+    project.name = 'Benchmark'
+    project.package = 'packages/benchmark.apkg'
+    field_names = ['Field{}'.format(i + 1) for i in range(fields)]
+    for i in range(note_types):
+        note_type = project.add_note_type(
+            name='Note Type {}'.format(i + 1),
+            fields=list(field_names)
+        )
+        for j in range(card_types):
+            path = 'templates/note-type-{}-card-{}.html'.format(i + 1, j + 1)
+            template = create_template_file(project.resolve_path(path))
+            template.front = ['{{{{{}}}}}'.format(field_names[j % fields])]
+            template.back = [
+                '{{FrontSide}}',
+                '<hr id="answer">',
+                '{{{{{}}}}}'.format(field_names[(j + 1) % fields])
+            ]
+            card_type = note_type.add_card_type(name='Card {}'.format(j + 1))
+            card_type.set_template(path, template)
+    data_files = []
+    for i in range(decks):
+        deck = project.add_deck(name='Benchmark::Deck {}'.format(i + 1))
+        deck.package = 'packages/deck-{}.apkg'.format(i + 1)
+        for j, note_type in enumerate(project.note_types):
+            note_group = deck.add_notes(type=note_type.name)
+            path = 'data/deck-{}-note-type-{}.csv'.format(i + 1, j + 1)
+            data_file = create_data_file(project.resolve_path(path))
+            data_file.fields = field_names
+            note_group.add_data(path, data_file)
+            data_files.append(data_file)
+    if media:
+        project.media = ['media']
+    project.save()
+    project.save_files()
+    # write the notes' data, spreading the notes over the data files
+    for index, data_file in enumerate(data_files):
+        count = notes // len(data_files) + (index < notes % len(data_files))
+        rows = (
+            generate_record(rand, index, i, fields, field_size, media)
+            for i in range(count)
+        )
+        data_file.write_rows(rows)
+    media_dir = project.resolve_path('media')
+    for i in range(media):
+        os.makedirs(media_dir, exist_ok=True)
+        with open(os.path.join(media_dir, media_name(i)), 'wb') as file:
+            file.write(rand.getrandbits(8 * media_size).to_bytes(
+                media_size, 'little'
+            ))
+    return project
+
+
+def generate_record(rand, group, index, fields, field_size, media):
+    # the first field is unique, since it's used for the notes' GUIDs
+    values = ['{}-{}-'.format(group, index)]
+    values += [''] * (fields - 1)
+    letters = 'abcdefghijklmnopqrstuvwxyz '
+    for i in range(fields):
+        size = max(field_size - len(values[i]), 0)
+        values[i] += ''.join(rand.choices(letters, k=size))
+    if media:
+        values[0] += '<img src="{}">'.format(media_name(index % media))
+    return values
+
+
+def media_name(index):
+    return 'media-{}.bin'.format(index)
+
+
+def run_benchmark(work_dir=None, **params):
+    """Generate a project and time each phase of building and dumping it.
+
+    Returns the phases' wall times and CPU times (in seconds) and the peak
+    resident memory of the process after each phase (in kilobytes). Run each
+    benchmark in a fresh process (see `run_benchmarks`) for the peak memory to
+    only account for that benchmark.
+    """
+    directory = tempfile.mkdtemp(dir=work_dir)
+    profiler = Profiler()
+    try:
+        with profiler.phase('generate_project'):
+            generate_project(directory, **params)
+        with profiler.phase('load_project'):
+            project = load_project(directory)
+        build_dir = project.create_build_dir()
+        collection = create_collection(
+            os.path.join(build_dir, 'collection.anki2')
+        )
+        with profiler.phase('add_note_types'):
+            add_note_types(collection, project)
+        with profiler.phase('add_decks'):
+            add_decks(collection, project)
+        with profiler.phase('add_media'):
+            add_media(collection, project)
+        with profiler.phase('close_collection'):
+            collection.close()
+        package_path = project.resolve_path(project.package)
+        with profiler.phase('export_package'):
+            export_package(collection, package_path)
+        collection.close()
+        dump_dir = os.path.join(directory, 'dump')
+        os.makedirs(dump_dir)
+        with profiler.phase('dump_package'):
+            dump_package(package_path, dump_dir)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'params': params,
+        'phases': {
+            phase['name']: {
+                'wall': phase['wall'],
+                'cpu': phase['cpu'],
+                'max_rss': phase['max_rss']
+            }
+            for phase in profiler.phases
+        },
+        'max_rss': max_rss()
+    }
+
+
+def run_benchmarks(cases, repeat=1, work_dir=None, callback=None):
+    """Run each benchmark case in its own process and return the results.
+
+    `cases` is an iterable of dicts of `generate_project` parameters.
+    """
+    # multiprocessing is slow to import, and is rarely needed
+    from concurrent.futures import ProcessPoolExecutor
+    results = []
+    for params in cases:
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(
+                    run_benchmark, work_dir, **params
+                ).result()
+            results.append(result)
+            if callback:
+                callback(result)
+    return {
+        'panki': panki_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': utcnow().isoformat(),
+        'results': results
+    }
+
+
+def benchmark_cases(**values):
+    """Return every combination of the given parameter values."""
+    names = sorted(values)
+    return [
+        dict(zip(names, combination))
+        for combination in itertools.product(*(values[n] for n in names))
+    ]
+
+
+def panki_version():
+    path = os.path.join(os.path.dirname(__file__), 'metadata', 'metadata.json')
+    return load_config_file(path).contents.get('version')
@@ -1,6 +1,13 @@
 from .cli import cli
 
+from .bench import bench
 from .build import build
+from .check import check
 from .create import create
+from .dedupe import dedupe
 from .dump import dump
 from .export import export
+from .index import index
+from .remote import remote
+from .search import search
+from .serve import serve
@@ -0,0 +1,110 @@
+import json
+import click
+from .cli import cli
+from ..bench import bench_params, benchmark_cases, run_benchmarks
+from ..util import bad_param
+
+
+def bench_opt(name):
+    return dict(
+        type=click.IntRange(min=0), multiple=True,
+        default=[bench_params[name]], show_default=True
+    )
+
+
+@cli.command()
+@click.option(
+    '--notes', **bench_opt('notes'),
+    help='The number of notes. Can be provided multiple times.')
+@click.option(
+    '--note-types', **bench_opt('note_types'),
+    help='The number of note types. Can be provided multiple times.')
+@click.option(
+    '--card-types', **bench_opt('card_types'),
+    help='The number of card types per note type. Can be provided multiple ' +
+    'times.')
+@click.option(
+    '--decks', **bench_opt('decks'),
+    help='The number of decks. Can be provided multiple times.')
+@click.option(
+    '--fields', **bench_opt('fields'),
+    help='The number of fields per note type. Can be provided multiple times.')
+@click.option(
+    '--field-size', **bench_opt('field_size'),
+    help='The number of characters per field. Can be provided multiple times.')
+@click.option(
+    '--media', **bench_opt('media'),
+    help='The number of media files. Can be provided multiple times.')
+@click.option(
+    '--media-size', **bench_opt('media_size'),
+    help='The size of each media file in bytes. Can be provided multiple ' +
+    'times.')
+@click.option(
+    '--repeat', type=click.IntRange(min=1), default=1, show_default=True,
+    help='The number of times to run each benchmark.')
+@click.option(
+    '--output', type=click.Path(dir_okay=False),
+    help='Write the results to this JSON file instead of stdout.')
+@click.option(
+    '--work-dir', type=click.Path(file_okay=False, exists=True),
+    help='Generate the projects in this directory (defaults to the ' +
+    'system\'s temporary directory).')
+def bench(
+        notes, note_types, card_types, decks, fields, field_size, media,
+        media_size, repeat, output, work_dir):
+    """Benchmark panki with generated projects.
+
+    A synthetic project is generated for every combination of the provided
+    options, and is built, exported and dumped. The wall time, CPU time and
+    peak memory of each phase are reported as JSON, so the results of
+    different releases can be compared. Each benchmark runs in a fresh
+    process, and its generated project is deleted once it completes.
+
+    \b
+    $ panki bench --notes 1000 --notes 100000 --media 0 --media 100
+    $ panki bench --notes 1000000 --field-size 200 --output results.json
+
+    A summary of each benchmark is reported as it completes.
+    """
+    for name, values in [
+            ('note_types', note_types), ('card_types', card_types),
+            ('decks', decks), ('fields', fields)]:
+        if 0 in values:
+            bad_param(name, 'The generated projects need at least one.')
+    cases = benchmark_cases(
+        notes=notes,
+        note_types=note_types,
+        card_types=card_types,
+        decks=decks,
+        fields=fields,
+        field_size=field_size,
+        media=media,
+        media_size=media_size
+    )
+    results = run_benchmarks(
+        cases,
+        repeat=repeat,
+        work_dir=work_dir,
+        callback=report_result
+    )
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+    else:
+        click.echo(json.dumps(results, indent=2))
+
+
+def report_result(result):
+    params = ' '.join(
+        '{}={}'.format(name, value)
+        for name, value in result['params'].items()
+    )
+    phases = ' '.join(
+        '{}={:.2f}s'.format(name, phase['wall'])
+        for name, phase in result['phases'].items()
+    )
+    click.echo(
+        '{}: {} max_rss={}KB'.format(params, phases, result['max_rss']),
+        err=True
+    )
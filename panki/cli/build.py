@@ -1,18 +1,256 @@
+import glob
+import os
+import time
 import click
-from .cli import cli
-from ..config import load_project
-from ..package import build_project
+from .cli import cli, load_project_param
+from .profiling import profile_options, profiling
+from ..collection import memory_temp_dir
+from ..config import validate_project
+from ..package import build_project, build_projects
+from ..profiling import profile_phase
 from ..util import bad_param
 
 
+default_chunk_size = 10000
+
+
 @cli.command()
-@click.argument(
-    'directory', type=click.Path(file_okay=False, exists=True), default='.')
-def build(directory):
-    """Build Anki package files from a panki project."""
-    project = load_project(directory)
-    if not project:
-        bad_param(
-            'directory',
-            'The directory does not contain a project config file')
-    build_project(project)
+@click.argument('directories', nargs=-1)
+@click.option(
+    '--temp-dir', type=click.Path(file_okay=False, exists=True),
+    help='Build the collection in this directory and copy it into the ' +
+    'project\'s build directory once it is complete.')
+@click.option(
+    '--in-memory', is_flag=True,
+    help='Build the collection in a memory-backed directory (tmpfs) and ' +
+    'copy it into the project\'s build directory once it is complete.')
+@click.option(
+    '--compression-level', type=click.IntRange(0, 9), default=6,
+    help='Set the zip compression level of the packages (0 stores files ' +
+    'without compression).')
+@click.option(
+    '--reproducible', is_flag=True,
+    help='Build byte-for-byte reproducible packages.')
+@click.option(
+    '--delta-from', type=click.Path(dir_okay=False, exists=True),
+    help='Also export delta packages with the notes that changed since the ' +
+    'build with this manifest.')
+@click.option(
+    '-j', '--jobs', type=click.IntRange(min=1),
+    help='The number of projects to build at the same time, when building ' +
+    'several projects (defaults to the number of CPUs).')
+@click.option(
+    '--chunk-size', type=click.IntRange(min=1),
+    help='Add notes in batches of this many notes, reading each data file ' +
+    'only when its notes are added.')
+@click.option(
+    '--max-memory', type=click.IntRange(min=1), metavar='MB',
+    help='Stop a chunked build that uses more than this many megabytes of ' +
+    'memory (implies --chunk-size 10000).')
+@click.option(
+    '--shards', type=click.IntRange(min=1),
+    help='Add the notes in this many processes at once and merge them into ' +
+    'the collection.')
+@click.option(
+    '--update', is_flag=True,
+    help='Update the collection in the build directory instead of building ' +
+    'a new one.')
+@click.option(
+    '--prune', is_flag=True,
+    help='Remove the notes that are no longer in the project from the ' +
+    'updated collection (requires --update).')
+@click.option(
+    '--stable-ids', is_flag=True,
+    help='Derive note and card IDs from the note GUIDs, and keep the ' +
+    'modification time of unchanged notes between builds.')
+@click.option(
+    '--no-check', is_flag=True,
+    help='Build the project without checking it for problems first.')
+@profile_options
+@click.pass_context
+def build(
+        ctx, directories, temp_dir, in_memory, compression_level,
+        reproducible, delta_from, jobs, chunk_size, max_memory, shards,
+        update, prune, stable_ids, no_check, profile, trace):
+    """Build Anki package files from panki projects.
+
+    The directory arguments are the project directories to build, and default
+    to the current directory. Glob patterns (e.g. `"projects/*"`) are expanded
+    to every matching directory. Several projects are built in parallel, in a
+    pool of `--jobs` processes, and the result of each build is reported as it
+    completes.
+
+    \b
+    $ panki build projects/spanish projects/german
+    $ panki build "projects/*" --jobs 4
+
+    On machines with slow disks, the `--in-memory` option can be used to build
+    the collection on tmpfs (`/dev/shm`, when available). The `--temp-dir`
+    option can be used to choose the scratch directory explicitly. Either way,
+    the finished collection is copied into the project's `build/` directory in
+    a single step before any packages are exported.
+
+    Packages are compressed with a compression level of 6 by default, which
+    can be changed with the `--compression-level` option. Media files that are
+    already compressed (images, audio, video, ...) are always stored as-is.
+
+    With the `--reproducible` option, building the same project twice yields
+    identical packages. IDs are derived from the note GUIDs and every
+    timestamp is set to the `SOURCE_DATE_EPOCH` environment variable or, if
+    it is not set, to the latest modification time of the project's files.
+    Packages whose contents have not changed are not rewritten.
+
+    Each build saves a manifest of the notes in its packages to
+    `build/manifest.json`. Given a copy of a previous build's manifest, the
+    `--delta-from` option also exports a delta package next to each deck
+    package (e.g. `deck.delta.apkg` next to `deck.apkg`), containing only the
+    notes that were added or modified since that build, and their media.
+
+    The `--profile` option reports how long each phase of the build took
+    (loading the project, adding each deck and note group, adding the media,
+    exporting each package, ...), along with its CPU time, the peak memory
+    used so far and the number of items it processed. The `--trace` option
+    also writes the phases to a Chrome trace event file, which can be opened
+    with chrome://tracing, Perfetto or speedscope.
+
+    \b
+    $ panki build --profile --trace build-trace.json
+
+    Projects are loaded in full before they are built. For projects with
+    millions of notes, the `--chunk-size` option reads each data file only
+    when its notes are added (streaming CSV and JSON Lines files), commits
+    the notes in batches and releases each data file's records once its notes
+    are added. The `--max-memory` option stops a chunked build with an error
+    once it uses more memory than the limit.
+
+    \b
+    $ panki build --chunk-size 10000 --max-memory 2048
+
+    The `--shards` option splits the notes into shards of about the same size
+    (splitting large note groups if needed) and adds each shard to its own
+    copy of the collection in a separate process. The shards' notes and cards
+    are then merged into the collection.
+
+    \b
+    $ panki build --shards 8
+
+    The `--update` option updates the collection left in `build/` by the
+    previous build (or any collection copied to `build/collection.anki2`)
+    instead of building a new one. Notes are matched by their GUID: new notes
+    are added, and existing notes are only written if their fields changed.
+    The `--prune` option also removes the notes of the project's note types
+    that are no longer in its data.
+
+    \b
+    $ panki build --update --prune
+
+    Anki gives new notes and cards IDs and modification times based on the
+    current time, so every build looks like a new set of edits. With the
+    `--stable-ids` option, note and card IDs are derived from the note GUIDs,
+    and a note keeps the modification time of the previous build (kept in
+    `.panki/notes.db`) until its fields, tags or note type change. Re-imported
+    packages then only update the notes that really changed.
+
+    Each project is checked like it is by `panki check` before anything is
+    built, and is not built if it has any problems. Only the columns of the
+    data files of chunked builds are checked (from their header or first
+    record), since their records are only read as their notes are added.
+    The `--no-check` option skips the check.
+    """
+    directories = expand_directories(directories or ['.'])
+    if in_memory and not temp_dir:
+        temp_dir = memory_temp_dir()
+    if max_memory and not chunk_size:
+        chunk_size = default_chunk_size
+    if prune and not update:
+        bad_param('prune', 'Notes can only be pruned with --update')
+    if update and shards and shards > 1:
+        bad_param('shards', 'A collection cannot be updated in shards')
+    options = dict(
+        temp_dir=temp_dir,
+        compression_level=compression_level,
+        reproducible=reproducible,
+        delta_from=delta_from,
+        chunk_size=chunk_size,
+        max_memory=max_memory,
+        shards=shards,
+        update=update,
+        prune=prune,
+        stable_ids=stable_ids
+    )
+    if len(directories) > 1:
+        if delta_from:
+            bad_param(
+                'delta_from',
+                'A manifest can only be used to build a single project')
+        if profile or trace:
+            bad_param('profile', 'Only a single project can be profiled')
+        build_many(ctx, directories, jobs, check=not no_check, **options)
+        return
+    with profiling('build', profile, trace) as profiler:
+        with profile_phase(profiler, 'load_project') as phase:
+            project = load_project_param(
+                directories[0],
+                lazy_data=bool(chunk_size)
+            )
+            if not chunk_size:
+                phase['count'] = count_records(project)
+        if not no_check:
+            with profile_phase(profiler, 'check_project'):
+                problems = validate_project(project)
+            for problem in problems:
+                click.echo(problem, err=True)
+            if problems:
+                click.echo(
+                    'Found {} problems, not building the project'.format(
+                        len(problems)
+                    ),
+                    err=True
+                )
+                ctx.exit(1)
+        build_project(project, profiler=profiler, **options)
+
+
+def count_records(project):
+    return sum(
+        len(data.file.contents)
+        for deck in project.decks
+        for note_group in deck.notes
+        for data in note_group.data
+    )
+
+
+def expand_directories(patterns):
+    directories = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) \
+            else [pattern]
+        matches = [path for path in matches if os.path.isdir(path)]
+        if not matches:
+            bad_param('directories', 'No such directory: {}'.format(pattern))
+        directories += [
+            path for path in matches if path not in directories
+        ]
+    return directories
+
+
+def build_many(ctx, directories, jobs, **options):
+    start = time.perf_counter()
+    failed = 0
+    for directory, elapsed, error in build_projects(
+            directories, max_workers=jobs, **options):
+        if error:
+            failed += 1
+            click.echo('{}: failed: {}'.format(directory, error), err=True)
+        else:
+            click.echo('{}: built in {:.2f}s'.format(directory, elapsed))
+    click.echo(
+        'Built {} of {} projects in {:.2f}s'.format(
+            len(directories) - failed,
+            len(directories),
+            time.perf_counter() - start
+        ),
+        err=True
+    )
+    if failed:
+        ctx.exit(1)
@@ -0,0 +1,54 @@
+import time
+import click
+from .cli import cli
+from ..config import load_project, validate_project
+from ..util import bad_param
+
+
+@cli.command()
+@click.argument('directory', default='.')
+@click.pass_context
+def check(ctx, directory):
+    """Check a panki project for problems without building it.
+
+    The directory argument is the project directory, and defaults to the
+    current directory. The project and its files are loaded, and checked for:
+
+    \b
+    - note groups with an unknown note type
+    - card types without a template
+    - templates that use fields their note type doesn't have
+    - data files without a column for each field of their note type
+    - records that are missing fields, or a value used by their GUID
+    - invalid GUID formats, and GUIDs used by more than one record
+
+    \b
+    $ panki check path/to/project
+
+    Each problem is printed on its own line, and the command exits with a
+    status of 1 if there are any. Anki is not loaded, so the check only takes
+    as long as reading the project's files. `panki build` runs the same check
+    before it builds a project.
+    """
+    start = time.perf_counter()
+    try:
+        project = load_project(directory)
+    except (OSError, ValueError) as ex:
+        problems = [str(ex)]
+    else:
+        if not project:
+            bad_param(
+                'directory',
+                'The directory does not contain a project config file')
+        problems = validate_project(project)
+    for problem in problems:
+        click.echo(problem)
+    click.echo(
+        'Found {} problems in {:.2f}s'.format(
+            len(problems),
+            time.perf_counter() - start
+        ),
+        err=True
+    )
+    if problems:
+        ctx.exit(1)
@@ -1,6 +1,8 @@
 import os
 import click
+from ..config import load_project
 from ..file import load_config_file
+from ..util import bad_param
 
 
 @click.group(invoke_without_command=True)
@@ -12,14 +14,27 @@ def cli(ctx, show_version):
     ctx.ensure_object(dict)
     current_dir = os.path.dirname(os.path.realpath(__file__))
     panki_dir = os.path.realpath(os.path.join(current_dir, '..'))
-    metadata_path = os.path.join(panki_dir, 'metadata', 'metadata.json')
-    metadata_file = load_config_file(metadata_path)
-    metadata = metadata_file.contents
     ctx.obj['panki_dir'] = panki_dir
-    ctx.obj['metadata'] = metadata
     if show_version:
+        # the metadata is only read when it is needed
+        metadata_path = os.path.join(panki_dir, 'metadata', 'metadata.json')
+        metadata = load_config_file(metadata_path).contents
+        ctx.obj['metadata'] = metadata
         name = ctx.info_name
         version = metadata.get('version')
         click.echo('{}, version {}'.format(name, version))
     elif not ctx.invoked_subcommand:
         click.echo(ctx.get_help())
+
+
+def load_project_param(directory, lazy_data=False):
+    """Load the project in a directory given as a command line argument."""
+    try:
+        project = load_project(directory, lazy_data=lazy_data)
+    except ValueError as ex:
+        bad_param('directory', str(ex))
+    if not project:
+        bad_param(
+            'directory',
+            'The directory does not contain a project config file')
+    return project
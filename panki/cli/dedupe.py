@@ -0,0 +1,62 @@
+import os
+import time
+import click
+from .cli import cli, load_project_param
+from ..dedupe import find_duplicates
+
+
+@cli.command()
+@click.argument('directory', default='.')
+@click.option(
+    '--threshold', type=click.FloatRange(0, 1), default=0.8,
+    help='The minimum similarity of near-duplicate records (defaults to 0.8).')
+@click.option(
+    '-j', '--jobs', type=click.IntRange(min=1),
+    help='The number of data files to read at the same time (defaults to ' +
+    'the number of CPUs).')
+def dedupe(directory, threshold, jobs):
+    """Find duplicate records across the data files of a panki project.
+
+    The directory argument is the project directory, and defaults to the
+    current directory. Records are exact duplicates if their text (the values
+    of all of their fields, ignoring case and whitespace) is the same, and
+    near duplicates if the similarity of their text is at least the
+    `--threshold`. Each cluster of duplicates is listed with the data file,
+    row number, deck and note type of its records.
+
+    \b
+    $ panki dedupe path/to/project
+    $ panki dedupe --threshold 0.6
+
+    Similar records are found with MinHash sketches and locality-sensitive
+    hashing rather than by comparing every pair of records, so the time taken
+    grows linearly with the number of records. Only the candidate pairs are
+    compared, and records that are barely similar enough may be missed. The
+    data files are read in parallel, in a pool of `--jobs` processes.
+    """
+    start = time.perf_counter()
+    project = load_project_param(directory, lazy_data=True)
+    records, clusters = find_duplicates(
+        project,
+        threshold=threshold,
+        max_workers=jobs
+    )
+    project_dir = os.path.dirname(project.file.path)
+    for cluster in clusters:
+        click.echo('{} duplicates ({} records):'.format(
+            'Exact' if cluster['exact'] else 'Near',
+            len(cluster['records'])
+        ))
+        for path, deck, note_type, row, preview in cluster['records']:
+            click.echo('  {}:{}: {} ({}): {}'.format(
+                os.path.relpath(path, project_dir), row, deck, note_type,
+                preview
+            ))
+    click.echo(
+        'Found {} clusters of duplicates among {} records in {:.2f}s'.format(
+            len(clusters),
+            records,
+            time.perf_counter() - start
+        ),
+        err=True
+    )
@@ -1,14 +1,29 @@
 import os
+import sqlite3
 import click
 from .cli import cli
+from .profiling import profile_options, profiling
+from ..collection import UnknownTablesError, dump_formats
 from ..package import dump_package, is_anki_package
-from ..util import bad_param
+from ..util import bad_param, multi_opt
 
 
 @cli.command()
 @click.argument('package', type=click.Path(dir_okay=False, exists=True))
 @click.argument('directory', type=click.Path(exists=False))
-def dump(package, directory):
+@click.option(
+    '--table', 'tables', **multi_opt(),
+    help='The name of a table to dump. Can be provided multiple times.')
+@click.option(
+    '--where', help='An SQL condition that dumped rows must match.')
+@click.option(
+    '--limit', type=click.IntRange(min=0),
+    help='The maximum number of rows to dump from each table.')
+@click.option(
+    '--format', type=click.Choice(sorted(dump_formats)), default='csv',
+    help='The format to dump table rows in.')
+@profile_options
+def dump(package, directory, tables, where, limit, format, profile, trace):
     """Dump the contents of an Anki package.
 
     The package argument is the path to an Anki .apkg file or an Anki .colpkg
@@ -17,11 +32,62 @@ def dump(package, directory):
     Make sure that the provided directory does not exist - panki will not
     overwrite existing directories.
 
+    Tables are dumped concurrently, and the number of rows dumped and the rows
+    per second are reported for each table.
+
     $ panki dump path/to/package.apkg path/to/dir
+
+    By default, every table is dumped. The `--table` option can be provided in
+    order to only dump specific tables:
+
+    \b
+    $ panki dump path/to/package.apkg path/to/dir \\
+        --table notes --table cards
+
+    The media files are only extracted when every table is dumped.
+
+    The `--where` and `--limit` options can be used to only dump some of the
+    rows of each table:
+
+    \b
+    $ panki dump path/to/package.apkg path/to/dir \\
+        --table notes --where "mid = 1234567890123" --limit 100
+
+    Rows are dumped to a `rows.csv` file by default. The `--format` option can
+    be used to dump them to a JSON Lines file (`jsonl`) or to a gzip
+    compressed SQLite database (`sqlite`) instead.
+
+    The `--profile` option reports the wall time, CPU time, peak memory and
+    row count of each phase of the dump, and `--trace` also writes them to a
+    Chrome trace event file.
     """
     if not is_anki_package(package):
         bad_param('package', 'The file is not an Anki .apkg or .colpkg file.')
     if os.path.exists(directory):
         bad_param('directory', 'The directory already exists.')
-    os.makedirs(directory)
-    dump_package(package, directory)
+    try:
+        with profiling('dump', profile, trace) as profiler:
+            dump_package(
+                package,
+                directory,
+                tables=tables,
+                where=where,
+                limit=limit,
+                format=format,
+                progress=report_progress,
+                profiler=profiler
+            )
+    except UnknownTablesError as ex:
+        bad_param('table', str(ex))
+    except sqlite3.OperationalError as ex:
+        bad_param('where', str(ex))
+
+
+def report_progress(table, rows, elapsed, done):
+    if done:
+        rate = rows / elapsed if elapsed > 0 else 0
+        click.echo(
+            '{}: {} rows in {:.2f}s ({:.0f} rows/s)'.format(
+                table, rows, elapsed, rate),
+            err=True
+        )
@@ -1,10 +1,12 @@
 import os
 import click
 from .cli import cli
+from .profiling import profile_options, profiling
 from ..collection import create_collection
 from ..package import export_package, is_anki_package, \
     is_anki_collection_package
-from ..util import bad_param
+from ..profiling import profile_phase
+from ..util import bad_param, source_date_epoch
 
 
 @cli.command()
@@ -13,7 +15,20 @@ from ..util import bad_param
 @click.argument('package_path', type=click.Path(exists=False))
 @click.option(
     '--deck', 'deck_id', help='The ID of a deck to export.')
-def export(collection_path, package_path, deck_id):
+@click.option(
+    '--all-media', is_flag=True,
+    help='Include all media files, not just the referenced ones.')
+@click.option(
+    '--compression-level', type=click.IntRange(0, 9), default=6,
+    help='Set the zip compression level of the package (0 stores files ' +
+    'without compression).')
+@click.option(
+    '--reproducible', is_flag=True,
+    help='Export a byte-for-byte reproducible package.')
+@profile_options
+def export(
+        collection_path, package_path, deck_id, all_media, compression_level,
+        reproducible, profile, trace):
     """Export an Anki collection into an Anki package.
 
     The collection path argument should be the path to an Anki collection file,
@@ -33,15 +48,41 @@ def export(collection_path, package_path, deck_id):
     \b
     $ panki export path/to/collection.anki2 path/to/package.apkg \\
         --deck 1234567890123
+
+    Only the media files referenced by the exported notes or by their note
+    types' templates and css are included in the package. The `--all-media`
+    option can be provided in order to include every media file instead.
+
+    The `--compression-level` option sets the zip compression level of the
+    package, from 0 (no compression) to 9. Media files that are already
+    compressed (images, audio, video, ...) are always stored as-is.
+
+    The `--reproducible` option exports the same package for the same notes,
+    note types and media. Every timestamp in the package is set to the
+    `SOURCE_DATE_EPOCH` environment variable or, if it is not set, to the
+    modification time of the collection file.
+
+    The `--profile` option reports the wall time, CPU time, peak memory and
+    item count of each phase of the export, and `--trace` also writes them to
+    a Chrome trace event file.
     """
     if not is_anki_package(package_path):
         bad_param('package_path', 'The file is not an Anki package file.')
     package_path = os.path.realpath(package_path)
-    collection = create_collection(collection_path)
     include_scheduling = is_anki_collection_package(package_path)
-    export_package(
-        collection,
-        package_path,
-        deck_id=deck_id,
-        include_scheduling=include_scheduling
-    )
+    timestamp = None
+    if reproducible:
+        timestamp = source_date_epoch([collection_path])
+    with profiling('export', profile, trace) as profiler:
+        with profile_phase(profiler, 'open_collection'):
+            collection = create_collection(collection_path)
+        export_package(
+            collection,
+            package_path,
+            deck_id=deck_id,
+            include_scheduling=include_scheduling,
+            prune_media=not all_media,
+            compression_level=compression_level,
+            timestamp=timestamp,
+            profiler=profiler
+        )
@@ -0,0 +1,38 @@
+import os
+import time
+import click
+from .cli import cli, load_project_param
+from ..search import index_path, update_index
+
+
+@cli.command()
+@click.argument('directory', default='.')
+def index(directory):
+    """Index the note data of a panki project for `panki search`.
+
+    The directory argument is the project directory, and defaults to the
+    current directory. The records of every data file are added to a SQLite
+    full-text (FTS5) index in `.panki/index.db`, along with their deck, note
+    type, data file and row number.
+
+    \b
+    $ panki index path/to/project
+
+    The index is updated incrementally: only the data files that changed
+    since they were last indexed (by modification time and contents) are
+    indexed again, and data files that are no longer in the project are
+    removed from the index.
+    """
+    start = time.perf_counter()
+    project = load_project_param(directory, lazy_data=True)
+    path = index_path(project)
+    sources, updated = update_index(project, path)
+    click.echo(
+        'Indexed {} of {} data files in {:.2f}s ({})'.format(
+            updated,
+            sources,
+            time.perf_counter() - start,
+            os.path.relpath(path)
+        ),
+        err=True
+    )
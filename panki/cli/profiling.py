@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+import click
+from ..profiling import Profiler
+
+
+def profile_options(command):
+    """Add the `--profile` and `--trace` options to a command."""
+    command = click.option(
+        '--trace', type=click.Path(dir_okay=False),
+        help='Profile the command and write a Chrome trace event file of ' +
+        'its phases (implies --profile).')(command)
+    command = click.option(
+        '--profile', is_flag=True,
+        help='Report the wall time, CPU time, peak memory and item count of ' +
+        'each phase of the command.')(command)
+    return command
+
+
+@contextmanager
+def profiling(name, profile, trace):
+    """Profile a command, if requested, and report its phases once it is done.
+
+    Yields the profiler, or None if the command isn't being profiled.
+    """
+    if not profile and not trace:
+        yield None
+        return
+    profiler = Profiler()
+    try:
+        with profiler.phase(name):
+            yield profiler
+    finally:
+        for line in profiler.summary():
+            click.echo(line, err=True)
+        if trace:
+            profiler.save_trace(trace)
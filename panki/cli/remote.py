@@ -0,0 +1,153 @@
+import os
+import click
+from .cli import cli
+from .dump import report_progress
+from ..collection import dump_formats
+from ..package import is_anki_package
+from ..server import RequestError, default_socket_path, send_request
+from ..util import bad_param, multi_opt
+
+
+@cli.group()
+@click.option(
+    '--socket', 'socket_path', type=click.Path(dir_okay=False),
+    help='The path to the Unix socket of the server.')
+@click.pass_context
+def remote(ctx, socket_path):
+    """Send requests to a panki server (see `panki serve`)."""
+    ctx.obj['socket_path'] = socket_path or default_socket_path()
+
+
+def request(ctx, command, **args):
+    try:
+        return send_request(ctx.obj['socket_path'], command, **args)
+    except OSError as ex:
+        raise click.ClickException(
+            'Could not connect to the server: {}'.format(ex.strerror or ex)
+        )
+    except RequestError as ex:
+        raise click.ClickException(str(ex))
+
+
+@remote.command('build')
+@click.argument(
+    'directory', type=click.Path(file_okay=False, exists=True), default='.')
+@click.option(
+    '--temp-dir', type=click.Path(file_okay=False, exists=True),
+    help='Build the collection in this directory.')
+@click.option(
+    '--compression-level', type=click.IntRange(0, 9), default=6,
+    help='Set the zip compression level of the packages.')
+@click.option(
+    '--reproducible', is_flag=True,
+    help='Build byte-for-byte reproducible packages.')
+@click.option(
+    '--delta-from', type=click.Path(dir_okay=False, exists=True),
+    help='Also export delta packages with the notes that changed since the ' +
+    'build with this manifest.')
+@click.option(
+    '--no-check', is_flag=True,
+    help='Build the project without checking it for problems first.')
+@click.pass_context
+def remote_build(
+        ctx, directory, temp_dir, compression_level, reproducible,
+        delta_from, no_check):
+    """Build a panki project on the server.
+
+    The options are the same as the options of `panki build`. The project is
+    checked like it is by `panki check` before it is built, and is not built
+    if it has any problems.
+    """
+    result = request(
+        ctx,
+        'build',
+        directory=os.path.abspath(directory),
+        temp_dir=temp_dir and os.path.abspath(temp_dir),
+        compression_level=compression_level,
+        reproducible=reproducible,
+        delta_from=delta_from and os.path.abspath(delta_from),
+        check=not no_check
+    )
+    for problem in result['problems']:
+        click.echo(problem, err=True)
+    if result['problems']:
+        click.echo(
+            'Found {} problems, not building the project'.format(
+                len(result['problems'])
+            ),
+            err=True
+        )
+        ctx.exit(1)
+
+
+@remote.command('validate')
+@click.argument(
+    'directory', type=click.Path(file_okay=False, exists=True), default='.')
+@click.pass_context
+def remote_validate(ctx, directory):
+    """Check a panki project on the server.
+
+    The project is checked like it is by `panki check`: every note group's
+    note type must exist, every record must have a value for each of the
+    note type's fields, and no two records may have the same GUID.
+    """
+    result = request(ctx, 'validate', directory=os.path.abspath(directory))
+    for problem in result['problems']:
+        click.echo(problem, err=True)
+    if result['problems']:
+        ctx.exit(1)
+
+
+@remote.command('dump')
+@click.argument('package', type=click.Path(dir_okay=False, exists=True))
+@click.argument('directory', type=click.Path(exists=False))
+@click.option(
+    '--table', 'tables', **multi_opt(),
+    help='The name of a table to dump. Can be provided multiple times.')
+@click.option(
+    '--where', help='An SQL condition that dumped rows must match.')
+@click.option(
+    '--limit', type=click.IntRange(min=0),
+    help='The maximum number of rows to dump from each table.')
+@click.option(
+    '--format', type=click.Choice(sorted(dump_formats)), default='csv',
+    help='The format to dump table rows in.')
+@click.pass_context
+def remote_dump(ctx, package, directory, tables, where, limit, format):
+    """Dump the contents of an Anki package on the server.
+
+    The arguments and options are the same as those of `panki dump`.
+    """
+    if not is_anki_package(package):
+        bad_param('package', 'The file is not an Anki .apkg or .colpkg file.')
+    if os.path.exists(directory):
+        bad_param('directory', 'The directory already exists.')
+    result = request(
+        ctx,
+        'dump',
+        package=os.path.abspath(package),
+        directory=os.path.abspath(directory),
+        tables=list(tables),
+        where=where,
+        limit=limit,
+        format=format
+    )
+    for table, rows, elapsed in result['tables']:
+        report_progress(table, rows, elapsed, True)
+
+
+@remote.command('status')
+@click.pass_context
+def remote_status(ctx):
+    """Show the server's process ID and the projects it has loaded."""
+    result = request(ctx, 'status')
+    click.echo('pid: {}'.format(result['pid']))
+    for project in result['projects']:
+        click.echo(project)
+
+
+@remote.command('stop')
+@click.pass_context
+def remote_stop(ctx):
+    """Stop the server."""
+    request(ctx, 'stop')
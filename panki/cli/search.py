@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import click
+from .cli import cli, load_project_param
+from ..search import index_path, search_index, update_index
+from ..util import bad_param
+
+
+@cli.command()
+@click.argument('query')
+@click.argument('directory', default='.')
+@click.option(
+    '--limit', type=click.IntRange(min=1), default=20,
+    help='The maximum number of records to show.')
+def search(query, directory, limit):
+    """Search the note data of a panki project.
+
+    The query argument is a SQLite full-text (FTS5) query, and the directory
+    argument is the project directory, which defaults to the current
+    directory. The project's index is updated first (see `panki index`), and
+    the best matching records are listed with their data file, row number,
+    deck and note type.
+
+    \b
+    $ panki search hydrogen
+    $ panki search "noble NEAR gas" path/to/project
+    $ panki search "helium OR neon" --limit 5
+    """
+    project = load_project_param(directory, lazy_data=True)
+    path = index_path(project)
+    update_index(project, path)
+    try:
+        results = search_index(path, query, limit=limit)
+    except sqlite3.OperationalError as ex:
+        bad_param('query', str(ex))
+    project_dir = os.path.dirname(project.file.path)
+    for source_path, deck, note_type, row, record in results:
+        click.echo('{}:{}: {} ({})'.format(
+            os.path.relpath(source_path, project_dir), row, deck, note_type
+        ))
+        for field, value in record.items():
+            click.echo('  {}: {}'.format(field, value))
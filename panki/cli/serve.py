@@ -0,0 +1,35 @@
+import click
+from .cli import cli
+from ..server import default_socket_path, serve as serve_requests
+from ..util import bad_param
+
+
+@cli.command()
+@click.option(
+    '--socket', 'socket_path', type=click.Path(dir_okay=False),
+    help='The path to the Unix socket to listen on.')
+@click.option(
+    '--idle-timeout', type=click.IntRange(min=0), default=600,
+    help='Forget projects that have not been used for this many seconds.')
+def serve(socket_path, idle_timeout):
+    """Serve build, validate and dump requests over a Unix socket.
+
+    The server keeps anki imported and keeps the projects it builds loaded, so
+    repeated builds only pay for loading the files that changed since the
+    previous request. Requests are sent with the `panki remote` commands.
+
+    $ panki serve &
+    $ panki remote build path/to/project
+
+    Several projects can be built at the same time, but requests for the same
+    project are handled one at a time. Projects that have not been used for
+    `--idle-timeout` seconds are forgotten.
+
+    The socket path defaults to the `PANKI_SOCKET` environment variable, or to
+    `panki.sock` in `$XDG_RUNTIME_DIR` (or the temporary directory). The
+    server runs until it receives a `panki remote stop` request.
+    """
+    try:
+        serve_requests(socket_path or default_socket_path(), idle_timeout)
+    except ValueError as ex:
+        bad_param('socket', str(ex))
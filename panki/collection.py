@@ -1,147 +1,1144 @@
 import base64
+import gc
+import gzip
+import hashlib
+import itertools
+import json
 import os
+import shutil
 import sqlite3
-import anki
-from .file import create_css_file, create_js_file, create_file
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .config import default_guid_format, load_project
+from .file import create_css_file, create_js_file, create_file, load_file
+from .media import hash_file, hash_media_files, link_file, \
+    load_media_manifest, media_file_name, save_media_manifest, scan_media_dirs
+from .profiling import current_rss, profile_phase
+from .util import stable_id, stable_id_end_before, stable_ids
 
 
-def build_collection(project):
-    build_dir = project.create_build_dir()
-    collection = create_collection(os.path.join(build_dir, 'collection.anki2'))
+def build_collection(
+        project, temp_dir=None, profiler=None, chunk_size=None,
+        max_memory=None, shards=None, update=False, prune=False,
+        stable_ids=False, timestamp=None):
+    """Build the project's collection in its build directory.
+
+    If `update` is true, the collection already in the build directory (if
+    any) is updated instead of building a new one: see `update_note`. If
+    `prune` is also true, the notes of the project's note types that are no
+    longer in its data are removed from the collection.
+
+    If `stable_ids` is true, the notes get stable IDs and modification times
+    once the collection is built: see `stabilize_notes`. New and modified
+    notes are stamped with the given timestamp, or the current time.
+    """
+    build_dir = project.create_build_dir(clean=not update)
+    collection_path = os.path.join(build_dir, 'collection.anki2')
+    notes = None
+    if update:
+        with profile_phase(profiler, 'index_notes') as phase:
+            notes = index_notes(collection_path) \
+                if os.path.exists(collection_path) else {}
+            phase['count'] = len(notes)
+    # optionally build in a scratch directory (e.g. on tmpfs) and persist the
+    # finished collection to the build directory with a single copy
+    work_dir = tempfile.mkdtemp(dir=temp_dir) if temp_dir else None
+    if work_dir and update and os.path.exists(collection_path):
+        copy_collection(
+            collection_path,
+            os.path.join(work_dir, 'collection.anki2')
+        )
+    with profile_phase(profiler, 'create_collection'):
+        collection = create_collection(
+            os.path.join(work_dir, 'collection.anki2') if work_dir
+            else collection_path
+        )
     try:
-        add_note_types(collection, project)
-        add_decks(collection, project)
-        add_media(collection, project)
+        with profile_phase(profiler, 'add_note_types') as phase:
+            fingerprints = add_note_types(collection, project)
+            phase['count'] = len(fingerprints)
+        options = dict(
+            profiler=profiler,
+            chunk_size=chunk_size,
+            max_memory=max_memory
+        )
+        with profile_phase(profiler, 'add_decks') as phase:
+            if shards and shards > 1 and not update:
+                phase['count'] = add_decks_in_shards(
+                    collection, project, shards, **options
+                )
+            else:
+                phase['count'] = add_decks(
+                    collection, project, notes=notes, **options
+                )
+        if update and prune:
+            with profile_phase(profiler, 'prune_notes') as phase:
+                phase['count'] = prune_notes(collection, project, notes)
+        with profile_phase(profiler, 'add_media') as phase:
+            phase['count'] = add_media(collection, project)
+        if work_dir:
+            with profile_phase(profiler, 'persist_collection'):
+                collection.close()
+                collection = persist_collection(collection, collection_path)
     except Exception as ex:
         raise ex
     finally:
-        collection.close()
+        with profile_phase(profiler, 'close_collection'):
+            collection.close()
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    keep_note_type_mods(collection_path, project, fingerprints)
+    if stable_ids:
+        with profile_phase(profiler, 'stabilize_notes'):
+            stabilize_notes(
+                collection_path,
+                project,
+                int(time.time()) if timestamp is None else timestamp
+            )
     return collection
 
 
 def create_collection(path):
+    import anki
     return anki.Collection(path)
 
 
+def persist_collection(collection, path):
+    """Copy a closed collection and its media to the given path.
+
+    Returns the collection opened from its new location.
+    """
+    copy_collection(collection.path, path)
+    return create_collection(path)
+
+
+def copy_collection(src_path, path):
+    media_dir = media_dir_path(src_path)
+    shutil.copyfile(src_path, path)
+    if os.path.isdir(media_dir):
+        shutil.copytree(media_dir, media_dir_path(path), dirs_exist_ok=True)
+
+
+def media_dir_path(collection_path):
+    return os.path.splitext(collection_path)[0] + '.media'
+
+
+def memory_temp_dir():
+    """Return a memory-backed temporary directory, if one is available."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
 def add_note_types(collection, project):
+    """Add the project's note types to the collection.
+
+    Each model is stored with a fingerprint of its fields, card types,
+    templates and css. Models that are already in the collection with the same
+    fingerprint are left untouched, and other existing models are updated in
+    place, so their schema only changes when fields or card types change.
+
+    Returns the fingerprint of each note type, by ID.
+    """
+    fingerprints = {}
     for note_type in project.note_types:
-        model = collection.models.new(note_type.name)
-        model['id'] = note_type.id
-        for field_name in note_type.fields:
-            field = collection.models.new_field(field_name)
+        fields, templates, css = render_note_type(note_type)
+        fingerprint = note_type_fingerprint(
+            note_type.name, fields, templates, css
+        )
+        fingerprints[note_type.id] = fingerprint
+        model = collection.models.get(note_type.id)
+        if model and model.get('pankiFingerprint') == fingerprint:
+            continue
+        if model:
+            # anki matches fields and templates by their original position
+            # (`ord`), so the existing ones are reused by name and the schema
+            # only changes if some are added, removed or reordered
+            existing_fields = {field['name']: field for field in model['flds']}
+            existing_templates = {
+                template['name']: template for template in model['tmpls']
+            }
+            model['name'] = note_type.name
+            model['flds'] = []
+            model['tmpls'] = []
+        else:
+            model = collection.models.new(note_type.name)
+            model['id'] = note_type.id
+            existing_fields = existing_templates = {}
+        for name in fields:
+            field = existing_fields.get(name) or \
+                collection.models.new_field(name)
             collection.models.add_field(model, field)
-        combined_css_file = create_css_file('combined.css', [])
-        for css in note_type.css:
-            combined_css_file.contents += css.file.contents
-        common_js_file = create_js_file('common.js', [])
-        for js in note_type.js:
-            common_js_file.contents += js.file.contents
-        for card_type in note_type.card_types:
-            template = collection.models.new_template(card_type.name)
-            template_file = card_type.template.file
-            # add the js code in the template
-            combined_js_file = create_js_file('combined.js', [])
-            combined_js_file.contents += ['<script>']
-            combined_js_file.contents += common_js_file.contents
-            combined_js_file.contents += template_file.script
-            combined_js_file.contents += ['</script>']
-            combined_js_file.prettify()
-            # prepend front with js code
-            front = template_file.front
-            front = combined_js_file.contents + front
-            template['qfmt'] = '\n'.join(front)
-            template['afmt'] = '\n'.join(template_file.back)
+        for name, front, back in templates:
+            template = existing_templates.get(name) or \
+                collection.models.new_template(name)
+            template['qfmt'] = front
+            template['afmt'] = back
             collection.models.add_template(model, template)
-            combined_css_file.contents += template_file.style
-        combined_css_file.prettify()
-        model['css'] = '\n'.join(combined_css_file.contents)
+        model['css'] = css
+        model['pankiFingerprint'] = fingerprint
         collection.models.save(model)
+    return fingerprints
+
 
+def render_note_type(note_type):
+    """Return the field names, templates and css of a note type's model.
 
-def add_decks(collection, project):
+    Templates are (name, front, back) tuples.
+    """
+    combined_css_file = create_css_file('combined.css', [])
+    for css in note_type.css:
+        combined_css_file.contents += css.file.contents
+    common_js_file = create_js_file('common.js', [])
+    for js in note_type.js:
+        common_js_file.contents += js.file.contents
+    templates = []
+    for card_type in note_type.card_types:
+        template_file = card_type.template.file
+        # add the js code in the template
+        combined_js_file = create_js_file('combined.js', [])
+        combined_js_file.contents += ['<script>']
+        combined_js_file.contents += common_js_file.contents
+        combined_js_file.contents += template_file.script
+        combined_js_file.contents += ['</script>']
+        combined_js_file.prettify()
+        # prepend front with js code
+        front = combined_js_file.contents + template_file.front
+        templates.append((
+            card_type.name,
+            '\n'.join(front),
+            '\n'.join(template_file.back)
+        ))
+        combined_css_file.contents += template_file.style
+    combined_css_file.prettify()
+    css = '\n'.join(combined_css_file.contents)
+    return list(note_type.fields), templates, css
+
+
+def note_type_fingerprint(name, fields, templates, css):
+    contents = json.dumps(
+        [name, fields, [list(template) for template in templates], css],
+        separators=(',', ':')
+    )
+    return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+def keep_note_type_mods(path, project, fingerprints):
+    """Keep the modification time of the note types that haven't changed.
+
+    A new collection stamps every model with the time it was built, and Anki
+    replaces its copy of a model (which needs a full sync) whenever a package
+    with a newer model is imported. The fingerprint and modification time of
+    each note type are kept in the project's cache, and the models of a closed
+    collection get back their previous modification time if their fingerprint
+    is the same as in the last build.
+    """
+    manifest_path = os.path.join(
+        project.create_cache_dir(), 'note-types.json'
+    )
+    manifest = {}
+    if os.path.exists(manifest_path):
+        manifest = load_file(manifest_path).contents
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            mods = dict(conn.execute('SELECT id, mtime_secs FROM notetypes'))
+            for id, fingerprint in fingerprints.items():
+                entry = manifest.get(str(id))
+                if entry and entry['fingerprint'] == fingerprint:
+                    conn.execute(
+                        'UPDATE notetypes SET mtime_secs = ? WHERE id = ?',
+                        (entry['mod'], id)
+                    )
+                elif id in mods:
+                    manifest[str(id)] = {
+                        'fingerprint': fingerprint,
+                        'mod': mods[id]
+                    }
+    finally:
+        conn.close()
+    manifest = {
+        id: entry for id, entry in manifest.items()
+        if int(id) in fingerprints
+    }
+    create_file(manifest_path, manifest).write()
+
+
+def add_decks(
+        collection, project, profiler=None, chunk_size=None, max_memory=None,
+        notes=None):
+    """Add the project's decks and their notes to the collection.
+
+    If a chunk size is provided, the notes are committed in batches of that
+    many notes, and each data file's records are released once its notes are
+    added (so the project's data files should be loaded lazily). If the
+    process uses more than `max_memory` megabytes after a batch, the build is
+    stopped with a `MemoryError`.
+
+    If an index of the collection's notes is provided (see `index_notes`),
+    the notes that are already in the collection are updated instead of
+    added, and are removed from the index.
+
+    Returns the number of notes added or updated.
+    """
+    total = 0
     for deck_config in project.decks:
-        deck_id = collection.decks.id(deck_config.name)
+        with profile_phase(
+                profiler, 'deck: ' + deck_config.name) as deck_phase:
+            count = add_deck(
+                collection,
+                deck_config,
+                profiler=profiler,
+                chunk_size=chunk_size,
+                max_memory=max_memory,
+                notes=notes
+            )
+            deck_phase['count'] = count
+            total += count
+    return total
+
+
+def add_deck(
+        collection, deck_config, profiler=None, chunk_size=None,
+        max_memory=None, notes=None):
+    create_deck(collection, deck_config)
+    total = 0
+    for note_group in deck_config.notes:
+        with profile_phase(
+                profiler, 'notes: ' + note_group.type) as phase:
+            count = add_notes(
+                collection,
+                deck_config,
+                note_group,
+                chunk_size=chunk_size,
+                max_memory=max_memory,
+                notes=notes
+            )
+            phase['count'] = count
+            total += count
+    return total
+
+
+def create_deck(collection, deck_config):
+    deck = collection.decks.get(deck_config.id, default=False)
+    if deck:
+        # the deck is already in the collection that is being updated
+        if deck['name'] != deck_config.name:
+            add_parent_decks(collection, deck_config.name)
+            collection.decks.rename(deck, deck_config.name)
+        return
+    add_parent_decks(collection, deck_config.name)
+    deck_id = collection.decks.id(deck_config.name)
+    deck = collection.decks.get(deck_id)
+    # hack to create a deck with the correct ID:
+    collection.decks.rem(deck_id)
+    deck['id'] = deck_config.id
+    collection.decks.update(deck)
+
+
+def add_notes(
+        collection, deck_config, note_group, chunk_size=None,
+        max_memory=None, notes=None):
+    count = 0
+    for data in note_group.data:
+        count += add_records(
+            collection,
+            deck_config,
+            note_group,
+            data.file.iter_records(),
+            chunk_size=chunk_size,
+            max_memory=max_memory,
+            notes=notes
+        )
+        if chunk_size:
+            # the records are no longer needed once their notes are added
+            data.file.contents = []
+    return count
+
+
+def add_records(
+        collection, deck_config, note_group, records, chunk_size=None,
+        max_memory=None, notes=None):
+    model = collection.models.byName(note_group.type)
+    collection.models.setCurrent(model)
+    guid_format = note_group.guid or \
+        default_guid_format(model['flds'][0]['name'])
+    field_names = [field['name'] for field in model['flds']]
+    count = 0
+    for record in records:
+        values = [record[name] for name in field_names]
+        guid = guid_format.format(
+            **record,
+            __DeckID__=deck_config.id,
+            __NoteTypeID__=model['id']
+        )
+        guid = base64.b64encode(guid.encode('utf-8'))
+        existing = notes.pop(guid.decode('ascii'), None) \
+            if notes is not None else None
+        if not existing or not update_note(
+                collection, existing, model['id'], deck_config.id, values):
+            note = collection.newNote()
+            for name, value in zip(field_names, values):
+                note[name] = value
+            note.guid = guid
+            collection.add_note(note, deck_config.id)
+        count += 1
+        if chunk_size and count % chunk_size == 0:
+            commit_notes(collection, max_memory)
+    if chunk_size:
+        commit_notes(collection, max_memory)
+    return count
+
+
+def index_notes(path):
+    """Index the notes of a (closed) collection file by GUID.
+
+    Each note is indexed as a `(note_id, note_type_id, deck_id, digest)`
+    tuple, where `deck_id` is the deck of its first card and `digest` is a
+    hash of its fields. The notes are read straight from the database, one
+    row at a time, rather than all at once through anki.
+    """
+    conn = connect_read_only(path)
+    try:
+        return {
+            guid: (note_id, note_type_id, deck_id, fields_digest(fields))
+            for note_id, guid, note_type_id, deck_id, fields in conn.execute(
+                'SELECT n.id, n.guid, n.mid, min(c.did), n.flds FROM notes n '
+                'LEFT JOIN cards c ON c.nid = n.id GROUP BY n.id'
+            )
+        }
+    finally:
+        conn.close()
+
+
+def fields_digest(fields):
+    # anki stores a note's fields joined by the unit separator
+    return hashlib.sha1(fields.encode('utf-8')).digest()
+
+
+def update_note(collection, existing, note_type_id, deck_id, values):
+    """Update an indexed note with a record's field values.
+
+    The note is only written if its fields changed, and its cards are only
+    moved if it is in another deck. A note of another note type is removed,
+    and False is returned so that a new note replaces it.
+    """
+    note_id, old_note_type_id, old_deck_id, digest = existing
+    if old_note_type_id != note_type_id:
+        collection.remove_notes([note_id])
+        return False
+    if fields_digest('\x1f'.join(values)) != digest:
+        note = collection.getNote(note_id)
+        note.fields = list(values)
+        note.flush()
+    if old_deck_id != deck_id:
+        card_ids = collection.db.list(
+            'SELECT id FROM cards WHERE nid = ?', note_id
+        )
+        collection.set_deck(card_ids, deck_id)
+    return True
+
+
+def prune_notes(collection, project, notes):
+    """Remove the indexed notes of the project's note types.
+
+    Returns the number of notes removed.
+    """
+    note_type_ids = {note_type.id for note_type in project.note_types}
+    note_ids = [
+        note_id for note_id, note_type_id, _, _ in notes.values()
+        if note_type_id in note_type_ids
+    ]
+    if note_ids:
+        collection.remove_notes(note_ids)
+    return len(note_ids)
+
+
+def commit_notes(collection, max_memory=None):
+    collection.save()
+    if not max_memory or current_rss() <= max_memory * 1024:
+        return
+    gc.collect()
+    rss = current_rss()
+    if rss > max_memory * 1024:
+        raise MemoryError(
+            'the build is using {:.0f}MB of memory, more than the {}MB '
+            'limit'.format(rss / 1024, max_memory)
+        )
+
+
+def add_decks_in_shards(
+        collection, project, shards, profiler=None, chunk_size=None,
+        max_memory=None):
+    """Add the project's decks and their notes to the collection in parallel.
+
+    The records are split into shards of about the same size, splitting large
+    note groups if needed. Each shard is added to its own copy of the
+    collection (with the note types and decks) by a worker process, and the
+    copies' notes and cards are then merged into the collection.
+
+    Returns the number of notes added.
+    """
+    # multiprocessing is slow to import, and is rarely needed
+    from concurrent.futures import ProcessPoolExecutor
+    for deck_config in project.decks:
+        create_deck(collection, deck_config)
+    tasks = split_records(project, shards)
+    if not tasks:
+        return 0
+    collection.close()
+    project_dir = os.path.dirname(project.file.path)
+    shard_dir = tempfile.mkdtemp(dir=os.path.dirname(collection.path))
+    paths = [
+        os.path.join(shard_dir, 'shard{}.anki2'.format(i))
+        for i in range(len(tasks))
+    ]
+    try:
+        with profile_phase(profiler, 'add_shards') as phase:
+            with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+                futures = [
+                    executor.submit(
+                        build_shard, project_dir, collection.path, path,
+                        shard_tasks, chunk_size=chunk_size,
+                        max_memory=max_memory
+                    )
+                    for path, shard_tasks in zip(paths, tasks)
+                ]
+                count = sum(future.result() for future in futures)
+            phase['count'] = count
+        with profile_phase(profiler, 'merge_shards') as phase:
+            next_position = merge_collections(collection.path, paths)
+            phase['count'] = len(paths)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        collection.reopen()
+    collection.set_config('nextPos', next_position)
+    return count
+
+
+def split_records(project, shards):
+    """Split the records of a project's data files into shards.
+
+    Returns a list of up to `shards` shards, each a list of `(deck, note
+    group, data file, start, stop)` tuples, where the first three are indexes
+    into the project's decks, the deck's note groups and the note group's
+    data files, and `start` and `stop` delimit a range of records.
+    """
+    files = []
+    for i, deck_config in enumerate(project.decks):
+        for j, note_group in enumerate(deck_config.notes):
+            for k, data in enumerate(note_group.data):
+                count = len(data.file.contents) or \
+                    sum(1 for _ in data.file.iter_records())
+                files.append(((i, j, k), count))
+    total = sum(count for _, count in files)
+    size = max(-(-total // shards), 1)
+    result = [[]]
+    room = size
+    for key, count in files:
+        start = 0
+        while start < count:
+            if room == 0:
+                result.append([])
+                room = size
+            stop = min(count, start + room)
+            result[-1].append(key + (start, stop))
+            room -= stop - start
+            start = stop
+    return [shard for shard in result if shard]
+
+
+def build_shard(
+        project_dir, base_path, path, tasks, chunk_size=None,
+        max_memory=None):
+    """Add a shard of a project's records to a copy of a collection."""
+    shutil.copyfile(base_path, path)
+    project = load_project(project_dir, lazy_data=True)
+    collection = create_collection(path)
+    try:
+        count = 0
+        for i, j, k, start, stop in tasks:
+            deck_config = project.decks[i]
+            note_group = deck_config.notes[j]
+            data = note_group.data[k]
+            count += add_records(
+                collection,
+                deck_config,
+                note_group,
+                itertools.islice(data.file.iter_records(), start, stop),
+                chunk_size=chunk_size,
+                max_memory=max_memory
+            )
+    finally:
+        collection.close()
+    return count
+
+
+def merge_collections(path, shard_paths):
+    """Merge the notes, cards and tags of closed shard collections into a
+    closed collection.
+
+    The shards' note and card IDs are shifted past the collection's if they
+    overlap, and their new cards' positions continue after the collection's.
+    Returns the next new card position.
+    """
+    conn = sqlite3.connect(file_uri(path), uri=True)
+    # anki's indexes use a case-insensitive collation of its own
+    conn.create_collation('unicase', unicase)
+    try:
+        for shard_path in shard_paths:
+            conn.execute(
+                'ATTACH DATABASE ? AS shard',
+                (read_only_uri(shard_path),)
+            )
+            note_offset = id_offset(conn, 'notes')
+            card_offset = id_offset(conn, 'cards')
+            (position,), = conn.execute(
+                'SELECT coalesce(max(due), 0) FROM main.cards WHERE type = 0'
+            )
+            merge_table(conn, 'notes', {
+                'id': 'id + {:d}'.format(note_offset)
+            })
+            merge_table(conn, 'cards', {
+                'id': 'id + {:d}'.format(card_offset),
+                'nid': 'nid + {:d}'.format(note_offset),
+                'due': 'CASE WHEN type = 0 THEN due + {:d} ELSE due END'
+                .format(position)
+            })
+            if has_table(conn, 'shard', 'tags'):
+                conn.execute(
+                    'INSERT OR IGNORE INTO main.tags SELECT * FROM shard.tags'
+                )
+            conn.commit()
+            conn.execute('DETACH DATABASE shard')
+        (position,), = conn.execute(
+            'SELECT coalesce(max(due), 0) FROM cards WHERE type = 0'
+        )
+    finally:
+        conn.close()
+    return position + 1
+
+
+def merge_table(conn, name, expressions):
+    table = quote_identifier(name)
+    columns = [
+        row[1] for row in
+        conn.execute('PRAGMA main.table_info({})'.format(table))
+    ]
+    conn.execute('INSERT INTO main.{0} ({1}) SELECT {2} FROM shard.{0}'.format(
+        table,
+        ', '.join(map(quote_identifier, columns)),
+        ', '.join(
+            expressions.get(column, quote_identifier(column))
+            for column in columns
+        )
+    ))
+
+
+def id_offset(conn, name):
+    table = quote_identifier(name)
+    (main_max,), = conn.execute('SELECT max(id) FROM main.' + table)
+    (shard_min,), = conn.execute('SELECT min(id) FROM shard.' + table)
+    if main_max is None or shard_min is None or shard_min > main_max:
+        return 0
+    return main_max - shard_min + 1
+
+
+def has_table(conn, schema, name):
+    (count,), = conn.execute(
+        'SELECT count(*) FROM {}.sqlite_master '
+        "WHERE type = 'table' AND name = ?".format(schema),
+        (name,)
+    )
+    return count > 0
+
+
+def unicase(a, b):
+    a, b = a.casefold(), b.casefold()
+    return (a > b) - (a < b)
+
+
+def add_parent_decks(collection, name):
+    # anki creates missing parent decks with IDs based on the current time,
+    # so create them up front with IDs derived from their names instead
+    names = [part.strip() for part in name.split('::')]
+    for i in range(1, len(names)):
+        parent_name = '::'.join(names[:i])
+        if collection.decks.byName(parent_name):
+            continue
+        deck_id = collection.decks.id(parent_name)
         deck = collection.decks.get(deck_id)
-        # hack to create a deck with the correct ID:
         collection.decks.rem(deck_id)
-        deck['id'] = deck_config.id
+        deck['id'] = stable_id('deck', parent_name)
         collection.decks.update(deck)
-        for note_group in deck_config.notes:
-            model = collection.models.byName(note_group.type)
-            collection.models.setCurrent(model)
-            guid_format = note_group.guid
-            if not guid_format:
-                first_field_name = model['flds'][0]['name']
-                guid_format = (
-                    '{__DeckID__}:' +
-                    '{__NoteTypeID__}:' +
-                    '{{{}}}'.format(first_field_name)
-                )
-            for data in note_group.data:
-                for record in data.file.contents:
-                    note = collection.newNote()
-                    for field in model['flds']:
-                        note[field['name']] = record[field['name']]
-                    guid = guid_format.format(
-                        **record,
-                        __DeckID__=deck_config.id,
-                        __NoteTypeID__=model['id']
-                    )
-                    note.guid = base64.b64encode(guid.encode('utf-8'))
-                    collection.add_note(note, deck_config.id)
 
 
 def add_media(collection, project):
-    # add all files in media directories
-    for media_dir in project.media:
-        media_dir_path = project.resolve_path(media_dir)
-        for file in os.listdir(media_dir_path):
-            file_path = os.path.join(media_dir_path, file)
-            collection.media.add_file(file_path)
+    """Add the files in the project's media directories to the collection.
+
+    Returns the number of media files.
+    """
+    if not project.media:
+        return 0
+    manifest_path = os.path.join(project.create_cache_dir(), 'media.json')
+    manifest = load_media_manifest(manifest_path)
+    # add all files in media directories (and their subdirectories)
+    entries = list(scan_media_dirs(
+        project.resolve_path(media_dir) for media_dir in project.media
+    ))
+    hashes = hash_media_files(entries, manifest)
+    collection_media_dir = collection.media.dir()
+    added = {}
+    placed = {}
+    for entry in entries:
+        name = media_file_name(entry.path)
+        digest = hashes[entry.path]
+        if name in added:
+            if added[name] != digest:
+                # let anki pick a unique name for conflicting files
+                collection.media.add_file(entry.path)
+            continue
+        added[name] = digest
+        path = os.path.join(collection_media_dir, name)
+        if os.path.exists(path):
+            if hash_file(path) == digest:
+                placed.setdefault(digest, path)
+                continue
+            os.unlink(path)
+        # files with identical contents share a single copy on disk
+        link_file(placed.get(digest, entry.path), path)
+        placed.setdefault(digest, path)
+    save_media_manifest(manifest_path, manifest, set(hashes))
+    return len(entries)
+
+
+def normalize_collection(path, timestamp, keep_note_mods=False):
+    """Rewrite a closed (schema 11) collection file so it is reproducible.
+
+    Anki stamps notes, cards, decks and note types with the time they were
+    created or modified, and note and card IDs are derived from the creation
+    time. This replaces the IDs with ones derived from the note GUIDs, every
+    modification time with the given timestamp (in seconds), drops note types
+    that no note uses (such as Anki's default "Basic" note type), serializes
+    the collection's JSON columns with sorted keys and finally copies the
+    database into a fresh file.
+
+    If `keep_note_mods` is true, the modification times of the notes and
+    cards are kept, e.g. when they were already made stable by
+    `stabilize_notes`.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            normalize_notes(conn, timestamp, keep_mods=keep_note_mods)
+            normalize_col(conn, timestamp)
+    finally:
+        conn.close()
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+    copy_database(path, temp_path)
+    os.replace(temp_path, path)
+
 
+def copy_database(src_path, path):
+    """Copy a database into a new file, one table at a time.
 
-def dump_collection(collection, path):
-    # connect to the collection
+    Unlike a copy of the file (or `VACUUM INTO`), the new file does not
+    depend on the history of the source database, only on its contents.
+    """
+    conn = sqlite3.connect(
+        file_uri(path),
+        uri=True
+    )
+    try:
+        conn.execute('ATTACH DATABASE ? AS src', (read_only_uri(src_path),))
+        (user_version,), = conn.execute('PRAGMA src.user_version')
+        schema = conn.execute(
+            'SELECT type, name, sql FROM src.sqlite_master '
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'table' DESC, rowid"
+        ).fetchall()
+        for type, name, sql in schema:
+            conn.execute(sql)
+            if type == 'table':
+                table = quote_identifier(name)
+                conn.execute(
+                    'INSERT INTO main.{0} SELECT * FROM src.{0}'.format(table)
+                )
+        conn.execute('PRAGMA user_version = {:d}'.format(user_version))
+        conn.commit()
+        conn.execute('DETACH DATABASE src')
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def stabilize_notes(path, project, timestamp):
+    """Give the notes of a closed collection stable IDs and modification times.
+
+    Note and card IDs are derived from the note GUIDs, as in reproducible
+    packages, and are dated before the given timestamp (in seconds). A note
+    keeps the modification time it had in the last build as long as its note
+    type, fields and tags are the same, and is otherwise stamped with the
+    timestamp, as are its new cards. The hash and modification time of each
+    note are kept in the project's cache.
+    """
+    cache_path = os.path.join(project.create_cache_dir(), 'notes.db')
+    conn = sqlite3.connect(path)
+    conn.create_collation('unicase', unicase)
+    conn.create_function('note_digest', 3, note_digest, deterministic=True)
+    try:
+        conn.execute('ATTACH DATABASE ? AS cache', (cache_path,))
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache.notes ('
+                'guid TEXT PRIMARY KEY, digest BLOB, mod INTEGER'
+                ') WITHOUT ROWID'
+            )
+            stabilize_note_ids(conn, timestamp)
+            conn.execute(
+                'UPDATE notes SET mod = coalesce((SELECT c.mod '
+                'FROM cache.notes c WHERE c.guid = notes.guid '
+                'AND c.digest = note_digest(notes.mid, notes.flds, notes.tags)'
+                '), ?)',
+                (timestamp,)
+            )
+            # reviewed cards keep their own modification time
+            conn.execute(
+                'UPDATE cards SET mod = '
+                '(SELECT mod FROM notes WHERE notes.id = cards.nid) '
+                'WHERE type = 0'
+            )
+            conn.execute('DELETE FROM cache.notes')
+            conn.execute(
+                'INSERT INTO cache.notes '
+                'SELECT guid, note_digest(mid, flds, tags), mod FROM notes'
+            )
+    finally:
+        conn.close()
+
+
+def note_digest(note_type_id, fields, tags):
+    return fields_digest('\x1f'.join((str(note_type_id), fields, tags)))
+
+
+def normalize_notes(conn, timestamp, keep_mods=False):
+    stabilize_note_ids(conn, timestamp)
+    if not keep_mods:
+        conn.execute('UPDATE notes SET mod = ?', (timestamp,))
+        conn.execute('UPDATE cards SET mod = ?', (timestamp,))
+
+
+def stabilize_note_ids(conn, timestamp):
+    # the IDs are creation times, so they are kept before the timestamp
+    end = stable_id_end_before(timestamp)
+    guids = dict(conn.execute('SELECT id, guid FROM notes'))
+    note_ids = stable_ids(
+        [(guid,) for guid in guids.values()],
+        end=end
+    )
+    cards = conn.execute('SELECT id, nid, ord FROM cards').fetchall()
+    card_ids = stable_ids(
+        ((guids[nid], ord) for _, nid, ord in cards if nid in guids),
+        end=end
+    )
+    conn.execute('CREATE TEMP TABLE note_ids (old INTEGER, new INTEGER)')
+    conn.executemany('INSERT INTO note_ids VALUES (?, ?)', (
+        (id, note_ids[(guid,)]) for id, guid in guids.items()
+    ))
+    conn.execute('CREATE TEMP TABLE card_ids (old INTEGER, new INTEGER)')
+    conn.executemany('INSERT INTO card_ids VALUES (?, ?)', (
+        (id, card_ids[(guids[nid], ord)])
+        for id, nid, ord in cards if nid in guids
+    ))
+    # negate the IDs first so the new IDs never clash with the old ones
+    for table, ids in (('notes', 'note_ids'), ('cards', 'card_ids')):
+        conn.execute('UPDATE {} SET id = -id'.format(table))
+        conn.execute(
+            'UPDATE {0} SET id = coalesce('
+            '(SELECT new FROM {1} WHERE old = -{0}.id), -id)'.format(
+                table, ids
+            )
+        )
+    conn.execute(
+        'UPDATE cards SET nid = coalesce('
+        '(SELECT new FROM note_ids WHERE old = cards.nid), nid)'
+    )
+    conn.execute(
+        'UPDATE revlog SET cid = coalesce('
+        '(SELECT new FROM card_ids WHERE old = revlog.cid), cid)'
+    )
+    conn.execute('DROP TABLE note_ids')
+    conn.execute('DROP TABLE card_ids')
+
+
+def normalize_col(conn, timestamp):
+    row = conn.execute(
+        'SELECT conf, models, decks, dconf, tags FROM col'
+    ).fetchone()
+    conf, models, decks, dconf, tags = (json.loads(value) for value in row)
+    used = {
+        str(mid) for mid, in conn.execute('SELECT DISTINCT mid FROM notes')
+    }
+    models = {id: model for id, model in models.items() if id in used}
+    for value in (*models.values(), *decks.values(), *dconf.values()):
+        value['mod'] = timestamp
+    if models and str(conf.get('curModel')) not in models:
+        conf['curModel'] = int(min(models, key=int))
+    values = [
+        json.dumps(value, sort_keys=True, separators=(',', ':'))
+        for value in (conf, models, decks, dconf, tags)
+    ]
+    conn.execute(
+        'UPDATE col SET mod = ?, scm = ?, ls = 0, conf = ?, models = ?, '
+        'decks = ?, dconf = ?, tags = ?',
+        (timestamp * 1000, timestamp * 1000, *values)
+    )
+    # the creation time anchors review due dates, so only unscheduled
+    # collections get a fixed one
+    scheduled = conn.execute(
+        'SELECT 1 FROM cards WHERE type != 0 UNION SELECT 1 FROM revlog'
+    ).fetchone()
+    if not scheduled:
+        crt = timestamp - timestamp % 86400
+        conn.execute('UPDATE col SET crt = ?', (crt,))
+
+
+dump_formats = {
+    'csv': 'rows.csv',
+    'jsonl': 'rows.jsonl',
+    'sqlite': 'rows.sqlite.gz'
+}
+
+
+def dump_collection(collection, path, **kwargs):
     collection.close()
-    conn = sqlite3.connect(collection.path)
-    conn.row_factory = sqlite3.Row
-    # get table info
+    dump_database(collection.path, path, **kwargs)
+
+
+class UnknownTablesError(ValueError):
+    """Raised when tables to dump are not in the collection."""
+
+    def __init__(self, tables):
+        super().__init__('unknown tables: {}'.format(', '.join(tables)))
+        self.tables = tables
+
+
+def dump_database(
+        collection_path, path, tables=None, where=None, limit=None,
+        format='csv', chunk_size=1000, max_workers=None, progress=None,
+        profiler=None):
+    """Dump the tables of a collection database file."""
+    if format not in dump_formats:
+        raise ValueError('unsupported dump format: {}'.format(format))
+    table_infos = select_tables(collection_path, tables)
     tables_dir = os.path.join(path, 'tables')
     os.makedirs(tables_dir)
-    cursor = conn.execute("SELECT * FROM sqlite_master WHERE type='table';")
-    tables = [dict(row) for row in cursor]
-    cursor.close()
-    # dump each table
-    for table in tables:
-        if table['name'].startswith('sqlite'):
-            continue
-        table_dir = os.path.join(tables_dir, table['name'])
-        os.makedirs(table_dir)
-        # dump table info
-        schema = table['sql'] + ';'
-        del table['sql']
-        table_file = create_file(
-            path=os.path.join(table_dir, 'table.json'),
-            contents=table
+    # dump each table concurrently, each over its own connection
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                dump_table, collection_path, table, tables_dir, where=where,
+                limit=limit, format=format, chunk_size=chunk_size,
+                progress=progress, profiler=profiler
+            )
+            for table in table_infos
+        ]
+        for future in futures:
+            future.result()
+
+
+def select_tables(collection_path, tables=None):
+    """Return the info of a collection's tables (or the given tables).
+
+    Raises an `UnknownTablesError` if any of the given tables are not in the
+    collection.
+    """
+    conn = connect_read_only(collection_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.execute(
+            "SELECT * FROM sqlite_master WHERE type='table';"
         )
-        table_file.write()
-        schema_file = create_file(
-            path=os.path.join(table_dir, 'schema.sql'),
-            contents=schema
+        table_infos = [dict(row) for row in cursor]
+    finally:
+        conn.close()
+    table_infos = [
+        table for table in table_infos
+        if not table['name'].startswith('sqlite')
+    ]
+    if tables:
+        names = [table['name'] for table in table_infos]
+        unknown = [name for name in tables if name not in names]
+        if unknown:
+            raise UnknownTablesError(unknown)
+        table_infos = [
+            table for table in table_infos
+            if table['name'] in tables
+        ]
+    return table_infos
+
+
+def dump_table(
+        collection_path, table, tables_dir, where=None, limit=None,
+        format='csv', chunk_size=1000, progress=None, profiler=None):
+    with profile_phase(profiler, 'table: ' + table['name']) as phase:
+        phase['count'] = dump_table_rows(
+            collection_path, table, tables_dir, where=where, limit=limit,
+            format=format, chunk_size=chunk_size, progress=progress
         )
-        schema_file.write()
-        # dump table rows
-        try:
-            cursor = conn.execute('SELECT * FROM {}'.format(table['name']))
-            rows = [row for row in cursor]
-            if len(rows) > 0:
-                rows = [dict(row) for row in rows]
-                rows_file = create_file(
-                    path=os.path.join(table_dir, 'rows.csv'),
-                    contents=rows
-                )
-                rows_file.write()
-        except sqlite3.OperationalError:
-            pass
-        finally:
-            cursor.close()
+
+
+def dump_table_rows(
+        collection_path, table, tables_dir, where=None, limit=None,
+        format='csv', chunk_size=1000, progress=None):
+    table_dir = os.path.join(tables_dir, table['name'])
+    os.makedirs(table_dir)
+    # dump table info
+    table = dict(table)
+    schema = table['sql'] + ';'
+    del table['sql']
+    table_file = create_file(
+        path=os.path.join(table_dir, 'table.json'),
+        contents=table
+    )
+    table_file.write()
+    schema_file = create_file(
+        path=os.path.join(table_dir, 'schema.sql'),
+        contents=schema
+    )
+    schema_file.write()
+    # dump table rows
+    rows_path = os.path.join(table_dir, dump_formats[format])
+    start = time.perf_counter()
+    count = 0
+
+    def report(rows, done=False):
+        nonlocal count
+        count = rows
+        if progress:
+            elapsed = time.perf_counter() - start
+            progress(table['name'], count, elapsed, done)
+
+    try:
+        if format == 'sqlite':
+            copy_table(
+                collection_path, table['name'], schema, rows_path,
+                where=where, limit=limit, callback=report
+            )
+        else:
+            stream_table(
+                collection_path, table['name'], rows_path, where=where,
+                limit=limit, chunk_size=chunk_size, callback=report
+            )
+    except sqlite3.OperationalError as ex:
+        # unreadable tables are skipped, but a bad filter is an error
+        if where:
+            raise ex
+    report(count, done=True)
+    return count
+
+
+def stream_table(
+        collection_path, name, path, where=None, limit=None, chunk_size=1000,
+        callback=None):
+    """Stream the rows of a table into a csv or json lines file.
+
+    Rows are fetched from the cursor in chunks and written as they are
+    fetched. No file is written if the table has no (matching) rows.
+    """
+    conn = connect_read_only(collection_path)
+    try:
+        source = quote_identifier(name)
+        fields = sorted(
+            row[1] for row in
+            conn.execute('PRAGMA table_info({})'.format(source))
+        )
+        cursor = conn.execute(select_query(source, fields, where, limit))
+        rows = iter_rows(cursor, chunk_size, callback)
+        first = next(rows, None)
+        if first is not None:
+            rows_file = create_file(path)
+            rows_file.fields = fields
+            rows_file.write_rows(itertools.chain([first], rows))
+    finally:
+        conn.close()
+
+
+def copy_table(
+        collection_path, name, schema, path, where=None, limit=None,
+        callback=None):
+    """Copy the rows of a table into a new, gzip compressed SQLite database.
+    """
+    db_path = path[:-len('.gz')] if path.endswith('.gz') else path
+    conn = sqlite3.connect(
+        file_uri(db_path),
+        uri=True
+    )
+    try:
+        conn.execute(schema)
+        conn.execute(
+            'ATTACH DATABASE ? AS src',
+            (read_only_uri(collection_path),)
+        )
+        cursor = conn.execute('INSERT INTO main.{} {}'.format(
+            quote_identifier(name),
+            select_query('src.' + quote_identifier(name), None, where, limit)
+        ))
+        conn.commit()
+        if callback:
+            callback(cursor.rowcount)
+    finally:
+        conn.close()
+    if db_path != path:
+        with open(db_path, 'rb') as src, gzip.open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.unlink(db_path)
+
+
+def select_query(source, fields=None, where=None, limit=None):
+    columns = ','.join(map(quote_identifier, fields)) if fields else '*'
+    query = 'SELECT {} FROM {}'.format(columns, source)
+    if where:
+        query += ' WHERE {}'.format(where)
+    if limit is not None:
+        query += ' LIMIT {:d}'.format(int(limit))
+    return query
+
+
+def iter_rows(cursor, chunk_size=1000, callback=None):
+    """Yield the rows of a cursor, fetching them in fixed-size chunks."""
+    count = 0
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        count += len(chunk)
+        if callback:
+            callback(count)
+        yield from chunk
+
+
+def connect_read_only(path):
+    return sqlite3.connect(
+        read_only_uri(path),
+        uri=True,
+        check_same_thread=False
+    )
+
+
+def read_only_uri(path):
+    return file_uri(path) + '?mode=ro'
+
+
+def file_uri(path):
+    # urllib.request is slow to import, and is rarely needed
+    from urllib.request import pathname2url
+    return 'file:{}'.format(pathname2url(os.path.abspath(path)))
+
+
+def quote_identifier(name):
+    return '"{}"'.format(name.replace('"', '""'))
@@ -1,7 +1,12 @@
+import json
 import os
+import re
 import shutil
-from .file import create_config_file, load_config_file, load_css_file, \
-    load_data_file, load_js_file, load_template_file
+import string
+from .file import SqliteFile, create_config_file, load_config_file, \
+    load_css_file, load_data_file, load_js_file, load_template_file
+from .media import scan_media_dirs
+from .records import Records, missing
 from .util import generate_id
 
 
@@ -40,6 +45,33 @@ class ProjectConfig(Config):
     def build_dir(self):
         return self.resolve_path('build')
 
+    @property
+    def cache_dir(self):
+        return self.resolve_path('.panki')
+
+    def source_paths(self):
+        """Yield the paths of the files the project is built from."""
+        yield self.file.path
+        for note_type in self.note_types:
+            if note_type.file:
+                yield note_type.file.path
+            for config in note_type.css + note_type.js:
+                yield config.file.path
+            for card_type in note_type.card_types:
+                if card_type.file:
+                    yield card_type.file.path
+                yield card_type.template.file.path
+        for deck in self.decks:
+            if deck.file:
+                yield deck.file.path
+            for note_group in deck.notes:
+                if note_group.file:
+                    yield note_group.file.path
+                for data in note_group.data:
+                    yield data.file.path
+        for entry in scan_media_dirs(map(self.resolve_path, self.media)):
+            yield entry.path
+
     def find_or_add_note_type(self, **kwargs):
         note_types = list(filter(
             lambda nt: nt.name == kwargs.get('name'),
@@ -83,13 +115,20 @@ class ProjectConfig(Config):
         for deck in self.decks:
             deck.save_files()
 
-    def create_build_dir(self):
+    def create_build_dir(self, clean=True):
         build_dir = self.build_dir
         if os.path.exists(build_dir):
+            if not clean:
+                return build_dir
             shutil.rmtree(build_dir)
         os.makedirs(build_dir)
         return build_dir
 
+    def create_cache_dir(self):
+        cache_dir = self.cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        return cache_dir
+
     def resolve_path(self, path, relative_to=None):
         """Resolve the given project path to a full path.
 
@@ -277,17 +316,208 @@ class FileConfig(Config):
         self.file.write()
 
 
-def load_project(path=None):
+def load_project(path=None, lazy_data=False):
+    """Load a project and its files.
+
+    If `lazy_data` is true, the data files are not read until their records
+    are needed (see `File.iter_records`).
+    """
     file = load_project_config_file(path)
     if not file:
         return None
     media = file.contents.get('media')
     project = ProjectConfig(file=file, media=media)
     load_note_types(project, file.contents.get('noteTypes', []))
-    load_decks(project, file.contents.get('decks', []))
+    load_decks(project, file.contents.get('decks', []), lazy_data)
     return project
 
 
+def validate_project(project):
+    """Return a list of the problems with a loaded project.
+
+    The note types' templates are checked for references to unknown fields,
+    and the records of each loaded data file are checked against the fields
+    of their note type and the GUID format of their note group. GUIDs that
+    are used by more than one record are reported too. Only the columns of
+    data files that were loaded lazily (and of databases) are checked, from
+    their header or first record.
+    """
+    problems = []
+    note_types = {
+        note_type.name: note_type for note_type in project.note_types
+    }
+    for note_type in project.note_types:
+        problems += validate_note_type(note_type)
+    guids = set()
+    for deck in project.decks:
+        for note_group in deck.notes:
+            note_type = note_types.get(note_group.type)
+            if not note_type:
+                problems.append('{}: unknown note type: {}'.format(
+                    deck.name, note_group.type
+                ))
+                continue
+            if not note_type.fields:
+                continue
+            guid_format = note_group.guid or \
+                default_guid_format(note_type.fields[0])
+            try:
+                guid_fields = format_fields(guid_format)
+            except ValueError as ex:
+                problems.append('{}: invalid GUID format: {}: {}'.format(
+                    deck.name, guid_format, ex
+                ))
+                continue
+            constants = {
+                '__DeckID__': deck.id,
+                '__NoteTypeID__': note_type.id
+            }
+            for data in note_group.data:
+                records = data.file.contents or []
+                if not records:
+                    if isinstance(data.file, SqliteFile) and \
+                            not data.file.query:
+                        problems.append(
+                            '{}: a table or query is needed to read '
+                            'records from a database'.format(data.file.path)
+                        )
+                        continue
+                    # only the columns of lazily loaded files are checked
+                    columns = data.file.columns()
+                    if columns is None:
+                        continue
+                    records = Records(columns)
+                problems += validate_records(
+                    data.file.path,
+                    records,
+                    note_type.fields,
+                    guid_format,
+                    guid_fields - constants.keys(),
+                    constants,
+                    guids
+                )
+    return problems
+
+
+def validate_note_type(note_type):
+    problems = []
+    if not note_type.fields:
+        problems.append('{}: no fields'.format(note_type.name))
+    fields = set(note_type.fields) | template_special_fields
+    for card_type in note_type.card_types:
+        if not card_type.template or not card_type.template.file:
+            problems.append('{}: {}: missing template'.format(
+                note_type.name, card_type.name
+            ))
+            continue
+        template_file = card_type.template.file
+        text = '\n'.join(template_file.front + template_file.back)
+        unknown = sorted(template_fields(text) - fields)
+        if unknown:
+            problems.append('{}: {}: unknown fields in template: {}'.format(
+                note_type.name, card_type.name, ', '.join(unknown)
+            ))
+    return problems
+
+
+def validate_records(
+        path, records, fields, guid_format, guid_fields, constants, guids):
+    """Check the records of a data file, and add their GUIDs to a set.
+
+    The header of compact records is checked once, and then only the values
+    of their rows that are needed are looked at.
+    """
+    problems = []
+    if isinstance(records, Records):
+        missing_columns = [
+            field for field in fields if field not in records.index
+        ]
+        if missing_columns:
+            problems.append('{}: missing columns: {}'.format(
+                path, ', '.join(missing_columns)
+            ))
+            return problems
+        columns = [records.index[field] for field in fields]
+        guid_columns = [
+            (field, records.index.get(field)) for field in guid_fields
+        ]
+        rows = records.rows
+    else:
+        rows = records
+    for i, row in enumerate(rows):
+        if rows is records:
+            missing_fields = [field for field in fields if field not in row]
+            values = {
+                field: row[field] for field in guid_fields if field in row
+            }
+        else:
+            missing_fields = [
+                field for field, column in zip(fields, columns)
+                if row[column] is missing
+            ]
+            values = {
+                field: row[column] for field, column in guid_columns
+                if column is not None and row[column] is not missing
+            }
+        if missing_fields:
+            problems.append('{}: record {}: missing {}'.format(
+                path, i + 1, ', '.join(missing_fields)
+            ))
+            continue
+        try:
+            guid = guid_format.format(**values, **constants)
+        except KeyError as ex:
+            problems.append('{}: record {}: unknown field in GUID: {}'.format(
+                path, i + 1, ex.args[0]
+            ))
+            continue
+        if guid in guids:
+            problems.append('{}: record {}: duplicate GUID: {}'.format(
+                path, i + 1, guid
+            ))
+        guids.add(guid)
+    return problems
+
+
+def default_guid_format(first_field):
+    return '{__DeckID__}:{__NoteTypeID__}:' + '{{{}}}'.format(first_field)
+
+
+def format_fields(format):
+    """Return the names of the fields referenced by a format string.
+
+    Raises a `ValueError` if the format string is invalid.
+    """
+    return {
+        field_name.split('.')[0].split('[')[0]
+        for _, field_name, _, _ in string.Formatter().parse(format)
+        if field_name is not None
+    }
+
+
+# the fields that anki adds to every note
+template_special_fields = {
+    'FrontSide', 'Tags', 'Type', 'Deck', 'Subdeck', 'Card', 'CardFlag'
+}
+
+
+def template_fields(text):
+    """Return the names of the fields referenced by a template."""
+    fields = set()
+    for match in re.finditer(r'{{(.*?)}}', text, re.DOTALL):
+        name = match.group(1).strip()
+        if name[:1] in ('#', '^', '/'):
+            name = name[1:]
+        elif name[:1] == '!':
+            # comments
+            continue
+        # filters come before the field name, e.g. {{text:Front}}
+        name = name.rsplit(':', 1)[-1].strip()
+        if name:
+            fields.add(name)
+    return fields
+
+
 def load_project_config_file(path=None):
     for filename in ('project.json', 'project.yaml', 'project.yml'):
         try:
@@ -367,12 +597,12 @@ def load_note_type_card_type(project, note_type, config):
     card_type.set_template(path=template_path, file=template_file)
 
 
-def load_decks(project, configs):
+def load_decks(project, configs, lazy_data=False):
     for config in configs:
-        load_deck(project, config)
+        load_deck(project, config, lazy_data)
 
 
-def load_deck(project, config):
+def load_deck(project, config, lazy_data=False):
     path = None
     file = None
     if isinstance(config, str):
@@ -387,15 +617,15 @@ def load_deck(project, config):
         name=config.get('name'),
         package=config.get('package')
     )
-    load_deck_note_groups(project, deck, config.get('notes', []))
+    load_deck_note_groups(project, deck, config.get('notes', []), lazy_data)
 
 
-def load_deck_note_groups(project, deck, configs):
+def load_deck_note_groups(project, deck, configs, lazy_data=False):
     for config in configs:
-        load_deck_note_group(project, deck, config)
+        load_deck_note_group(project, deck, config, lazy_data)
 
 
-def load_deck_note_group(project, deck, config):
+def load_deck_note_group(project, deck, config, lazy_data=False):
     path = None
     file = None
     if isinstance(config, str):
@@ -413,9 +643,23 @@ def load_deck_note_group(project, deck, config):
     if not isinstance(data_paths, list):
         data_paths = [data_paths]
     for data_path in data_paths:
+        # databases are given as a path and the table or query to read
+        source = data_path if isinstance(data_path, dict) else {}
+        if source and (
+                not source.get('path') or
+                bool(source.get('table')) == bool(source.get('query'))):
+            raise ValueError(
+                '{}: a database data source needs a path and either a table '
+                'or a query: {}'.format(deck.name, json.dumps(source))
+            )
         resolved_path = project.resolve_path(
-            data_path,
+            source.get('path') if source else data_path,
             relative_to=(note_group.path or deck.path)
         )
-        data_file = load_data_file(resolved_path)
+        data_file = load_data_file(
+            resolved_path,
+            lazy=lazy_data,
+            table=source.get('table'),
+            query=source.get('query')
+        )
         note_group.add_data(data_path, data_file)
@@ -0,0 +1,168 @@
+import hashlib
+import zlib
+from array import array
+
+# records are compared by the sets of 5 character shingles of their text,
+# sketched with 64 min-hash bins, and the sketches are split into 16 bands of
+# 4 bins for locality-sensitive hashing (which only finds the candidate pairs
+# whose shingles are compared)
+shingle_size = 5
+num_bins = 64
+band_size = 4
+preview_size = 60
+
+
+def record_text(record):
+    """Return the normalized text of a record's values."""
+    text = ' '.join(
+        str(value) for value in record.values() if value is not None
+    )
+    return ' '.join(text.lower().split())
+
+
+def shingles(text, size=shingle_size):
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+def minhash(text):
+    """Return the min-hash sketch of a text's shingles.
+
+    The sketch uses one permutation hashing: each shingle is hashed once, the
+    hashes are split into bins, and the sketch keeps the smallest hash of
+    each bin. Empty bins borrow the value of the next bin that isn't empty.
+    The fraction of equal bins in two sketches estimates the similarity
+    (Jaccard index) of the texts' shingles. Sketches are packed into bytes,
+    so that millions of them fit in memory.
+    """
+    hashes = sorted(
+        map(zlib.crc32, map(str.encode, shingles(text))),
+        reverse=True
+    )
+    # the smallest hash of each bin is the last one written
+    bins = {value % num_bins: value for value in hashes}
+    sketch = array('Q')
+    for i in range(num_bins):
+        j = i
+        offset = 0
+        while j not in bins:
+            j = (j + 1) % num_bins
+            offset += 1
+        sketch.append(bins[j] + (offset << 32))
+    return sketch.tobytes()
+
+
+def similarity(a, b):
+    a, b = array('Q', a), array('Q', b)
+    return sum(x == y for x, y in zip(a, b)) / num_bins
+
+
+def jaccard(a, b):
+    """Return the similarity (Jaccard index) of two texts' shingles."""
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+def sketch_data_file(file):
+    """Sketch the records of a data file.
+
+    Returns a `(row, digest, sketch, text)` tuple for each record, where
+    `row` is the number of the record in the file (starting at 1), `text` is
+    its normalized text and `digest` is a hash of that text.
+    """
+    sketches = []
+    for row, record in enumerate(file.iter_records(), 1):
+        text = record_text(record)
+        sketches.append((
+            row,
+            hashlib.sha1(text.encode('utf-8')).digest(),
+            minhash(text),
+            text
+        ))
+    return sketches
+
+
+def find_duplicates(project, threshold=0.8, max_workers=None):
+    """Find clusters of duplicate records across a project's data files.
+
+    Records are exact duplicates if their normalized text is the same, and
+    near duplicates if the similarity of their text is at least the
+    threshold. Candidate pairs are found with locality-sensitive hashing, so
+    the time taken grows linearly with the number of records, and only the
+    candidates' shingles are compared. The data
+    files are sketched in a pool of `max_workers` processes.
+
+    Returns a `(records, clusters)` tuple, with the number of records and a
+    list of clusters, largest first. Each cluster is a dict with an `exact`
+    flag and its records, as `(path, deck, note_type, row, preview)` tuples.
+    """
+    sources = {}
+    for deck in project.decks:
+        for note_group in deck.notes:
+            for data in note_group.data:
+                # a data file shared by several note groups is only read once
+                # (databases are read once per query)
+                sources.setdefault(
+                    (data.file.path, getattr(data.file, 'query', None)),
+                    (data.file, deck.name, note_group.type)
+                )
+    files = [file for file, _, _ in sources.values()]
+    if max_workers == 1 or len(files) < 2:
+        sketches_by_file = list(map(sketch_data_file, files))
+    else:
+        # multiprocessing is slow to import, and is rarely needed
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            sketches_by_file = list(executor.map(sketch_data_file, files))
+    records = []
+    # the records with the same text, and the sketch and text of the first of
+    # them
+    groups = {}
+    sketches = []
+    texts = []
+    for (file, deck, note_type), file_sketches in zip(
+            sources.values(), sketches_by_file):
+        path = file.path
+        for row, digest, sketch, text in file_sketches:
+            if digest not in groups:
+                groups[digest] = []
+                sketches.append(sketch)
+                texts.append(text)
+            groups[digest].append(len(records))
+            records.append((path, deck, note_type, row, text[:preview_size]))
+    groups = list(groups.values())
+    parents = list(range(len(groups)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    # the buckets of one band are kept in memory at a time, and each group is
+    # only compared to the first group in its bucket (by the shingles of their
+    # text, since estimates of the similarity of short texts are too rough)
+    band_bytes = band_size * array('Q').itemsize
+    for start in range(0, num_bins * array('Q').itemsize, band_bytes):
+        buckets = {}
+        for group, sketch in enumerate(sketches):
+            other = buckets.setdefault(sketch[start:start + band_bytes], group)
+            if other == group or find(other) == find(group):
+                continue
+            if jaccard(texts[group], texts[other]) >= threshold:
+                parents[find(group)] = find(other)
+    clusters = {}
+    for group, members in enumerate(groups):
+        clusters.setdefault(find(group), []).append(members)
+    return len(records), sorted(
+        (
+            {
+                'exact': len(cluster) == 1,
+                'records': [
+                    records[i] for members in cluster for i in members
+                ]
+            }
+            for cluster in clusters.values()
+            if sum(map(len, cluster)) > 1
+        ),
+        key=lambda cluster: -len(cluster['records'])
+    )
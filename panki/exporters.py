@@ -0,0 +1,147 @@
+import os
+import shutil
+import anki
+import anki.exporting
+import anki.utils
+from .collection import media_dir_path, normalize_collection
+from .media import media_references
+from .package import PackageWriter
+from .profiling import profile_phase
+
+
+class PackageWriterMixin:
+    """Writes an Anki exporter's package with a `PackageWriter`."""
+
+    compression_level = 6
+    timestamp = None
+    keep_note_mods = False
+    profiler = None
+
+    def exportInto(self, path):
+        with PackageWriter(
+                path, self.compression_level, self.timestamp) as writer:
+            self.writer = writer
+            self.doExport(writer.zip_file, path)
+        self.writer = None
+
+    def _addDummyCollection(self, zip):
+        path = anki.utils.namedtmp('dummy.anki2')
+        collection = anki.Collection(path)
+        note = collection.newNote()
+        note.guid = 'panki-dummy'
+        note.fields[0] = 'This file requires a newer version of Anki.'
+        collection.addNote(note)
+        collection.close(downgrade=True)
+        if self.timestamp is not None:
+            normalize_collection(path, self.timestamp)
+        self.writer.write_file(path, 'collection.anki2')
+        os.unlink(path)
+
+    def _exportMedia(self, z, files, fdir):
+        paths = ((file, os.path.join(fdir, file)) for file in files)
+        with profile_phase(self.profiler, 'write_media') as phase:
+            media = self.writer.write_media(
+                (file, path) for file, path in paths if os.path.isfile(path)
+            )
+            phase['count'] = len(media)
+        return media
+
+
+class PackageExporter(PackageWriterMixin, anki.exporting.AnkiPackageExporter):
+    """Deck package exporter that only includes referenced media files.
+
+    Anki only includes media referenced by the notes' fields (and `_` prefixed
+    files referenced by templates), so this also picks up media referenced by
+    the templates and css of the exported note types.
+    """
+
+    prune_media = True
+
+    def doExport(self, z, path):
+        # same as anki's, except the collection can be normalized before it
+        # is written to the package
+        colfile = os.path.splitext(path)[0] + '.anki2'
+        with profile_phase(self.profiler, 'copy_notes') as phase:
+            anki.exporting.AnkiExporter.exportInto(self, colfile)
+            phase['count'] = self.count
+        if self.timestamp is not None:
+            with profile_phase(self.profiler, 'normalize_collection'):
+                normalize_collection(
+                    colfile, self.timestamp, self.keep_note_mods
+                )
+        with profile_phase(self.profiler, 'write_collection'):
+            if self._v2sched:
+                self._addDummyCollection(z)
+                self.writer.write_file(colfile, 'collection.anki21')
+            else:
+                self.writer.write_file(colfile, 'collection.anki2')
+        with profile_phase(self.profiler, 'find_media') as phase:
+            self.prepareMedia()
+            phase['count'] = len(self.mediaFiles)
+        media = self._exportMedia(z, self.mediaFiles, self.mediaDir)
+        # tidy up intermediate files
+        os.unlink(colfile)
+        media_db = os.path.splitext(path)[0] + '.media.db2'
+        if os.path.exists(media_db):
+            os.unlink(media_db)
+        shutil.rmtree(media_dir_path(colfile), ignore_errors=True)
+        return media
+
+    def prepareMedia(self):
+        if self.prune_media and self.includeMedia:
+            note_ids = None
+            if self.cids is not None:
+                note_ids = self.src.db.list(
+                    'SELECT DISTINCT nid FROM cards WHERE id IN ' +
+                    anki.utils.ids2str(self.cids)
+                )
+            self.mediaFiles = sorted(
+                media_references(self.src, self.did, note_ids)
+            )
+
+
+class CollectionPackageExporter(
+        PackageWriterMixin, anki.exporting.AnkiCollectionPackageExporter):
+    """Collection package exporter that only includes referenced media files.
+    """
+
+    prune_media = True
+
+    def doExport(self, z, path):
+        # same as anki's, except the collection can be normalized before it
+        # is written to the package (the collection is closed before the
+        # media is exported, so the references are collected first)
+        with profile_phase(self.profiler, 'find_media') as phase:
+            self.references = media_references(self.col)
+            phase['count'] = len(self.references)
+        self.count = self.col.cardCount()
+        v2 = self.col.schedVer() != 1
+        media_dir = self.col.media.dir()
+        with profile_phase(self.profiler, 'close_collection'):
+            self.col.close(downgrade=True)
+        colfile = self.col.path
+        if self.timestamp is not None:
+            colfile = os.path.splitext(path)[0] + '.anki2'
+            with profile_phase(self.profiler, 'normalize_collection'):
+                shutil.copyfile(self.col.path, colfile)
+                normalize_collection(
+                    colfile, self.timestamp, self.keep_note_mods
+                )
+        try:
+            with profile_phase(self.profiler, 'write_collection'):
+                if v2:
+                    self._addDummyCollection(z)
+                    self.writer.write_file(colfile, 'collection.anki21')
+                else:
+                    self.writer.write_file(colfile, 'collection.anki2')
+        finally:
+            if colfile != self.col.path:
+                os.unlink(colfile)
+        if not self.includeMedia:
+            return self.writer.write_media([])
+        return self._exportMedia(z, os.listdir(media_dir), media_dir)
+
+    def _exportMedia(self, z, files, fdir):
+        if self.prune_media:
+            files = set(files) & self.references
+        return super()._exportMedia(z, sorted(files), fdir)
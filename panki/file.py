@@ -1,9 +1,13 @@
+import base64
 import csv
 import json
 import os
 import shutil
-import bs4
-import yaml
+import sqlite3
+from collections.abc import Mapping
+from importlib import import_module
+from urllib.parse import quote
+from .records import Records, is_record_list
 from .util import strip_lines
 
 
@@ -16,13 +20,51 @@ class File:
     def exists(self):
         return os.path.exists(self.path)
 
+    def open(self, mode='r'):
+        """Open the file in text mode.
+
+        Files with a compression extension (e.g. `data.csv.gz`) are
+        decompressed as they are read, and compressed as they are written.
+        """
+        compression = compression_modules.get(compression_extension(self.path))
+        if compression:
+            return import_module(compression).open(self.path, mode + 't')
+        return open(self.path, mode)
+
     def read(self):
-        with open(self.path, 'r') as file:
+        with self.open('r') as file:
             self.contents = [line.rstrip() for line in file]
         return self.contents
 
+    def iter_records(self):
+        """Yield the records of a data file.
+
+        Loaded contents are used as-is. Otherwise, the file is read, and
+        formats that can be streamed are streamed without being loaded.
+        """
+        if not self.contents:
+            self.read()
+        yield from self.contents
+
+    def columns(self):
+        """Return the fields of the data file's first record.
+
+        Returns None if the file has no records. Only the first record of
+        formats that can be streamed is read, and the contents of a file that
+        wasn't loaded are not kept.
+        """
+        loaded = bool(self.contents)
+        records = self.iter_records()
+        try:
+            record = next(records, None)
+        finally:
+            records.close()
+            if not loaded:
+                self.contents = []
+        return list(record) if isinstance(record, Mapping) else None
+
     def write(self):
-        with open(self.path, 'w') as file:
+        with self.open('w') as file:
             if isinstance(self.contents, list):
                 file.writelines(self.contents)
             else:
@@ -51,11 +93,13 @@ class JsonFile(File):
         self.indent = indent
 
     def read(self):
-        with open(self.path, 'r') as file:
+        with self.open('r') as file:
             self.contents = json.load(file)
+        if is_record_list(self.contents):
+            self.contents = Records.from_dicts(self.contents)
 
     def write(self):
-        with open(self.path, 'w') as file:
+        with self.open('w') as file:
             if self.compact and isinstance(self.contents, list):
                 indent_str = ' ' * self.indent
                 file.write('[\n')
@@ -69,10 +113,58 @@ class JsonFile(File):
                     self.contents,
                     file,
                     indent=self.indent,
-                    ensure_ascii=self.ensure_ascii
+                    ensure_ascii=self.ensure_ascii,
+                    default=json_default
                 )
 
 
+class JsonLinesFile(File):
+
+    def __init__(
+        self, path=None, contents=None, fields=None, ensure_ascii=False
+    ):
+        super().__init__(path, contents)
+        self.fields = fields
+        self.ensure_ascii = ensure_ascii
+
+    def read(self):
+        with self.open('r') as file:
+            self.contents = Records.from_dicts(
+                json.loads(line) for line in file if line.strip()
+            )
+
+    def iter_records(self):
+        if self.contents:
+            yield from self.contents
+            return
+        with self.open('r') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def write(self):
+        with self.open('w') as file:
+            for row in self.contents:
+                file.write(self.dumps(row) + '\n')
+
+    def write_rows(self, rows):
+        """Write an iterable of rows to the file, one JSON object per line.
+
+        Rows are sequences of values in the same order as `fields` and are
+        written as they are consumed, so they never have to be held in memory.
+        """
+        with self.open('w') as file:
+            for row in rows:
+                file.write(self.dumps(dict(zip(self.fields, row))) + '\n')
+
+    def dumps(self, value):
+        return json.dumps(
+            value,
+            ensure_ascii=self.ensure_ascii,
+            default=json_default
+        )
+
+
 class YamlFile(File):
 
     def __init__(self, path=None, contents=None, indent=2):
@@ -80,12 +172,19 @@ class YamlFile(File):
         self.indent = indent
 
     def read(self):
-        with open(self.path, 'r') as file:
+        import yaml
+        with self.open('r') as file:
             self.contents = yaml.load(file, Loader=yaml.FullLoader)
+        if is_record_list(self.contents):
+            self.contents = Records.from_dicts(self.contents)
 
     def write(self):
-        with open(self.path, 'w') as file:
-            yaml.dump(self.contents, file, indent=self.indent)
+        import yaml
+        contents = self.contents
+        if isinstance(contents, Records):
+            contents = [dict(record) for record in contents]
+        with self.open('w') as file:
+            yaml.dump(contents, file, indent=self.indent)
 
 
 class CsvFile(File):
@@ -98,15 +197,28 @@ class CsvFile(File):
         self.lineterminator = lineterminator
 
     def read(self):
-        with open(self.path, 'r') as file:
-            self.contents = [row for row in csv.DictReader(file)]
+        with self.open('r') as file:
+            reader = csv.reader(file)
+            header = next(reader, [])
+            # like csv.DictReader, blank rows are skipped
+            self.contents = Records.from_rows(
+                header,
+                (row[:len(header)] for row in reader if row)
+            )
         if len(self.contents) > 0 and not self.fields:
-            self.fields = sorted(list(self.contents[0].keys()))
+            self.fields = sorted(self.contents.fields)
+
+    def iter_records(self):
+        if self.contents:
+            yield from self.contents
+            return
+        with self.open('r') as file:
+            yield from csv.DictReader(file)
 
     def write(self):
         if len(self.contents) > 0 and not self.fields:
             self.fields = sorted(list(self.contents[0].keys()))
-        with open(self.path, 'w') as file:
+        with self.open('w') as file:
             writer = csv.DictWriter(
                 file,
                 fieldnames=self.fields,
@@ -115,6 +227,91 @@ class CsvFile(File):
             writer.writeheader()
             writer.writerows(self.contents)
 
+    def write_rows(self, rows):
+        """Write the header followed by an iterable of rows to the file.
+
+        Rows are sequences of values in the same order as `fields` and are
+        written as they are consumed, so they never have to be held in memory.
+        """
+        with self.open('w') as file:
+            writer = csv.writer(file, lineterminator=self.lineterminator)
+            writer.writerow(self.fields)
+            writer.writerows(rows)
+
+
+class SqliteFile(File):
+    """A SQLite database, whose records are the rows of a table or query.
+
+    Databases are read-only data sources. Their records are streamed from a
+    cursor, and their values are converted to text (NULLs to empty strings
+    and blobs to base64 strings).
+    """
+
+    def __init__(self, path=None, contents=None, table=None, query=None):
+        super().__init__(path, contents)
+        self.table = table
+        self.query = query
+        if table and not query:
+            self.query = 'SELECT * FROM "{}"'.format(table.replace('"', '""'))
+
+    def connect(self):
+        return sqlite3.connect(
+            'file:{}?mode=ro'.format(quote(self.path)),
+            uri=True
+        )
+
+    def execute(self, conn, limit=None):
+        if not self.query:
+            raise ValueError(
+                'A table or query is needed to read records from a ' +
+                'database: {}'.format(self.path)
+            )
+        query = self.query
+        if limit is not None:
+            query = 'SELECT * FROM ({}) LIMIT {}'.format(
+                query.rstrip().rstrip(';'),
+                limit
+            )
+        return conn.execute(query)
+
+    def columns(self):
+        """Return the names of the columns of the table or query."""
+        conn = self.connect()
+        try:
+            cursor = self.execute(conn, limit=0)
+            return [column[0] for column in cursor.description]
+        finally:
+            conn.close()
+
+    def read(self):
+        conn = self.connect()
+        try:
+            cursor = self.execute(conn)
+            self.contents = Records.from_rows(
+                [column[0] for column in cursor.description],
+                ([sql_text(value) for value in row] for row in cursor)
+            )
+        finally:
+            conn.close()
+
+    def iter_records(self):
+        if self.contents:
+            yield from self.contents
+            return
+        conn = self.connect()
+        try:
+            cursor = self.execute(conn)
+            fields = [column[0] for column in cursor.description]
+            for row in cursor:
+                yield dict(zip(fields, map(sql_text, row)))
+        finally:
+            conn.close()
+
+    def write(self):
+        raise ValueError(
+            'Databases are read-only data sources: {}'.format(self.path)
+        )
+
 
 class CssFile(File):
 
@@ -168,7 +365,7 @@ class TemplateFile(File):
         self.contents['script'] = contents
 
     def read(self):
-        with open(self.path, 'r') as file:
+        with self.open('r') as file:
             template = soup(file).template
             self.front = []
             if template:
@@ -196,7 +393,7 @@ class TemplateFile(File):
                     self.script = [line for line in lines if line.strip()]
 
     def write(self):
-        with open(self.path, 'w') as file:
+        with self.open('w') as file:
             file.write('<template>\n')
             self.write_style_element(file)
             self.write_script_element(file)
@@ -265,15 +462,24 @@ class TemplateFile(File):
 
 file_extension_map = {
     '.json': JsonFile,
+    '.jsonl': JsonLinesFile,
     '.yaml': YamlFile,
     '.yml': YamlFile,
     '.csv': CsvFile,
+    '.sqlite': SqliteFile,
+    '.db': SqliteFile,
     '.css': CssFile,
     '.js': JsFile,
     '.html': TemplateFile
 }
 config_file_extensions = ('.json', '.yaml', '.yml')
-data_file_extensions = ('.csv', '.json', '.yaml', '.yml')
+data_file_extensions = (
+    '.csv', '.json', '.jsonl', '.yaml', '.yml', '.sqlite', '.db'
+)
+database_extensions = ('.sqlite', '.db')
+# the modules that read and write compressed files, which are only imported
+# when they are needed
+compression_modules = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
 template_extensions = ('.html',)
 css_extensions = ('.css',)
 js_extensions = ('.js',)
@@ -298,8 +504,33 @@ def is_config_file(path):
     return file_extension(path) in config_file_extensions
 
 
-def load_data_file(path):
+def load_data_file(path, lazy=False, table=None, query=None):
+    """Load a data file.
+
+    If `lazy` is true, the file's contents are not read until its records are
+    iterated over (see `iter_records`). Databases are always loaded lazily,
+    and their records are the rows of the given table or query.
+    """
     require_data_file(path)
+    if is_database(path):
+        file = SqliteFile(path, table=table, query=query)
+        if not file.exists():
+            raise FileNotFoundError(
+                'No such database: {}'.format(file.path)
+            )
+        if not file.query:
+            raise ValueError(
+                'A table or query is needed to read records from a ' +
+                'database: {}'.format(file.path)
+            )
+        return file
+    if lazy:
+        file = create_file(path)
+        if not file.exists():
+            raise FileNotFoundError(
+                'No such data file: {}'.format(file.path)
+            )
+        return file
     return load_file(path)
 
 
@@ -311,12 +542,18 @@ def create_data_file(path, contents=None):
 def require_data_file(path):
     if not is_data_file(path):
         raise ValueError('path is not a supported data file format: %s' % path)
+    if is_database(path) and compression_extension(path):
+        raise ValueError('databases cannot be compressed: %s' % path)
 
 
 def is_data_file(path):
     return file_extension(path) in data_file_extensions
 
 
+def is_database(path):
+    return file_extension(path) in database_extensions
+
+
 def load_template_file(path):
     require_template_file(path)
     return load_file(path)
@@ -388,11 +625,49 @@ def create_file(path=None, contents=None):
 
 
 def file_extension(path):
+    """Return the extension of a file, ignoring its compression extension.
+
+    >>> file_extension('data.csv.gz')
+    '.csv'
+    """
+    ext = compression_extension(path)
+    if ext:
+        path = path[:-len(ext)]
     ext_start = path.rfind('.')
     return path[ext_start:] if ext_start >= 0 else None
 
 
+def compression_extension(path):
+    ext_start = path.rfind('.')
+    ext = path[ext_start:] if ext_start >= 0 else None
+    return ext if ext in compression_modules else None
+
+
+def json_default(value):
+    # blobs are encoded as base64 strings
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, Records):
+        return list(value)
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(
+        'Object of type {} is not JSON serializable'.format(
+            type(value).__name__
+        )
+    )
+
+
+def sql_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return value if isinstance(value, str) else str(value)
+
+
 def soup(value, features='html.parser'):
+    import bs4
     return bs4.BeautifulSoup(value, features=features)
 
 
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from .file import create_file, load_file
+from .media import find_media_references, hash_file, \
+    note_type_media_references
+
+
+def package_manifest(collection, deck_id=None):
+    """Return the manifest of the notes in a package.
+
+    The manifest maps the GUID of each note in the deck (or the collection, if
+    no deck is provided) to a hash of its fields, tags and note type, and of
+    the contents of the media files they reference. A note's hash changes
+    whenever re-importing it would change it.
+    """
+    if deck_id:
+        deck_ids = collection.decks.deck_and_child_ids(int(deck_id))
+        rows = collection.db.execute(
+            'SELECT guid, mid, flds, tags FROM notes WHERE id IN '
+            '(SELECT nid FROM cards WHERE did IN ({}))'.format(
+                ','.join(map(str, deck_ids))
+            )
+        )
+    else:
+        rows = collection.db.execute('SELECT guid, mid, flds, tags FROM notes')
+    media_dir = collection.media.dir()
+    media_hashes = {}
+
+    def media_hash(name):
+        if name not in media_hashes:
+            path = os.path.join(media_dir, name)
+            media_hashes[name] = hash_file(path) if os.path.isfile(path) \
+                else None
+        return media_hashes[name]
+
+    note_type_hashes = {}
+    notes = {}
+    for guid, model_id, fields, tags in rows:
+        if model_id not in note_type_hashes:
+            note_type_hashes[model_id] = note_type_hash(
+                collection.models.get(model_id),
+                media_hash
+            )
+        digest = hashlib.sha1()
+        digest.update(note_type_hashes[model_id].encode('utf-8'))
+        digest.update(json.dumps([fields, tags.strip()]).encode('utf-8'))
+        media = {
+            name: media_hash(name)
+            for name in find_media_references(fields)
+        }
+        digest.update(json.dumps(media, sort_keys=True).encode('utf-8'))
+        notes[guid] = digest.hexdigest()
+    return {'notes': notes}
+
+
+def note_type_hash(model, media_hash):
+    note_type = {
+        'name': model['name'],
+        'fields': [field['name'] for field in model['flds']],
+        'templates': [
+            [template['name'], template['qfmt'], template['afmt']]
+            for template in model['tmpls']
+        ],
+        'css': model['css'],
+        'media': {
+            name: media_hash(name)
+            for name in note_type_media_references(model)
+        }
+    }
+    return hashlib.sha1(
+        json.dumps(note_type, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def changed_notes(manifest, previous_manifest):
+    """Return the GUIDs of the notes that were added or modified since the
+    previous manifest.
+    """
+    previous_notes = previous_manifest.get('notes', {})
+    return {
+        guid for guid, digest in manifest.get('notes', {}).items()
+        if previous_notes.get(guid) != digest
+    }
+
+
+def load_build_manifest(path):
+    return load_file(path).contents
+
+
+def save_build_manifest(path, manifest):
+    file = create_file(path, manifest)
+    file.create_path_to()
+    file.write()
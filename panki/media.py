@@ -0,0 +1,199 @@
+import errno
+import hashlib
+import html
+import os
+import re
+import shutil
+import unicodedata
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from .file import create_file, load_file
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+# linux ioctl for cloning a file's extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+media_reference_regexps = [
+    # html src attributes (quoted and unquoted)
+    re.compile(r'(?i)\bsrc\s*=\s*"([^"]+)"'),
+    re.compile(r"(?i)\bsrc\s*=\s*'([^']+)'"),
+    re.compile(r'(?i)\bsrc\s*=\s*([^\s"\'>]+)'),
+    # anki sound tags
+    re.compile(r'\[sound:([^\]]+)\]'),
+    # css urls (quoted and unquoted)
+    re.compile(r'(?i)\burl\(\s*"([^"]+)"\s*\)'),
+    re.compile(r"(?i)\burl\(\s*'([^']+)'\s*\)"),
+    re.compile(r'(?i)\burl\(\s*([^\s"\')]+)\s*\)')
+]
+
+
+def scan_media_dirs(paths):
+    for path in paths:
+        yield from scan_media_dir(path)
+
+
+def scan_media_dir(path):
+    """Recursively yield a `DirEntry` for every file in a media directory."""
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            yield from scan_media_dir(entry.path)
+        elif entry.is_file():
+            yield entry
+
+
+def media_file_name(path):
+    return unicodedata.normalize('NFC', os.path.basename(path))
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_media_files(entries, manifest, max_workers=None):
+    """Return a map of file paths to content hashes.
+
+    Hashes recorded in the manifest are reused for files whose size and
+    modification time have not changed. All other files are hashed in
+    parallel, and the manifest is updated with the results.
+    """
+    hashes = {}
+    stale = []
+    for entry in entries:
+        stat = entry.stat()
+        record = manifest['files'].get(entry.path)
+        if record and record['size'] == stat.st_size and \
+                record['mtime'] == stat.st_mtime_ns:
+            hashes[entry.path] = record['hash']
+        else:
+            stale.append((entry.path, stat))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = [path for path, _ in stale]
+        for (path, stat), digest in zip(stale, executor.map(hash_file, paths)):
+            hashes[path] = digest
+            manifest['files'][path] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'hash': digest
+            }
+    return hashes
+
+
+def link_file(src, dst):
+    """Make `dst` a hardlink, reflink or (as a last resort) copy of `src`."""
+    try:
+        os.link(src, dst)
+        return
+    except OSError as ex:
+        if ex.errno == errno.EEXIST:
+            raise ex
+    try:
+        reflink_file(src, dst)
+        return
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+
+
+def reflink_file(src, dst):
+    if not fcntl:
+        raise OSError(errno.ENOTSUP, 'reflinks are not supported')
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError as ex:
+            dst_file.close()
+            os.unlink(dst)
+            raise ex
+
+
+def load_media_manifest(path):
+    if not os.path.exists(path):
+        return {'files': {}}
+    contents = load_file(path).contents
+    contents.setdefault('files', {})
+    return contents
+
+
+def save_media_manifest(path, manifest, paths=None):
+    if paths is not None:
+        manifest['files'] = {
+            path: record
+            for path, record in manifest['files'].items()
+            if path in paths
+        }
+    file = create_file(path, manifest)
+    file.create_path_to()
+    file.write()
+
+
+def find_media_references(text):
+    """Return the names of the local media files referenced in some text.
+
+    References are found in html `src` attributes, `[sound:...]` tags and css
+    `url(...)` values. Remote urls and data uris are ignored.
+    """
+    references = set()
+    for regexp in media_reference_regexps:
+        for match in regexp.finditer(text):
+            name = html.unescape(match.group(1).strip())
+            if re.match(r'(?i)^([a-z][a-z0-9+.-]*:|//)', name):
+                continue
+            name = urllib.parse.unquote(name)
+            references.add(unicodedata.normalize('NFC', name))
+    return references
+
+
+def media_references(collection, deck_id=None, note_ids=None):
+    """Return the names of the media files used by a deck's notes.
+
+    Both the notes' field values and their note types' templates and css are
+    scanned. If no deck is provided, all notes in the collection are scanned.
+    If note IDs are provided, only those notes are scanned.
+    """
+    if note_ids is not None:
+        rows = collection.db.execute(
+            'SELECT id, mid, flds FROM notes WHERE id IN ({})'.format(
+                ','.join(map(str, map(int, note_ids)))
+            )
+        )
+    elif deck_id:
+        deck_ids = collection.decks.deck_and_child_ids(int(deck_id))
+        rows = collection.db.execute(
+            'SELECT DISTINCT n.id, n.mid, n.flds FROM notes n '
+            'JOIN cards c ON c.nid = n.id '
+            'WHERE c.did IN ({})'.format(','.join(map(str, deck_ids)))
+        )
+    else:
+        rows = collection.db.execute('SELECT id, mid, flds FROM notes')
+    references = set()
+    model_ids = set()
+    for _, model_id, fields in rows:
+        model_ids.add(model_id)
+        references |= find_media_references(fields)
+    for model_id in model_ids:
+        references |= note_type_media_references(
+            collection.models.get(model_id)
+        )
+    return references
+
+
+def note_type_media_references(model):
+    """Return the names of the media files used by a note type's templates
+    and css.
+    """
+    references = find_media_references(model['css'])
+    for template in model['tmpls']:
+        references |= find_media_references(template['qfmt'])
+        references |= find_media_references(template['afmt'])
+    return references
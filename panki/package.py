@@ -1,64 +1,487 @@
+import json
 import os
-import anki
-import anki.exporting
-import anki.importing
-from .collection import build_collection, dump_collection
+import shutil
+import struct
+import tempfile
+import time
+import unicodedata
+import zipfile
+from datetime import datetime, timezone
+from .collection import build_collection, dump_database, media_dir_path, \
+    select_tables
+from .config import load_project, validate_project
 from .file import create_file
+from .manifest import changed_notes, load_build_manifest, \
+    package_manifest, save_build_manifest
+from .media import hash_file
+from .profiling import profile_phase
+from .util import source_date_epoch, utcnow
 
 
-def build_project(project):
-    collection = build_collection(project)
+class PackageReader:
+    """Reads the contents of an .apkg or .colpkg file without importing it.
+
+    Media entries are read lazily from the zip file, and uncompressed entries
+    are copied straight from the package file to their destination with
+    `os.copy_file_range` (or `os.sendfile`) where the platform supports it.
+    """
+
+    collection_names = ('collection.anki21', 'collection.anki2')
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.zip_file = None
+
+    def __enter__(self):
+        self.zip_file = zipfile.ZipFile(self.path, 'r')
+        return self
+
+    def __exit__(self, *args):
+        self.zip_file.close()
+        self.zip_file = None
+
+    @property
+    def collection_entry(self):
+        names = self.zip_file.namelist()
+        for name in self.collection_names:
+            if name in names:
+                return self.zip_file.getinfo(name)
+        raise ValueError(
+            'package does not contain a supported collection: %s' % self.path
+        )
+
+    def extract_collection(self, path):
+        self.extract_entry(self.collection_entry, path)
+
+    def media(self):
+        """Yield the name and zip entry of each media file in the package."""
+        try:
+            with self.zip_file.open('media') as file:
+                media = json.load(file)
+        except KeyError:
+            return
+        for index, name in media.items():
+            name = os.path.basename(name)
+            if not name or name in ('.', '..'):
+                continue
+            try:
+                yield name, self.zip_file.getinfo(index)
+            except KeyError:
+                continue
+
+    def extract_media(self, path):
+        """Extract the media files and return how many were extracted."""
+        os.makedirs(path, exist_ok=True)
+        count = 0
+        for name, info in self.media():
+            self.extract_entry(info, os.path.join(path, name))
+            count += 1
+        return count
+
+    def extract_entry(self, info, path):
+        with open(path, 'wb') as dst:
+            if info.compress_type == zipfile.ZIP_STORED and \
+                    not info.flag_bits & 0x1:
+                with open(self.path, 'rb') as src:
+                    offset = entry_data_offset(src, info)
+                    copy_file_range(src, dst, offset, info.file_size)
+            else:
+                with self.zip_file.open(info) as src:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+
+
+class PackageWriter:
+    """Writes the contents of an .apkg or .colpkg file.
+
+    Files are streamed into the zip file. Media in formats that are already
+    compressed (images, audio, video, ...) are stored as-is, and everything
+    else is deflated with the configured compression level. A compression
+    level of 0 stores every entry without compression.
+
+    If a timestamp is given, every entry gets that modification time and the
+    same permissions, so the package only depends on the entries' contents.
+    """
+
+    stored_extensions = (
+        '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic',
+        '.mp3', '.ogg', '.oga', '.opus', '.m4a', '.aac', '.flac', '.spx',
+        '.mp4', '.m4v', '.webm', '.mkv', '.mov', '.avi', '.mpg', '.mpeg',
+        '.woff', '.woff2', '.zip', '.gz', '.bz2', '.xz', '.zst', '.7z'
+    )
+    copy_buffer_size = 1024 * 1024
+
+    def __init__(self, path, compression_level=6, timestamp=None):
+        self.path = os.path.abspath(path)
+        self.compression_level = compression_level
+        self.timestamp = timestamp
+        self.zip_file = None
+
+    def __enter__(self):
+        self.zip_file = zipfile.ZipFile(
+            self.path,
+            'w',
+            self.compression,
+            allowZip64=True,
+            compresslevel=self.compression_level or None
+        )
+        return self
+
+    def __exit__(self, *args):
+        self.zip_file.close()
+        self.zip_file = None
+
+    @property
+    def compression(self):
+        if self.compression_level == 0:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def write_file(self, path, name, compress=True):
+        compress_type, compresslevel = self.compression_options(compress)
+        if self.timestamp is None:
+            self.zip_file.write(
+                path,
+                name,
+                compress_type=compress_type,
+                compresslevel=compresslevel
+            )
+            return
+        info = self.zip_info(name)
+        # the file size tells the zip file whether the entry needs zip64
+        info.file_size = os.path.getsize(path)
+        info.compress_type = compress_type
+        set_compression_level(info, compresslevel)
+        with open(path, 'rb') as src, self.zip_file.open(info, 'w') as dest:
+            shutil.copyfileobj(src, dest, self.copy_buffer_size)
+
+    def write_bytes(self, name, data, compress=True):
+        compress_type, compresslevel = self.compression_options(compress)
+        self.zip_file.writestr(
+            self.zip_info(name),
+            data,
+            compress_type=compress_type,
+            compresslevel=compresslevel
+        )
+
+    def zip_info(self, name):
+        if self.timestamp is None:
+            return zipfile.ZipInfo(name, date_time=utcnow().timetuple()[:6])
+        # zip timestamps start in 1980
+        date_time = datetime.fromtimestamp(
+            max(self.timestamp, 315532800),
+            timezone.utc
+        )
+        info = zipfile.ZipInfo(name, date_time=date_time.timetuple()[:6])
+        info.external_attr = 0o644 << 16
+        return info
+
+    def write_media(self, files):
+        """Write media files to the package and return the media map.
+
+        `files` is an iterable of `(name, path)` pairs. Each file is stored
+        under its index in the package, and the map from indexes to names is
+        written to the package's `media` entry.
+        """
+        media = {}
+        for name, path in files:
+            index = str(len(media))
+            self.write_file(path, index, self.compress_media(name))
+            media[index] = unicodedata.normalize('NFC', name)
+        self.write_bytes('media', json.dumps(media))
+        return media
+
+    def compress_media(self, name):
+        ext = os.path.splitext(name)[1].lower()
+        return ext not in self.stored_extensions
+
+    def compression_options(self, compress):
+        if compress and self.compression_level != 0:
+            return zipfile.ZIP_DEFLATED, self.compression_level
+        return zipfile.ZIP_STORED, None
+
+
+def set_compression_level(info, level):
+    """Set the compression level `ZipFile.open` uses for a zip entry.
+
+    `ZipFile.open` ignores the zip file's compression level for an entry
+    with its own zip info, and the entry's level is only public (as
+    `compress_level`) from Python 3.13 on.
+    """
+    if hasattr(zipfile.ZipInfo, 'compress_level'):
+        info.compress_level = level
+    else:
+        info._compresslevel = level
+
+
+def build_project(
+        project, temp_dir=None, compression_level=6, reproducible=False,
+        delta_from=None, profiler=None, chunk_size=None, max_memory=None,
+        shards=None, update=False, prune=False, stable_ids=False):
+    """Build a project's collection and export its packages.
+
+    A manifest of the notes in each package is saved to the build directory.
+    If the path to the manifest of a previous build is provided, a delta
+    package with only the notes that were added or modified since that build
+    is also exported next to each deck package.
+
+    See `add_decks` for building in chunks with a memory limit,
+    `add_decks_in_shards` for adding notes in several processes and
+    `build_collection` for updating the collection of a previous build and
+    for stable note IDs.
+    """
+    timestamp = None
+    if reproducible:
+        timestamp = source_date_epoch(project.source_paths())
+    collection = build_collection(
+        project,
+        temp_dir=temp_dir,
+        profiler=profiler,
+        chunk_size=chunk_size,
+        max_memory=max_memory,
+        shards=shards,
+        update=update,
+        prune=prune,
+        stable_ids=stable_ids,
+        timestamp=timestamp
+    )
+    previous_packages = None
+    if delta_from:
+        previous_packages = load_build_manifest(delta_from)['packages']
+    packages = []
     if project.package:
-        resolved_path = project.resolve_path(project.package)
-        export_package(collection, resolved_path)
+        packages.append((project.resolve_path(project.package), None))
     for deck in project.decks:
         if deck.package:
             resolved_path = project.resolve_path(
                 deck.package,
                 relative_to=deck.path
             )
-            export_package(collection, resolved_path, deck.id)
+            packages.append((resolved_path, deck.id))
+    project_dir = os.path.dirname(project.file.path)
+    manifest = {'packages': {}}
+    for path, deck_id in packages:
+        name = os.path.relpath(path, project_dir)
+        export_package(
+            collection,
+            path,
+            deck_id=deck_id,
+            compression_level=compression_level,
+            timestamp=timestamp,
+            keep_note_mods=stable_ids,
+            profiler=profiler
+        )
+        if not collection.db:
+            collection.reopen()
+        with profile_phase(profiler, 'package_manifest', path=name) as phase:
+            package = package_manifest(collection, deck_id)
+            phase['count'] = len(package['notes'])
+        manifest['packages'][name] = package
+        if previous_packages is None or is_anki_collection_package(path):
+            continue
+        guids = changed_notes(package, previous_packages.get(name, {}))
+        delta_path = delta_package_path(path)
+        if guids:
+            export_package(
+                collection,
+                delta_path,
+                deck_id=deck_id,
+                guids=guids,
+                compression_level=compression_level,
+                timestamp=timestamp,
+                keep_note_mods=stable_ids,
+                profiler=profiler
+            )
+        elif os.path.exists(delta_path):
+            os.unlink(delta_path)
+    save_build_manifest(
+        os.path.join(project.build_dir, 'manifest.json'),
+        manifest
+    )
+
+
+def build_projects(directories, max_workers=None, **kwargs):
+    """Build several projects in a pool of processes.
+
+    Yields a `(directory, elapsed, error)` tuple for each project as its build
+    completes, where `error` is `None` if the build succeeded. Each project is
+    built into its own build directory, and a failed build does not stop the
+    other builds.
+    """
+    # multiprocessing is slow to import, and is rarely needed
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(build_project_directory, directory, **kwargs):
+            directory
+            for directory in directories
+        }
+        for future in as_completed(futures):
+            elapsed, error = future.result()
+            yield futures[future], elapsed, error
+
+
+def build_project_directory(directory, check=True, **kwargs):
+    # errors are returned as messages, since they may not be picklable
+    start = time.perf_counter()
+    try:
+        project = load_project(
+            directory,
+            lazy_data=bool(kwargs.get('chunk_size'))
+        )
+        if not project:
+            raise ValueError(
+                'The directory does not contain a project config file'
+            )
+        problems = validate_project(project) if check else []
+        if problems:
+            raise ValueError('{} problems: {}'.format(
+                len(problems),
+                '; '.join(problems)
+            ))
+        build_project(project, **kwargs)
+        error = None
+    except Exception as ex:
+        error = str(ex) or type(ex).__name__
+    return time.perf_counter() - start, error
+
+
+def delta_package_path(path):
+    root, ext = os.path.splitext(path)
+    return root + '.delta' + ext
 
 
 def import_package(path, collection):
+    import anki.importing
     importer = anki.importing.AnkiPackageImporter(collection, path)
     importer.run()
 
 
 def export_package(
         collection, path, deck_id=None, include_tags=True, include_media=True,
-        include_scheduling=False):
+        include_scheduling=False, prune_media=True, compression_level=6,
+        timestamp=None, guids=None, profiler=None, keep_note_mods=False):
+    """Export a collection (or one of its decks) into a package file.
+
+    If a timestamp is given, the package is reproducible: exporting the same
+    notes, note types and media again yields a byte-for-byte identical file.
+    Notes and cards get the timestamp as their modification time, unless
+    `keep_note_mods` is true.
+    The package file is left untouched if its contents would not change.
+    If GUIDs are given, only those notes are exported (to a deck package).
+    Returns whether the package file was written.
+    """
     # if the collection is closed, reopen it
     if not collection.db:
         collection.reopen()
+    # anki is only imported by the commands that export packages
+    from .exporters import CollectionPackageExporter, PackageExporter
     # create the exporter
     exporter = None
     if is_anki_collection_package(path):
-        exporter = anki.exporting.AnkiCollectionPackageExporter(collection)
+        exporter = CollectionPackageExporter(collection)
     else:
-        exporter = anki.exporting.AnkiPackageExporter(collection)
+        exporter = PackageExporter(collection)
         if deck_id:
-            exporter.did = deck_id
+            exporter.did = int(deck_id)
+        if guids is not None:
+            exporter.cids = note_card_ids(collection, guids, deck_id)
     exporter.includeTags = include_tags
     exporter.includeMedia = include_media
     exporter.includeSched = include_scheduling
-    # export the package
-    collection_dir = os.path.dirname(collection.path)
-    file = create_file(os.path.join(collection_dir, 'temp.apkg'))
-    exporter.exportInto(file.path)
-    file.move(path)
+    exporter.prune_media = prune_media
+    exporter.compression_level = compression_level
+    exporter.timestamp = timestamp
+    exporter.keep_note_mods = keep_note_mods
+    exporter.profiler = profiler
+    # export the package next to its destination and move it into place
+    file = create_file(path)
+    file.create_path_to()
+    temp_path = os.path.join(
+        os.path.dirname(file.path),
+        '.{}.{}.apkg'.format(
+            os.path.splitext(os.path.basename(file.path))[0],
+            os.getpid()
+        )
+    )
+    try:
+        name = os.path.basename(file.path)
+        with profile_phase(profiler, 'package: ' + name):
+            exporter.exportInto(temp_path)
+        if same_contents(temp_path, file.path):
+            return False
+        os.replace(temp_path, file.path)
+        return True
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def note_card_ids(collection, guids, deck_id=None):
+    """Return the IDs of the cards of the notes with the given GUIDs."""
+    guids = set(guids)
+    query = 'SELECT c.id, n.guid FROM cards c JOIN notes n ON n.id = c.nid'
+    if deck_id:
+        deck_ids = collection.decks.deck_and_child_ids(int(deck_id))
+        query += ' WHERE c.did IN ({})'.format(','.join(map(str, deck_ids)))
+    return [
+        card_id for card_id, guid in collection.db.execute(query)
+        if guid in guids
+    ]
+
+
+def same_contents(path, other_path):
+    if not os.path.isfile(other_path):
+        return False
+    if os.path.getsize(path) != os.path.getsize(other_path):
+        return False
+    return hash_file(path) == hash_file(other_path)
 
 
 def convert_package(path):
     raise NotImplementedError()
 
 
-def dump_package(package, path):
-    package = os.path.abspath(package)
+def dump_package(
+        package, path, tables=None, where=None, limit=None, format='csv',
+        media=None, progress=None, profiler=None):
+    """Dump the collection (and media) of a package into a new directory.
+
+    The collection is extracted next to the directory, and the directory is
+    only created once the tables to dump are known to be in the collection.
+    Media files are only extracted if `media` is true, which by default is
+    when every table is dumped.
+    """
+    package = os.path.realpath(package)
     path = os.path.abspath(path)
-    collection = anki.Collection(os.path.join(path, 'collection.anki2'))
-    import_package(os.path.realpath(package), collection)
-    dump_collection(collection, path)
+    if media is None:
+        media = not tables
+    parent_dir = os.path.dirname(path)
+    os.makedirs(parent_dir, exist_ok=True)
+    with PackageReader(package) as reader:
+        with tempfile.TemporaryDirectory(dir=parent_dir) as temp_dir:
+            temp_path = os.path.join(temp_dir, 'collection.anki2')
+            with profile_phase(profiler, 'extract_collection'):
+                reader.extract_collection(temp_path)
+            select_tables(temp_path, tables)
+            os.makedirs(path, exist_ok=True)
+            collection_path = os.path.join(path, 'collection.anki2')
+            os.replace(temp_path, collection_path)
+        if media:
+            with profile_phase(profiler, 'extract_media') as phase:
+                phase['count'] = reader.extract_media(
+                    media_dir_path(collection_path)
+                )
+    with profile_phase(profiler, 'dump_tables'):
+        dump_database(
+            collection_path,
+            path,
+            tables=tables,
+            where=where,
+            limit=limit,
+            format=format,
+            progress=progress,
+            profiler=profiler
+        )
 
 
 def is_anki_package(path):
@@ -71,3 +494,49 @@ def is_anki_deck_package(path):
 
 def is_anki_collection_package(path):
     return path.endswith('.colpkg')
+
+
+def entry_data_offset(file, info):
+    """Return the offset of a zip entry's data within the zip file."""
+    file.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, file.read(30))
+    return info.header_offset + 30 + \
+        header[zipfile._FH_FILENAME_LENGTH] + \
+        header[zipfile._FH_EXTRA_FIELD_LENGTH]
+
+
+def copy_file_range(src, dst, offset, count):
+    """Copy `count` bytes at `offset` in `src` to the end of `dst`.
+
+    The copy happens in the kernel where possible, falling back to regular
+    reads and writes.
+    """
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    for copy in (os_copy_file_range, os_sendfile):
+        try:
+            while count > 0:
+                copied = copy(src_fd, dst_fd, offset, count)
+                if not copied:
+                    break
+                offset += copied
+                count -= copied
+            if count == 0:
+                return
+        except (AttributeError, OSError):
+            pass
+    src.seek(offset)
+    while count > 0:
+        chunk = src.read(min(count, 1 << 20))
+        if not chunk:
+            raise EOFError('unexpected end of zip file')
+        dst.write(chunk)
+        count -= len(chunk)
+
+
+def os_copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def os_sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
@@ -0,0 +1,147 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class Profiler:
+    """Records the wall time, CPU time, peak memory and item count of each
+    phase of a command.
+
+    Phases can be nested, and can run in several threads at once. Phases run by
+    worker threads are nested in the main thread's current phase. The CPU time
+    of a phase is the CPU time used by the whole process while it ran.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases = []
+        self.stacks = {}
+        self.main_thread = threading.get_ident()
+
+    @contextmanager
+    def phase(self, name, **args):
+        """Time a phase. Set the phase's `count` to record its item count."""
+        stack = self.stacks.setdefault(threading.get_ident(), [])
+        depth = len(stack)
+        if not stack:
+            depth = len(self.stacks.get(self.main_thread, []))
+        phase = {
+            'name': name,
+            'depth': depth,
+            'thread': threading.get_ident(),
+            'start': time.perf_counter() - self.origin,
+            'count': None,
+            'args': args
+        }
+        self.phases.append(phase)
+        stack.append(phase)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield phase
+        finally:
+            stack.pop()
+            phase['wall'] = time.perf_counter() - wall
+            phase['cpu'] = time.process_time() - cpu
+            phase['max_rss'] = max_rss()
+
+    def summary(self):
+        """Return the lines of a table summarizing the finished phases."""
+        rows = [('Phase', 'Wall', 'CPU', 'Peak RSS', 'Items')]
+        for phase in self.finished_phases():
+            count = phase['count']
+            rows.append((
+                '  ' * phase['depth'] + phase['name'],
+                '{:.3f}s'.format(phase['wall']),
+                '{:.3f}s'.format(phase['cpu']),
+                '{:.1f}MB'.format(phase['max_rss'] / 1024),
+                '' if count is None else str(count)
+            ))
+        widths = [max(len(row[i]) for row in rows) for i in range(5)]
+        return [
+            '  '.join(
+                value.ljust(width) if i == 0 else value.rjust(width)
+                for i, (value, width) in enumerate(zip(row, widths))
+            ).rstrip()
+            for row in rows
+        ]
+
+    def trace(self):
+        """Return the finished phases as a Chrome trace event file.
+
+        The trace can be opened with chrome://tracing, Perfetto or speedscope.
+        """
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for phase in self.finished_phases():
+            tid = threads.setdefault(phase['thread'], len(threads) + 1)
+            args = dict(phase['args'])
+            args.update(
+                cpu=phase['cpu'],
+                max_rss=phase['max_rss'],
+                count=phase['count']
+            )
+            events.append({
+                'name': phase['name'],
+                'ph': 'X',
+                'ts': round(phase['start'] * 1e6, 3),
+                'dur': round(phase['wall'] * 1e6, 3),
+                'pid': pid,
+                'tid': tid,
+                'args': args
+            })
+        for thread, tid in threads.items():
+            events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': tid,
+                'args': {
+                    'name': 'main' if thread == self.main_thread
+                    else 'worker {}'.format(tid)
+                }
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.trace(), file)
+
+    def finished_phases(self):
+        return [phase for phase in self.phases if 'wall' in phase]
+
+
+def profile_phase(profiler, name, **args):
+    """Time a phase with the profiler, if there is one.
+
+    Like `Profiler.phase`, the context manager yields the phase, so its
+    `count` can be set whether or not the command is being profiled.
+    """
+    if profiler:
+        return profiler.phase(name, **args)
+    return nullcontext({})
+
+
+def max_rss():
+    """Return the peak resident memory of the process in kilobytes."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos reports bytes
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def current_rss():
+    """Return the resident memory of the process in kilobytes.
+
+    Falls back to the peak resident memory where it isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            pages = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return max_rss()
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
@@ -0,0 +1,117 @@
+from collections.abc import Mapping, Sequence
+
+
+class Records(Sequence):
+    """A compact, read-only list of data file records.
+
+    Records share a single header, and each record's values are stored in a
+    tuple, instead of each record being a dict with its own copy of the keys.
+    Repeated values are stored once. Records are accessed like dicts:
+
+    >>> records = Records.from_dicts([{'Front': 'a', 'Back': 'b'}])
+    >>> records[0]['Front']
+    'a'
+    """
+
+    __slots__ = ('fields', 'index', 'rows')
+
+    def __init__(self, fields=(), rows=None):
+        self.fields = tuple(fields)
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.rows = rows if rows is not None else []
+
+    @classmethod
+    def from_rows(cls, fields, rows):
+        """Create records from a header and an iterable of value sequences.
+
+        Like `csv.DictReader`, values missing from the end of a row are None.
+        """
+        values = {}
+        padding = (None,) * len(fields)
+        return cls(fields, [
+            tuple(values.setdefault(value, value) for value in row) +
+            padding[len(row):]
+            for row in rows
+        ])
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        """Create records from an iterable of dicts.
+
+        The header has every key of every dict, in the order they were first
+        seen. Keys missing from a dict are missing from its record.
+        """
+        records = cls()
+        values = {}
+        for item in dicts:
+            for key in item:
+                if key not in records.index:
+                    records.index[key] = len(records.index)
+            row = [missing] * len(records.index)
+            for key, value in item.items():
+                if isinstance(value, str):
+                    value = values.setdefault(value, value)
+                row[records.index[key]] = value
+            records.rows.append(tuple(row))
+        records.fields = tuple(records.index)
+        return records
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Records(self.fields, self.rows[i])
+        return Record(self.index, self.rows[i])
+
+    def __eq__(self, other):
+        if isinstance(other, (Records, list)):
+            return len(self) == len(other) and \
+                all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return 'Records({!r})'.format(list(map(dict, self)))
+
+
+class Record(Mapping):
+    """A single record of a `Records` list."""
+
+    __slots__ = ('index', 'row')
+
+    def __init__(self, index, row):
+        self.index = index
+        self.row = row
+
+    def __getitem__(self, key):
+        i = self.index[key]
+        value = self.row[i] if i < len(self.row) else missing
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key, i in self.index.items():
+            if i < len(self.row) and self.row[i] is not missing:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'Record({!r})'.format(dict(self))
+
+
+class Missing:
+
+    def __repr__(self):
+        return 'missing'
+
+
+# marks the keys that are missing from a record
+missing = Missing()
+
+
+def is_record_list(value):
+    return isinstance(value, list) and len(value) > 0 and \
+        all(isinstance(item, dict) for item in value)
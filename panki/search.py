@@ -0,0 +1,154 @@
+import json
+import os
+import sqlite3
+from .media import hash_file
+
+# each source's records get the rowids `source_id << row_bits | row`, so a
+# source's records can be replaced with a single rowid range
+row_bits = 32
+
+
+def index_path(project):
+    return os.path.join(project.create_cache_dir(), 'index.db')
+
+
+def update_index(project, path=None):
+    """Update the full-text index of a project's note data.
+
+    Every data file of every note group is a source of the index, along with
+    its deck and note type (and its query, for a database). Sources whose
+    files have the same size and modification time as when they were indexed
+    are skipped, sources whose files have the same contents are only
+    re-stamped, and the records of the other sources are indexed again.
+    Sources that are no longer in the project are removed.
+
+    Returns a `(sources, updated)` tuple with the number of sources in the
+    index and the number of sources that were indexed again.
+    """
+    conn = connect_index(path or index_path(project))
+    try:
+        with conn:
+            indexed = {
+                (row[1], row[2], row[3], row[4]): row
+                for row in conn.execute(
+                    'SELECT id, path, deck, note_type, query, mtime_ns, size, '
+                    'digest FROM sources'
+                )
+            }
+            seen = set()
+            updated = 0
+            for deck, note_group, data in project_sources(project):
+                key = (
+                    data.file.path,
+                    deck.name,
+                    note_group.type,
+                    getattr(data.file, 'query', None)
+                )
+                if key in seen:
+                    continue
+                seen.add(key)
+                if update_source(conn, indexed.get(key), key, data):
+                    updated += 1
+            for key, row in indexed.items():
+                if key not in seen:
+                    delete_source(conn, row[0])
+        return len(seen), updated
+    finally:
+        conn.close()
+
+
+def project_sources(project):
+    for deck in project.decks:
+        for note_group in deck.notes:
+            for data in note_group.data:
+                yield deck, note_group, data
+
+
+def update_source(conn, row, key, data):
+    stat = os.stat(data.file.path)
+    if row and (row[5], row[6]) == (stat.st_mtime_ns, stat.st_size):
+        return False
+    digest = hash_file(data.file.path)
+    if row and row[7] == digest:
+        conn.execute(
+            'UPDATE sources SET mtime_ns = ?, size = ? WHERE id = ?',
+            (stat.st_mtime_ns, stat.st_size, row[0])
+        )
+        return False
+    if row:
+        delete_source(conn, row[0])
+    source_id = conn.execute(
+        'INSERT INTO sources '
+        '(path, deck, note_type, query, mtime_ns, size, digest) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (*key, stat.st_mtime_ns, stat.st_size, digest)
+    ).lastrowid
+    conn.executemany(
+        'INSERT INTO records (rowid, text, record) VALUES (?, ?, ?)',
+        (
+            (
+                (source_id << row_bits) | row,
+                '\n'.join(
+                    str(value) for value in record.values()
+                    if value is not None
+                ),
+                json.dumps(dict(record), ensure_ascii=False)
+            )
+            for row, record in enumerate(data.file.iter_records(), 1)
+        )
+    )
+    # the records are no longer needed once they are indexed
+    data.file.contents = []
+    return True
+
+
+def delete_source(conn, source_id):
+    conn.execute(
+        'DELETE FROM records WHERE rowid BETWEEN ? AND ?',
+        (source_id << row_bits, ((source_id + 1) << row_bits) - 1)
+    )
+    conn.execute('DELETE FROM sources WHERE id = ?', (source_id,))
+
+
+def search_index(path, query, limit=20):
+    """Search the full-text index of a project's note data.
+
+    The query uses the SQLite FTS5 query syntax. Returns a `(path, deck,
+    note_type, row, record)` tuple for each matching record, best matches
+    first, where `row` is the number of the record in its data file
+    (starting at 1).
+    """
+    conn = connect_index(path)
+    try:
+        rows = conn.execute(
+            'SELECT s.path, s.deck, s.note_type, r.rowid, r.record '
+            'FROM records r JOIN sources s ON s.id = r.rowid >> ? '
+            'WHERE records MATCH ? ORDER BY r.rank LIMIT ?',
+            (row_bits, query, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+    row_mask = (1 << row_bits) - 1
+    return [
+        (source_path, deck, note_type, rowid & row_mask, json.loads(record))
+        for source_path, deck, note_type, rowid, record in rows
+    ]
+
+
+def connect_index(path):
+    conn = sqlite3.connect(path)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(sources)')]
+    if columns and 'query' not in columns:
+        # indexes from before database queries were sources are rebuilt
+        conn.executescript(
+            'DROP TABLE sources;'
+            'DROP TABLE IF EXISTS records;'
+        )
+    conn.executescript(
+        'CREATE TABLE IF NOT EXISTS sources ('
+        'id INTEGER PRIMARY KEY, path TEXT, deck TEXT, note_type TEXT, '
+        'query TEXT, mtime_ns INTEGER, size INTEGER, digest TEXT);'
+        'CREATE VIRTUAL TABLE IF NOT EXISTS records USING fts5('
+        'text, record UNINDEXED);'
+    )
+    return conn
@@ -0,0 +1,226 @@
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from .config import load_project, validate_project
+from .package import build_project, dump_package
+
+
+class RequestError(Exception):
+    """An error reported by the server in response to a request."""
+
+    def __init__(self, message, type=None):
+        super().__init__(message)
+        self.type = type
+
+
+class ProjectEntry:
+    """A project kept loaded by the server.
+
+    The project is reloaded whenever one of its files has changed since it was
+    loaded.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.project = None
+        self.fingerprint = None
+        self.last_used = time.monotonic()
+
+    def load(self):
+        if self.project and \
+                project_fingerprint(self.project) == self.fingerprint:
+            return self.project
+        project = load_project(self.directory)
+        if not project:
+            raise ValueError(
+                'The directory does not contain a project config file'
+            )
+        self.project = project
+        self.fingerprint = project_fingerprint(project)
+        return project
+
+
+class ProjectCache:
+    """The projects loaded by the server, evicted after being idle."""
+
+    def __init__(self, idle_timeout=600):
+        self.idle_timeout = idle_timeout
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def project(self, directory):
+        """Load a project and hold its lock while it is in use."""
+        directory = os.path.realpath(directory)
+        with self.lock:
+            entry = self.entries.get(directory)
+            if not entry:
+                entry = self.entries[directory] = ProjectEntry(directory)
+            entry.last_used = time.monotonic()
+        with entry.lock:
+            try:
+                yield entry.load()
+            finally:
+                entry.last_used = time.monotonic()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            for directory, entry in list(self.entries.items()):
+                if entry.lock.locked():
+                    continue
+                if now - entry.last_used > self.idle_timeout:
+                    del self.entries[directory]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            result = self.server.handle_request(request)
+            response = {'ok': True, 'result': result}
+        except Exception as ex:
+            response = {
+                'ok': False,
+                'error': str(ex) or type(ex).__name__,
+                'type': type(ex).__name__
+            }
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves build, validate and dump requests over a Unix socket.
+
+    Each request is a single line of JSON with a `command` and its `args`, and
+    is answered with a single line of JSON. Requests are handled concurrently,
+    but only one request at a time is handled for each project.
+    """
+
+    # requests in progress are finished before the server stops
+    daemon_threads = False
+    block_on_close = True
+    commands = ('build', 'validate', 'dump', 'status', 'stop')
+
+    def __init__(self, path, idle_timeout=600):
+        self.projects = ProjectCache(idle_timeout)
+        super().__init__(path, RequestHandler)
+
+    def service_actions(self):
+        # called by serve_forever() between requests
+        self.projects.evict_idle()
+
+    def handle_request(self, request):
+        command = request.get('command')
+        if command not in self.commands:
+            raise ValueError('unknown command: {}'.format(command))
+        return getattr(self, 'do_' + command)(**request.get('args', {}))
+
+    def do_build(self, directory, check=True, **kwargs):
+        start = time.perf_counter()
+        with self.projects.project(directory) as project:
+            # projects with problems are not built, as with `panki build`
+            problems = validate_project(project) if check else []
+            if problems:
+                return {'problems': problems}
+            build_project(project, **kwargs)
+        return {'elapsed': time.perf_counter() - start, 'problems': []}
+
+    def do_validate(self, directory):
+        with self.projects.project(directory) as project:
+            return {'problems': validate_project(project)}
+
+    def do_dump(self, package, directory, **kwargs):
+        tables = []
+
+        def progress(table, rows, elapsed, done):
+            if done:
+                tables.append([table, rows, elapsed])
+
+        dump_package(package, directory, progress=progress, **kwargs)
+        return {'tables': tables}
+
+    def do_status(self):
+        with self.projects.lock:
+            projects = sorted(self.projects.entries)
+        return {'pid': os.getpid(), 'projects': projects}
+
+    def do_stop(self):
+        # shutdown() waits for serve_forever() to return, so it can't be
+        # called from the thread handling this request
+        threading.Thread(target=self.shutdown).start()
+        return {}
+
+
+def serve(path, idle_timeout=600):
+    """Serve requests on a Unix socket until a stop request is received."""
+    if os.path.exists(path):
+        if is_serving(path):
+            raise ValueError('a server is already running on ' + path)
+        os.unlink(path)
+    # import anki up front, so the first build doesn't have to
+    from . import exporters  # noqa: F401
+    # only the current user can connect to the socket
+    umask = os.umask(0o077)
+    try:
+        server = Server(path, idle_timeout)
+    finally:
+        os.umask(umask)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def send_request(path, command, **args):
+    """Send a request to the server and return its result."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        request = json.dumps({'command': command, 'args': args})
+        sock.sendall(request.encode('utf-8') + b'\n')
+        with sock.makefile('rb') as file:
+            response = json.loads(file.readline())
+    if not response['ok']:
+        raise RequestError(response['error'], response.get('type'))
+    return response['result']
+
+
+def is_serving(path):
+    try:
+        send_request(path, 'status')
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def default_socket_path():
+    path = os.environ.get('PANKI_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'panki.sock')
+    return os.path.join(
+        tempfile.gettempdir(),
+        'panki-{}.sock'.format(os.getuid())
+    )
+
+
+def project_fingerprint(project):
+    fingerprint = []
+    try:
+        for path in project.source_paths():
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    except OSError:
+        return None
+    return fingerprint
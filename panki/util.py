@@ -1,3 +1,5 @@
+import hashlib
+import os
 import click
 from datetime import datetime, timezone
 from time import sleep
@@ -27,6 +29,71 @@ def generate_id():
     return round(timestamp() * 1000)
 
 
+# anki reads note and card IDs as their creation times (in milliseconds), so
+# stable IDs are kept in the ~31 years before 2021, or before the time of a
+# build that is older than that
+stable_id_end = 1609459200000
+stable_id_span = 10 ** 12
+
+
+def stable_id(*parts, end=stable_id_end, span=stable_id_span):
+    """Derive an ID in `[end - span, end)` from a hash of the parts.
+
+    The range is cut short at zero, so the IDs are never negative.
+    """
+    start, span = id_range(end, span)
+    key = '\x1f'.join(map(str, parts)).encode('utf-8')
+    digest = hashlib.sha1(key).digest()
+    return start + int.from_bytes(digest[:8], 'big') % span
+
+
+def stable_ids(keys, end=stable_id_end, span=stable_id_span):
+    """Map each key (a tuple of parts) to a unique stable ID.
+
+    Keys are assigned in sorted order, and an ID that is already taken is
+    incremented (wrapping around within the range of `stable_id`) until it
+    is free, so colliding keys still get the same IDs every time.
+    """
+    start, span = id_range(end, span)
+    keys = sorted(keys)
+    if len(keys) > span:
+        raise ValueError('Too many keys for {} stable IDs'.format(span))
+    ids = {}
+    used = set()
+    for key in keys:
+        id = stable_id(*key, end=end, span=span)
+        while id in used:
+            id = start + (id - start + 1) % span
+        used.add(id)
+        ids[key] = id
+    return ids
+
+
+def stable_id_end_before(timestamp):
+    """Return the end of the stable IDs of a build at a timestamp (seconds)."""
+    return min(stable_id_end, int(timestamp * 1000))
+
+
+def id_range(end, span):
+    start = max(end - span, 0)
+    if end <= start:
+        raise ValueError('No IDs before {}'.format(end))
+    return start, end - start
+
+
+def source_date_epoch(paths=()):
+    """Return the timestamp of reproducible output, in seconds.
+
+    The `SOURCE_DATE_EPOCH` environment variable is used when it is set,
+    otherwise the latest modification time of the given paths.
+    """
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        return int(epoch)
+    mtimes = (os.stat(path).st_mtime for path in paths if os.path.exists(path))
+    return int(max(mtimes, default=0))
+
+
 def timestamp():
     return utcnow().timestamp()
 
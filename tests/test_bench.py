@@ -0,0 +1,101 @@
+import csv
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import panki.bench
+from panki.config import load_project
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_generate_project(self):
+        panki.bench.generate_project(
+            self.dir, note_types=2, card_types=3, decks=2, notes=11,
+            fields=3, field_size=30, media=4, media_size=100
+        )
+        project = load_project(self.dir)
+        self.assertEqual(len(project.note_types), 2)
+        for note_type in project.note_types:
+            self.assertEqual(
+                note_type.fields, ['Field1', 'Field2', 'Field3']
+            )
+            self.assertEqual(len(note_type.card_types), 3)
+        self.assertEqual(len(project.decks), 2)
+        self.assertEqual(project.media, ['media'])
+        records = []
+        for deck in project.decks:
+            self.assertEqual(len(deck.notes), 2)
+            for note_group in deck.notes:
+                for data in note_group.data:
+                    records += data.file.contents
+        self.assertEqual(len(records), 11)
+        self.assertEqual(len({r['Field1'] for r in records}), 11)
+        for record in records:
+            self.assertIn('<img src="media-', record['Field1'])
+            self.assertEqual(len(record['Field2']), 30)
+        media_dir = os.path.join(self.dir, 'media')
+        self.assertEqual(len(os.listdir(media_dir)), 4)
+        self.assertEqual(
+            os.path.getsize(os.path.join(media_dir, 'media-0.bin')), 100
+        )
+
+    def test_generate_project_is_deterministic(self):
+        for name in ('a', 'b'):
+            panki.bench.generate_project(
+                os.path.join(self.dir, name), notes=5, seed=1
+            )
+        rows = []
+        for name in ('a', 'b'):
+            path = os.path.join(
+                self.dir, name, 'data', 'deck-1-note-type-1.csv'
+            )
+            with open(path) as file:
+                rows.append(list(csv.reader(file)))
+        self.assertEqual(rows[0], rows[1])
+        self.assertEqual(len(rows[0]), 6)
+
+    def test_benchmark_cases(self):
+        cases = panki.bench.benchmark_cases(notes=[1, 2], media=[0, 3])
+        self.assertEqual(cases, [
+            {'media': 0, 'notes': 1},
+            {'media': 0, 'notes': 2},
+            {'media': 3, 'notes': 1},
+            {'media': 3, 'notes': 2}
+        ])
+
+    @patch(
+        'concurrent.futures.ProcessPoolExecutor',
+        lambda max_workers: ThreadPoolExecutor(max_workers)
+    )
+    def test_run_benchmarks(self):
+        reported = []
+        results = panki.bench.run_benchmarks(
+            [{'notes': 10, 'media': 2}],
+            repeat=2,
+            work_dir=self.dir,
+            callback=reported.append
+        )
+        self.assertEqual(results['results'], reported)
+        self.assertEqual(len(reported), 2)
+        for result in reported:
+            self.assertEqual(result['params'], {'notes': 10, 'media': 2})
+            self.assertEqual(list(result['phases']), [
+                'generate_project', 'load_project', 'add_note_types',
+                'add_decks', 'add_media', 'close_collection',
+                'export_package', 'dump_package'
+            ])
+            for phase in result['phases'].values():
+                self.assertGreaterEqual(phase['wall'], 0)
+                self.assertGreaterEqual(phase['cpu'], 0)
+                self.assertGreater(phase['max_rss'], 0)
+        self.assertIn('python', results)
+        self.assertEqual(os.listdir(self.dir), [])
@@ -1,19 +1,28 @@
 import base64
+import gzip
+import json
 import os
+import sqlite3
+import tempfile
 import unittest
 from unittest.mock import MagicMock, call, patch
 import panki.collection
+import panki.config
 import panki.file
+import panki.util
 
 
 class TestCollection(unittest.TestCase):
 
+    @patch('panki.collection.keep_note_type_mods')
     @patch('panki.config.os.path.realpath')
-    @patch('panki.collection.anki')
-    def test_build_collection(self, _anki, _realpath):
+    @patch('anki.Collection')
+    def test_build_collection(
+            self, _anki_collection, _realpath, _keep_note_type_mods):
         _realpath.side_effect = lambda p: p
         collection = MagicMock()
-        _anki.Collection.return_value = collection
+        _anki_collection.return_value = collection
+        collection.models.get.return_value = None
         models = {
             'Foo Note Type': MagicMock(),
             'Foo Note Type 2': MagicMock()
@@ -48,7 +57,8 @@ class TestCollection(unittest.TestCase):
             1234567890125: MagicMock(),
             1234567890126: MagicMock()
         }
-        collection.decks.get.side_effect = lambda id: decks.get(id)
+        collection.decks.get.side_effect = \
+            lambda id, default=True: decks.get(id) if default else None
         notes = []
 
         def create_note():
@@ -156,7 +166,7 @@ class TestCollection(unittest.TestCase):
         )
         project.create_build_dir.assert_called_once()
         collection_path = os.path.join(build_dir, 'collection.anki2')
-        _anki.Collection.called_with(collection_path)
+        _anki_collection.called_with(collection_path)
         collection.models.new.assert_has_calls([
             call('Foo Note Type'),
             call('Foo Note Type 2')
@@ -217,6 +227,18 @@ class TestCollection(unittest.TestCase):
             call(models['Foo Note Type']),
             call(models['Foo Note Type 2'])
         ])
+        collection_path = os.path.join(build_dir, 'collection.anki2')
+        fingerprints = _keep_note_type_mods.call_args[0][2]
+        _keep_note_type_mods.assert_called_with(
+            collection_path, project, fingerprints
+        )
+        self.assertEqual(
+            list(fingerprints),
+            [1234567890123, 1234567890124]
+        )
+        foo_note_type.__setitem__.assert_any_call(
+            'pankiFingerprint', fingerprints[1234567890123]
+        )
         bar_deck = decks[1234567890125]
         bar_deck.__setitem__.assert_has_calls([
             call('id', 1234567890125)
@@ -239,18 +261,658 @@ class TestCollection(unittest.TestCase):
         ])
         collection.close.assert_called_with()
 
+    @patch('panki.collection.keep_note_type_mods')
     @patch('panki.config.os.path.realpath')
-    @patch('panki.collection.anki')
-    def test_build_collection_error(self, _anki, _realpath):
+    @patch('anki.Collection')
+    def test_build_collection_error(
+            self, _anki_collection, _realpath, _keep_note_type_mods):
         _realpath.side_effect = lambda p: p
         collection = MagicMock()
-        collection.models.new.side_effect = Exception
-        _anki.Collection.return_value = collection
+        collection.models.get.return_value = None
+        collection.models.new.side_effect = Exception('bad note type')
+        _anki_collection.return_value = collection
         project = panki.config.ProjectConfig()
         build_dir = project.build_dir
         project.create_build_dir = MagicMock(return_value=build_dir)
         project.add_note_type()
-        with self.assertRaises(Exception):
+        with self.assertRaisesRegex(Exception, 'bad note type'):
             panki.collection.build_collection(project)
-        project.create_build_dir.assert_called_with()
+        project.create_build_dir.assert_called_with(clean=True)
+        collection.models.new.assert_called_once()
+        collection.close.assert_called_with()
+        _keep_note_type_mods.assert_not_called()
+
+    @patch('panki.collection.keep_note_type_mods')
+    @patch('panki.collection.shutil')
+    @patch('panki.collection.tempfile.mkdtemp')
+    @patch('anki.Collection')
+    def test_build_collection_temp_dir(
+            self, _anki_collection, _mkdtemp, _shutil, _keep_note_type_mods):
+        collection = MagicMock()
+        collection.path = os.path.join('tmp', 'work', 'collection.anki2')
+        _anki_collection.return_value = collection
+        _mkdtemp.return_value = os.path.join('tmp', 'work')
+        project = panki.config.ProjectConfig()
+        build_dir = project.build_dir
+        project.create_build_dir = MagicMock(return_value=build_dir)
+        panki.collection.build_collection(project, temp_dir='tmp')
+        _mkdtemp.assert_called_with(dir='tmp')
+        collection_path = os.path.join(build_dir, 'collection.anki2')
+        self.assertEqual(_anki_collection.call_args_list, [
+            call(os.path.join('tmp', 'work', 'collection.anki2')),
+            call(collection_path)
+        ])
+        _shutil.copyfile.assert_called_with(
+            os.path.join('tmp', 'work', 'collection.anki2'),
+            collection_path
+        )
+        _shutil.rmtree.assert_called_with(
+            os.path.join('tmp', 'work'),
+            ignore_errors=True
+        )
         collection.close.assert_called_with()
+
+    def create_note_group(self, records):
+        data = MagicMock()
+        data.file.contents = records
+        data.file.iter_records.side_effect = lambda: iter(records)
+        note_group = MagicMock(guid=None, data=[data])
+        deck = MagicMock(id=123)
+        return deck, note_group, data
+
+    def create_notes_collection(self):
+        collection = MagicMock()
+        collection.models.byName.return_value = {
+            'id': 456,
+            'flds': [{'name': 'Front'}, {'name': 'Back'}]
+        }
+        collection.newNote.side_effect = MagicMock
+        return collection
+
+    def test_add_notes(self):
+        collection = self.create_notes_collection()
+        records = [{'Front': str(i), 'Back': 'b'} for i in range(5)]
+        deck, note_group, data = self.create_note_group(records)
+        count = panki.collection.add_notes(collection, deck, note_group)
+        self.assertEqual(count, 5)
+        self.assertEqual(collection.add_note.call_count, 5)
+        collection.save.assert_not_called()
+        self.assertEqual(data.file.contents, records)
+
+    def test_add_notes_chunked(self):
+        collection = self.create_notes_collection()
+        records = [{'Front': str(i), 'Back': 'b'} for i in range(5)]
+        deck, note_group, data = self.create_note_group(records)
+        count = panki.collection.add_notes(
+            collection, deck, note_group, chunk_size=2
+        )
+        self.assertEqual(count, 5)
+        self.assertEqual(collection.add_note.call_count, 5)
+        # after the 2nd and 4th notes, and after the last one
+        self.assertEqual(collection.save.call_count, 3)
+        self.assertEqual(data.file.contents, [])
+
+    @patch('panki.collection.current_rss')
+    def test_add_notes_max_memory(self, _current_rss):
+        collection = self.create_notes_collection()
+        records = [{'Front': str(i), 'Back': 'b'} for i in range(5)]
+        deck, note_group, data = self.create_note_group(records)
+        _current_rss.return_value = 100 * 1024
+        panki.collection.add_notes(
+            collection, deck, note_group, chunk_size=2, max_memory=100
+        )
+        _current_rss.return_value = 101 * 1024
+        with self.assertRaises(MemoryError):
+            panki.collection.add_notes(
+                collection, deck, note_group, chunk_size=2, max_memory=100
+            )
+
+    def test_add_notes_update(self):
+        collection = self.create_notes_collection()
+        records = [{'Front': str(i), 'Back': 'b'} for i in range(4)]
+        deck, note_group, data = self.create_note_group(records)
+
+        def guid(front):
+            return base64.b64encode(
+                '123:456:{}'.format(front).encode('utf-8')
+            ).decode('ascii')
+
+        digest = panki.collection.fields_digest
+        notes = {
+            # unchanged
+            guid(0): (1, 456, 123, digest('0\x1fb')),
+            # changed fields
+            guid(1): (2, 456, 123, digest('1\x1fa')),
+            # moved to another deck
+            guid(2): (3, 456, 789, digest('2\x1fb')),
+            # no longer in the project
+            guid(9): (4, 456, 123, digest('9\x1fb'))
+        }
+        note = MagicMock()
+        collection.getNote.return_value = note
+        collection.db.list.return_value = [31, 32]
+        count = panki.collection.add_notes(
+            collection, deck, note_group, notes=notes
+        )
+        self.assertEqual(count, 4)
+        collection.getNote.assert_called_once_with(2)
+        self.assertEqual(note.fields, ['1', 'b'])
+        note.flush.assert_called_once_with()
+        collection.set_deck.assert_called_once_with([31, 32], 123)
+        self.assertEqual(collection.add_note.call_count, 1)
+        self.assertEqual(list(notes), [guid(9)])
+        # a note of another note type is replaced
+        notes = {guid(0): (1, 999, 123, digest('0\x1fb'))}
+        collection.add_note.reset_mock()
+        panki.collection.add_notes(
+            collection, deck, note_group, notes=notes
+        )
+        collection.remove_notes.assert_called_once_with([1])
+        self.assertEqual(collection.add_note.call_count, 4)
+
+    def test_index_notes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'collection.anki2')
+            conn = sqlite3.connect(path)
+            conn.execute(
+                'CREATE TABLE notes (id INTEGER PRIMARY KEY, guid TEXT, '
+                'mid INTEGER, flds TEXT)'
+            )
+            conn.execute(
+                'CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, '
+                'did INTEGER)'
+            )
+            conn.execute("INSERT INTO notes VALUES (1, 'a', 5, 'x\x1fy')")
+            conn.execute("INSERT INTO notes VALUES (2, 'b', 6, 'z')")
+            conn.execute('INSERT INTO cards VALUES (10, 1, 8)')
+            conn.execute('INSERT INTO cards VALUES (11, 1, 7)')
+            conn.commit()
+            conn.close()
+            self.assertEqual(panki.collection.index_notes(path), {
+                'a': (1, 5, 7, panki.collection.fields_digest('x\x1fy')),
+                'b': (2, 6, None, panki.collection.fields_digest('z'))
+            })
+
+    def test_prune_notes(self):
+        collection = MagicMock()
+        project = panki.config.ProjectConfig()
+        project.add_note_type(id=5, name='Foo')
+        notes = {'a': (1, 5, 7, b''), 'b': (2, 6, 7, b'')}
+        self.assertEqual(
+            panki.collection.prune_notes(collection, project, notes), 1
+        )
+        collection.remove_notes.assert_called_once_with([1])
+
+    def create_note_type_project(self, front='{{Front}}'):
+        project = panki.config.ProjectConfig()
+        note_type = project.add_note_type(
+            id=456, name='Basic', fields=['Front', 'Back']
+        )
+        card_type = note_type.add_card_type(name='Card 1')
+        file = panki.file.create_file(
+            'card.html', {'front': [front], 'back': ['{{Back}}']}
+        )
+        card_type.set_template(file.path, file)
+        return project
+
+    def test_add_note_types_unchanged(self):
+        project = self.create_note_type_project()
+        collection = MagicMock()
+        collection.models.get.return_value = None
+        collection.models.new.return_value = {'flds': [], 'tmpls': []}
+        collection.models.new_field.side_effect = \
+            lambda name: {'name': name, 'ord': None}
+        collection.models.new_template.side_effect = \
+            lambda name: {'name': name, 'ord': None}
+        collection.models.add_field.side_effect = \
+            lambda model, field: model['flds'].append(field)
+        collection.models.add_template.side_effect = \
+            lambda model, template: model['tmpls'].append(template)
+        fingerprints = panki.collection.add_note_types(collection, project)
+        model, = collection.models.save.call_args[0]
+        self.assertEqual(model['pankiFingerprint'], fingerprints[456])
+        # the same note type leaves the saved model untouched
+        collection.models.save.reset_mock()
+        collection.models.get.return_value = model
+        self.assertEqual(
+            panki.collection.add_note_types(collection, project),
+            fingerprints
+        )
+        collection.models.save.assert_not_called()
+        # a changed template updates the model, keeping its fields
+        for field in model['flds'] + model['tmpls']:
+            field['ord'] = 0 if field['name'] in ('Front', 'Card 1') else 1
+        project = self.create_note_type_project(front='{{Front}}!')
+        changed = panki.collection.add_note_types(collection, project)
+        self.assertNotEqual(changed[456], fingerprints[456])
+        collection.models.save.assert_called_once_with(model)
+        self.assertEqual(
+            [(field['name'], field['ord']) for field in model['flds']],
+            [('Front', 0), ('Back', 1)]
+        )
+        self.assertEqual(model['tmpls'][0]['ord'], 0)
+        self.assertTrue(model['tmpls'][0]['qfmt'].endswith('{{Front}}!'))
+        self.assertEqual(model['pankiFingerprint'], changed[456])
+
+    def test_keep_note_type_mods(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project = panki.config.ProjectConfig(
+                path=os.path.join(temp_dir, 'project.json')
+            )
+            path = os.path.join(temp_dir, 'collection.anki2')
+
+            def build(mods, fingerprints):
+                if os.path.exists(path):
+                    os.unlink(path)
+                conn = sqlite3.connect(path)
+                conn.execute(
+                    'CREATE TABLE notetypes (id INTEGER PRIMARY KEY, '
+                    'mtime_secs INTEGER)'
+                )
+                conn.executemany('INSERT INTO notetypes VALUES (?, ?)', mods)
+                conn.commit()
+                conn.close()
+                panki.collection.keep_note_type_mods(
+                    path, project, fingerprints
+                )
+                conn = sqlite3.connect(path)
+                rows = conn.execute(
+                    'SELECT id, mtime_secs FROM notetypes ORDER BY id'
+                ).fetchall()
+                conn.close()
+                return rows
+
+            self.assertEqual(
+                build([(1, 100), (2, 100)], {1: 'a', 2: 'b'}),
+                [(1, 100), (2, 100)]
+            )
+            # only the unchanged note type keeps its modification time
+            self.assertEqual(
+                build([(1, 200), (2, 200)], {1: 'a', 2: 'c'}),
+                [(1, 100), (2, 200)]
+            )
+            self.assertEqual(
+                build([(1, 300), (2, 300)], {1: 'a', 2: 'c'}),
+                [(1, 100), (2, 200)]
+            )
+
+    def test_split_records(self):
+        project = MagicMock()
+        sizes = [[[5], [1, 0]], [[4]]]
+        project.decks = [
+            MagicMock(notes=[
+                MagicMock(data=[
+                    MagicMock(**{'file.contents': [{}] * size})
+                    for size in group
+                ])
+                for group in deck
+            ])
+            for deck in sizes
+        ]
+        self.assertEqual(panki.collection.split_records(project, 3), [
+            [(0, 0, 0, 0, 4)],
+            [(0, 0, 0, 4, 5), (0, 1, 0, 0, 1), (1, 0, 0, 0, 2)],
+            [(1, 0, 0, 2, 4)]
+        ])
+        self.assertEqual(panki.collection.split_records(project, 1), [[
+            (0, 0, 0, 0, 5), (0, 1, 0, 0, 1), (1, 0, 0, 0, 4)
+        ]])
+        self.assertEqual(len(panki.collection.split_records(project, 20)), 10)
+
+    def create_shard(self, path, notes, cards):
+        conn = sqlite3.connect(path)
+        conn.create_collation('unicase', panki.collection.unicase)
+        conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, guid TEXT)')
+        conn.execute(
+            'CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, '
+            'type INTEGER, due INTEGER)'
+        )
+        conn.execute(
+            'CREATE TABLE tags (tag TEXT NOT NULL PRIMARY KEY COLLATE unicase)'
+        )
+        conn.executemany('INSERT INTO notes VALUES (?, ?)', notes)
+        conn.executemany('INSERT INTO cards VALUES (?, ?, ?, ?)', cards)
+        conn.execute('INSERT INTO tags VALUES (?)', ('Tag',))
+        conn.execute('INSERT INTO tags VALUES (?)', (os.path.basename(path),))
+        conn.commit()
+        conn.close()
+
+    def test_merge_collections(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [
+                os.path.join(temp_dir, name)
+                for name in ('main.anki2', 'shard1.anki2', 'shard2.anki2')
+            ]
+            self.create_shard(paths[0], [], [])
+            self.create_shard(
+                paths[1],
+                [(100, 'a'), (101, 'b')],
+                [(200, 100, 0, 1), (201, 101, 0, 2)]
+            )
+            self.create_shard(
+                paths[2],
+                [(100, 'c')],
+                [(200, 100, 0, 1), (201, 100, 2, 30)]
+            )
+            position = panki.collection.merge_collections(
+                paths[0],
+                paths[1:]
+            )
+            self.assertEqual(position, 4)
+            conn = sqlite3.connect(paths[0])
+            conn.create_collation('unicase', panki.collection.unicase)
+            self.assertEqual(
+                conn.execute('SELECT * FROM notes ORDER BY id').fetchall(),
+                [(100, 'a'), (101, 'b'), (102, 'c')]
+            )
+            self.assertEqual(
+                conn.execute('SELECT * FROM cards ORDER BY id').fetchall(),
+                [
+                    (200, 100, 0, 1),
+                    (201, 101, 0, 2),
+                    (202, 102, 0, 3),
+                    (203, 102, 2, 30)
+                ]
+            )
+            self.assertEqual(conn.execute(
+                'SELECT tag FROM tags ORDER BY tag'
+            ).fetchall(), [('main.anki2',), ('shard1.anki2',),
+                           ('shard2.anki2',), ('Tag',)])
+            conn.close()
+
+    def test_add_media(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for path, contents in (
+                    (('media', 'a.png'), 'a'),
+                    (('media', 'sub', 'b.png'), 'b'),
+                    (('media2', 'c.png'), 'a'),
+                    (('media2', 'a.png'), 'z')):
+                path = os.path.join(temp_dir, *path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as file:
+                    file.write(contents)
+            collection_media_dir = os.path.join(temp_dir, 'collection.media')
+            os.makedirs(collection_media_dir)
+            collection = MagicMock()
+            collection.media.dir.return_value = collection_media_dir
+            project = panki.config.ProjectConfig(
+                path=os.path.join(temp_dir, 'project.json'),
+                media=['media', 'media2']
+            )
+            panki.collection.add_media(collection, project)
+            self.assertEqual(
+                sorted(os.listdir(collection_media_dir)),
+                ['a.png', 'b.png', 'c.png']
+            )
+            collection.media.add_file.assert_called_once_with(
+                os.path.join(os.path.realpath(temp_dir), 'media2', 'a.png')
+            )
+            self.assertTrue(os.path.exists(
+                os.path.join(project.cache_dir, 'media.json')
+            ))
+
+    def test_dump_collection(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            collection_path = os.path.join(temp_dir, 'collection.anki2')
+            conn = sqlite3.connect(collection_path)
+            conn.execute('CREATE TABLE notes (id INTEGER, flds TEXT)')
+            conn.execute('CREATE TABLE graves (oid INTEGER)')
+            conn.executemany(
+                'INSERT INTO notes VALUES (?, ?)',
+                [(i, 'note {}'.format(i)) for i in range(5)]
+            )
+            conn.commit()
+            conn.close()
+            collection = MagicMock()
+            collection.path = collection_path
+            progress = MagicMock()
+            panki.collection.dump_collection(
+                collection, temp_dir, chunk_size=2, progress=progress
+            )
+            collection.close.assert_called_with()
+            notes_dir = os.path.join(temp_dir, 'tables', 'notes')
+            with open(os.path.join(notes_dir, 'rows.csv'), 'r') as file:
+                self.assertEqual(file.read(), ''.join([
+                    'flds,id\n',
+                    'note 0,0\n',
+                    'note 1,1\n',
+                    'note 2,2\n',
+                    'note 3,3\n',
+                    'note 4,4\n'
+                ]))
+            with open(os.path.join(notes_dir, 'schema.sql'), 'r') as file:
+                self.assertEqual(
+                    file.read(),
+                    'CREATE TABLE notes (id INTEGER, flds TEXT);'
+                )
+            self.assertTrue(
+                os.path.exists(os.path.join(notes_dir, 'table.json'))
+            )
+            graves_dir = os.path.join(temp_dir, 'tables', 'graves')
+            self.assertFalse(
+                os.path.exists(os.path.join(graves_dir, 'rows.csv'))
+            )
+            notes_calls = [
+                c for c in progress.call_args_list if c[0][0] == 'notes'
+            ]
+            self.assertEqual(
+                [(c[0][1], c[0][3]) for c in notes_calls],
+                [(2, False), (4, False), (5, False), (5, True)]
+            )
+
+    def create_dump_collection(self, temp_dir):
+        collection_path = os.path.join(temp_dir, 'collection.anki2')
+        conn = sqlite3.connect(collection_path)
+        conn.execute('CREATE TABLE notes (id INTEGER, flds TEXT)')
+        conn.execute('CREATE TABLE cards (id INTEGER, nid INTEGER)')
+        conn.executemany(
+            'INSERT INTO notes VALUES (?, ?)',
+            [(i, 'note {}'.format(i)) for i in range(5)]
+        )
+        conn.commit()
+        conn.close()
+        collection = MagicMock()
+        collection.path = collection_path
+        return collection
+
+    def test_dump_collection_filtered_jsonl(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            collection = self.create_dump_collection(temp_dir)
+            panki.collection.dump_collection(
+                collection, temp_dir, tables=['notes'], where='id > 1',
+                limit=2, format='jsonl'
+            )
+            self.assertEqual(
+                os.listdir(os.path.join(temp_dir, 'tables')),
+                ['notes']
+            )
+            path = os.path.join(temp_dir, 'tables', 'notes', 'rows.jsonl')
+            with open(path, 'r') as file:
+                self.assertEqual(file.read(), ''.join([
+                    '{"flds": "note 2", "id": 2}\n',
+                    '{"flds": "note 3", "id": 3}\n'
+                ]))
+
+    def test_dump_collection_sqlite(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            collection = self.create_dump_collection(temp_dir)
+            panki.collection.dump_collection(
+                collection, temp_dir, tables=['notes'], limit=3,
+                format='sqlite'
+            )
+            path = os.path.join(temp_dir, 'tables', 'notes', 'rows.sqlite.gz')
+            db_path = os.path.join(temp_dir, 'notes.db')
+            with gzip.open(path, 'rb') as src, open(db_path, 'wb') as dst:
+                dst.write(src.read())
+            conn = sqlite3.connect(db_path)
+            self.assertEqual(
+                conn.execute('SELECT * FROM notes').fetchall(),
+                [(0, 'note 0'), (1, 'note 1'), (2, 'note 2')]
+            )
+            conn.close()
+
+    def test_dump_collection_unknown_table(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            collection = self.create_dump_collection(temp_dir)
+            with self.assertRaises(ValueError):
+                panki.collection.dump_collection(
+                    collection, temp_dir, tables=['foo']
+                )
+
+    def create_normalize_collection(self, path, first_id):
+        conn = sqlite3.connect(path)
+        conn.execute(
+            'CREATE TABLE col (id INTEGER PRIMARY KEY, crt INTEGER, '
+            'mod INTEGER, scm INTEGER, ls INTEGER, conf TEXT, models TEXT, '
+            'decks TEXT, dconf TEXT, tags TEXT)'
+        )
+        conn.execute(
+            'CREATE TABLE notes (id INTEGER PRIMARY KEY, guid TEXT, '
+            'mid INTEGER, mod INTEGER)'
+        )
+        conn.execute(
+            'CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, '
+            'ord INTEGER, mod INTEGER, type INTEGER)'
+        )
+        conn.execute(
+            'CREATE TABLE revlog (id INTEGER PRIMARY KEY, cid INTEGER)'
+        )
+        conn.execute('CREATE INDEX ix_cards_nid ON cards (nid)')
+        models = {
+            '1': {'id': 1, 'name': 'Foo', 'mod': first_id},
+            str(first_id): {'id': first_id, 'name': 'Basic', 'mod': first_id}
+        }
+        if first_id % 2:
+            models = dict(reversed(list(models.items())))
+        conn.execute(
+            'INSERT INTO col VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                first_id, first_id, first_id, first_id,
+                json.dumps({'curModel': first_id, 'nextPos': 3}),
+                json.dumps(models),
+                json.dumps({'1': {'id': 1, 'mod': first_id}}),
+                json.dumps({'1': {'id': 1, 'mod': first_id}}),
+                '{}'
+            )
+        )
+        for i, guid in enumerate(('foo', 'bar')):
+            note_id = first_id + i
+            conn.execute(
+                'INSERT INTO notes VALUES (?, ?, 1, ?)',
+                (note_id, guid, first_id)
+            )
+            for ord in range(2):
+                conn.execute(
+                    'INSERT INTO cards VALUES (?, ?, ?, ?, 0)',
+                    (first_id + 10 + i * 2 + ord, note_id, ord, first_id)
+                )
+        conn.commit()
+        conn.close()
+
+    def test_normalize_collection(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            contents = []
+            for first_id in (1000, 2001):
+                path = os.path.join(temp_dir, '{}.anki2'.format(first_id))
+                self.create_normalize_collection(path, first_id)
+                panki.collection.normalize_collection(path, 1600000000)
+                with open(path, 'rb') as file:
+                    contents.append(file.read())
+            self.assertEqual(contents[0], contents[1])
+            conn = sqlite3.connect(path)
+            col = conn.execute(
+                'SELECT crt, mod, conf, models FROM col'
+            ).fetchone()
+            self.assertEqual(col[0], 1599955200)
+            self.assertEqual(col[1], 1600000000000)
+            self.assertEqual(json.loads(col[2])['curModel'], 1)
+            self.assertEqual(list(json.loads(col[3])), ['1'])
+            notes = dict(conn.execute('SELECT guid, id FROM notes'))
+            end = 1600000000000
+            self.assertEqual(
+                notes['foo'],
+                panki.util.stable_id('foo', end=end)
+            )
+            self.assertTrue(all(id < end for id in notes.values()))
+            cards = conn.execute(
+                'SELECT c.id, n.guid, c.ord, c.mod FROM cards c '
+                'JOIN notes n ON n.id = c.nid'
+            ).fetchall()
+            self.assertEqual(len(cards), 4)
+            for card_id, guid, ord, mod in cards:
+                self.assertEqual(
+                    card_id,
+                    panki.util.stable_id(guid, ord, end=end)
+                )
+                self.assertLess(card_id, end)
+                self.assertEqual(mod, 1600000000)
+            conn.close()
+
+    def test_stabilize_notes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project = panki.config.ProjectConfig(
+                path=os.path.join(temp_dir, 'project.json')
+            )
+            path = os.path.join(temp_dir, 'collection.anki2')
+
+            def build(first_id, notes, timestamp):
+                if os.path.exists(path):
+                    os.unlink(path)
+                conn = sqlite3.connect(path)
+                conn.execute(
+                    'CREATE TABLE notes (id INTEGER PRIMARY KEY, guid TEXT, '
+                    'mid INTEGER, mod INTEGER, tags TEXT, flds TEXT)'
+                )
+                conn.execute(
+                    'CREATE TABLE cards (id INTEGER PRIMARY KEY, '
+                    'nid INTEGER, ord INTEGER, mod INTEGER, type INTEGER)'
+                )
+                conn.execute(
+                    'CREATE TABLE revlog (id INTEGER PRIMARY KEY, cid INTEGER)'
+                )
+                for i, (guid, fields) in enumerate(notes):
+                    conn.execute(
+                        "INSERT INTO notes VALUES (?, ?, 1, ?, '', ?)",
+                        (first_id + i, guid, first_id, fields)
+                    )
+                    conn.execute(
+                        'INSERT INTO cards VALUES (?, ?, 0, ?, 0)',
+                        (first_id + 10 + i, first_id + i, first_id)
+                    )
+                conn.commit()
+                conn.close()
+                panki.collection.stabilize_notes(path, project, timestamp)
+                conn = sqlite3.connect(path)
+                rows = conn.execute(
+                    'SELECT n.guid, n.id, n.mod, c.id, c.mod FROM notes n '
+                    'JOIN cards c ON c.nid = n.id ORDER BY n.guid'
+                ).fetchall()
+                conn.close()
+                return rows
+
+            rows = build(1000, [('foo', 'a'), ('bar', 'b')], 1700000000)
+            self.assertEqual(rows, [
+                ('bar', panki.util.stable_id('bar'), 1700000000,
+                 panki.util.stable_id('bar', 0), 1700000000),
+                ('foo', panki.util.stable_id('foo'), 1700000000,
+                 panki.util.stable_id('foo', 0), 1700000000)
+            ])
+            # only the modified and new notes get the new timestamp
+            rows = build(
+                2000,
+                [('foo', 'a'), ('bar', 'c'), ('baz', 'd')],
+                1700000100
+            )
+            self.assertEqual(
+                [(guid, mod, card_mod) for guid, _, mod, _, card_mod in rows],
+                [
+                    ('bar', 1700000100, 1700000100),
+                    ('baz', 1700000100, 1700000100),
+                    ('foo', 1700000000, 1700000000)
+                ]
+            )
+            self.assertEqual(rows[2][1], panki.util.stable_id('foo'))
+            # IDs are creation times, so they are never after the build
+            rows = build(3000, [('foo', 'a')], 1000)
+            self.assertLess(rows[0][1], 1000 * 1000)
+            self.assertLess(rows[0][3], 1000 * 1000)
@@ -1,8 +1,11 @@
 import os
+import sqlite3
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 import panki.config
 import panki.file
+from panki.records import Records
 
 
 class TestConfig(unittest.TestCase):
@@ -268,6 +271,192 @@ class TestConfig(unittest.TestCase):
         _exists.assert_called_with('build')
         _rmtree.assert_called_with('build')
         _makedirs.assert_called_with('build')
+        _rmtree.reset_mock()
+        _makedirs.reset_mock()
+        self.assertEqual('build', project.create_build_dir(clean=False))
+        _rmtree.assert_not_called()
+        _makedirs.assert_not_called()
+
+    @patch('panki.config.scan_media_dirs')
+    def test_source_paths(self, _scan_media_dirs):
+        project = panki.config.ProjectConfig(path='project.json')
+        note_type = project.add_note_type(name='Foo')
+        note_type.add_css('foo.css', panki.file.File('foo.css'))
+        card_type = note_type.add_card_type(name='Foo Card')
+        card_type.set_template('foo.html', panki.file.File('foo.html'))
+        deck = project.add_deck(
+            path='deck.json',
+            file=panki.file.File('deck.json'),
+            name='Foo Deck'
+        )
+        note_group = deck.add_notes(type='Foo')
+        note_group.add_data('foo.csv', panki.file.File('foo.csv'))
+        _scan_media_dirs.return_value = [MagicMock(path='media/foo.png')]
+        self.assertEqual(
+            [os.path.basename(path) for path in project.source_paths()],
+            [
+                'project.json', 'foo.css', 'foo.html', 'deck.json',
+                'foo.csv', 'foo.png'
+            ]
+        )
+
+    def test_validate_project(self):
+        project = panki.config.ProjectConfig(path='project.json')
+        project.add_note_type(name='Foo', fields=['Front', 'Back'])
+        deck = project.add_deck(name='Foo Deck')
+        note_group = deck.add_notes(type='Foo')
+        note_group.add_data('foo.csv', panki.file.File('foo.csv', [
+            {'Front': 'a', 'Back': 'b'},
+            {'Front': 'c'}
+        ]))
+        deck.add_notes(type='Bar')
+        self.assertEqual(panki.config.validate_project(project), [
+            '{}: record 2: missing Back'.format(os.path.abspath('foo.csv')),
+            'Foo Deck: unknown note type: Bar'
+        ])
+
+    def test_validate_project_templates(self):
+        project = panki.config.ProjectConfig(path='project.json')
+        note_type = project.add_note_type(name='Foo', fields=['Front'])
+        card_type = note_type.add_card_type(name='Card 1')
+        card_type.set_template('card1.html', panki.file.TemplateFile(
+            'card1.html',
+            {
+                'front': ['{{Front}}{{#Back}}{{text:Back}}{{/Back}}'],
+                'back': ['{{FrontSide}}<hr>{{Tags}}{{!comment}}']
+            }
+        ))
+        note_type.add_card_type(name='Card 2')
+        self.assertEqual(panki.config.validate_project(project), [
+            'Foo: Card 1: unknown fields in template: Back',
+            'Foo: Card 2: missing template'
+        ])
+
+    def test_validate_project_guids(self):
+        project = panki.config.ProjectConfig(path='project.json')
+        project.add_note_type(id=2, name='Foo', fields=['Front', 'Back'])
+        deck = project.add_deck(id=1, name='Foo Deck')
+        deck.add_notes(type='Foo').add_data(
+            'foo.csv',
+            panki.file.File('foo.csv', Records.from_rows(
+                ['Front', 'Back'],
+                [['a', 'b'], ['c', 'd'], ['a', 'e']]
+            ))
+        )
+        deck.add_notes(type='Foo', guid='{Back}').add_data(
+            'bar.csv',
+            panki.file.File('bar.csv', Records.from_rows(
+                ['Front'], [['a']]
+            ))
+        )
+        deck.add_notes(type='Foo', guid='{Extra').add_data(
+            'baz.csv',
+            panki.file.File('baz.csv', [])
+        )
+        deck.add_notes(type='Foo', guid='{Extra}').add_data(
+            'qux.csv',
+            panki.file.File('qux.csv', Records.from_dicts([
+                {'Front': 'x', 'Back': 'y', 'Extra': 1},
+                {'Front': 'x', 'Back': 'y'},
+                {'Front': 'z', 'Back': 'y', 'Extra': 1}
+            ]))
+        )
+        self.assertEqual(panki.config.validate_project(project), [
+            '{}: record 3: duplicate GUID: 1:2:a'.format(
+                os.path.abspath('foo.csv')
+            ),
+            '{}: missing columns: Back'.format(os.path.abspath('bar.csv')),
+            'Foo Deck: invalid GUID format: {Extra: '
+            "expected '}' before end of string",
+            '{}: record 2: unknown field in GUID: Extra'.format(
+                os.path.abspath('qux.csv')
+            ),
+            '{}: record 3: duplicate GUID: 1'.format(
+                os.path.abspath('qux.csv')
+            )
+        ])
+
+    def test_validate_project_lazy(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project = panki.config.ProjectConfig(
+                path=os.path.join(temp_dir, 'project.json')
+            )
+            project.add_note_type(name='Foo', fields=['Front', 'Back'])
+            deck = project.add_deck(name='Foo Deck')
+            for name, records in (
+                    ('foo.csv', [{'Front': 'a', 'Back': 'b'}]),
+                    ('bar.csv', [{'Front': 'a'}]),
+                    ('baz.jsonl', [{'Front': 'a'}, {'Front': 'b', 'Back': 1}]),
+                    ('qux.jsonl', [])):
+                path = os.path.join(temp_dir, name)
+                panki.file.create_data_file(path, records).write()
+                deck.add_notes(type='Foo').add_data(
+                    name,
+                    panki.file.load_data_file(path, lazy=True)
+                )
+            # only the header or first record of lazily loaded files is read
+            self.assertEqual(panki.config.validate_project(project), [
+                '{}: missing columns: Back'.format(
+                    os.path.join(temp_dir, 'bar.csv')
+                ),
+                '{}: missing columns: Back'.format(
+                    os.path.join(temp_dir, 'baz.jsonl')
+                )
+            ])
+            for note_group in deck.notes:
+                self.assertEqual(note_group.data[0].file.contents, [])
+
+    def test_load_project_database(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            conn = sqlite3.connect(os.path.join(temp_dir, 'notes.db'))
+            with conn:
+                conn.execute('CREATE TABLE notes (Front, Back)')
+                conn.execute('INSERT INTO notes VALUES (?, ?)', ('a', 1))
+            conn.close()
+            data = [
+                {'path': 'notes.db', 'table': 'notes'},
+                {'path': 'notes.db', 'query': 'SELECT Front FROM notes'}
+            ]
+            panki.file.create_file(
+                os.path.join(temp_dir, 'project.json'),
+                {
+                    'noteTypes': [
+                        {'name': 'Foo', 'fields': ['Front', 'Back']}
+                    ],
+                    'decks': [{
+                        'id': 1,
+                        'name': 'Foo Deck',
+                        'notes': [{'type': 'Foo', 'data': data}]
+                    }]
+                }
+            ).write()
+            project = panki.config.load_project(temp_dir)
+            note_group = project.decks[0].notes[0]
+            self.assertEqual(dict(note_group)['data'], data)
+            self.assertEqual(
+                list(note_group.data[0].file.iter_records()),
+                [{'Front': 'a', 'Back': '1'}]
+            )
+            db_path = os.path.join(os.path.realpath(temp_dir), 'notes.db')
+            self.assertEqual(panki.config.validate_project(project), [
+                '{}: missing columns: Back'.format(db_path)
+            ])
+            note_group.data[0].file = panki.file.SqliteFile(db_path)
+            self.assertEqual(panki.config.validate_project(project)[0], (
+                '{}: a table or query is needed to read records from a '
+                'database'.format(db_path)
+            ))
+            # databases need a table or a query
+            for source in (
+                    {'path': 'notes.db'},
+                    {'table': 'notes'},
+                    {'path': 'notes.db', 'table': 'notes', 'query': 'x'}):
+                with self.subTest(source=source):
+                    deck = panki.config.DeckConfig(id=2, name='Bar Deck')
+                    with self.assertRaisesRegex(ValueError, 'Bar Deck: a'):
+                        panki.config.load_deck_note_group(
+                            project, deck, {'type': 'Foo', 'data': [source]}
+                        )
 
     @patch('panki.file.os.path.abspath')
     @patch('panki.config.os.path.realpath')
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+import panki.config
+import panki.dedupe
+import panki.file
+
+
+class TestDedupe(unittest.TestCase):
+
+    def test_record_text(self):
+        self.assertEqual(
+            panki.dedupe.record_text(
+                {'Front': '  Hello\nWorld ', 'Back': 42, 'Extra': None}
+            ),
+            'hello world 42'
+        )
+
+    def test_minhash(self):
+        text = 'the quick brown fox jumps over the lazy dog'
+        sketch = panki.dedupe.minhash(text)
+        self.assertEqual(len(sketch), panki.dedupe.num_bins * 8)
+        self.assertEqual(sketch, panki.dedupe.minhash(text))
+        self.assertEqual(panki.dedupe.similarity(sketch, sketch), 1)
+        similar = panki.dedupe.minhash(text + ' again')
+        different = panki.dedupe.minhash('lorem ipsum dolor sit amet')
+        self.assertGreater(
+            panki.dedupe.similarity(sketch, similar),
+            panki.dedupe.similarity(sketch, different)
+        )
+        self.assertLess(panki.dedupe.similarity(sketch, different), 0.2)
+
+    def test_find_duplicates(self):
+        sentence = 'the quick brown fox jumps over the lazy dog'
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project = panki.config.ProjectConfig(
+                path=os.path.join(temp_dir, 'project.json')
+            )
+            deck = project.add_deck(id=1, name='Foo')
+            for name, records in (
+                    ('a.csv', [
+                        {'Front': sentence, 'Back': 'one'},
+                        {'Front': 'lorem ipsum dolor sit amet', 'Back': 'x'},
+                        {'Front': 'unique', 'Back': 'y'}
+                    ]),
+                    ('b.csv', [
+                        {'Front': 'LOREM ipsum  dolor sit amet', 'Back': 'X'},
+                        {'Front': sentence, 'Back': 'one!'}
+                    ])):
+                path = os.path.join(temp_dir, name)
+                panki.file.create_file(path, records).write()
+                note_group = deck.add_notes(type='Basic')
+                note_group.add_data(name, panki.file.load_data_file(path))
+            records, clusters = panki.dedupe.find_duplicates(
+                project, threshold=0.7, max_workers=1
+            )
+        self.assertEqual(records, 5)
+        self.assertEqual(
+            [
+                (cluster['exact'], [
+                    (os.path.basename(path), row)
+                    for path, _, _, row, _ in cluster['records']
+                ])
+                for cluster in clusters
+            ],
+            [
+                (False, [('a.csv', 1), ('b.csv', 2)]),
+                (True, [('a.csv', 2), ('b.csv', 1)])
+            ]
+        )
+        self.assertEqual(
+            clusters[1]['records'][0][1:4],
+            ('Foo', 'Basic', 2)
+        )
+
+    def test_find_duplicates_threshold(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project = panki.config.ProjectConfig(
+                path=os.path.join(temp_dir, 'project.json')
+            )
+            path = os.path.join(temp_dir, 'symbols.csv')
+            panki.file.create_file(path, [
+                {'Element': 'hydrogen', 'Symbol': 'h'},
+                {'Element': 'hydrogen', 'Symbol': '1'}
+            ]).write()
+            project.add_deck(id=1, name='Foo').add_notes(type='Basic') \
+                .add_data('symbols.csv', panki.file.load_data_file(path))
+            # the sketches of the records are similar enough, but their
+            # shingles aren't
+            texts = ['hydrogen h', 'hydrogen 1']
+            self.assertGreaterEqual(
+                panki.dedupe.similarity(*map(panki.dedupe.minhash, texts)),
+                0.8
+            )
+            self.assertLess(panki.dedupe.jaccard(*texts), 0.8)
+            self.assertEqual(
+                panki.dedupe.find_duplicates(project, max_workers=1),
+                (2, [])
+            )
+            records, clusters = panki.dedupe.find_duplicates(
+                project, threshold=0.7, max_workers=1
+            )
+            self.assertEqual(
+                [record[3] for record in clusters[0]['records']],
+                [1, 2]
+            )
@@ -1,4 +1,6 @@
 import os
+import sqlite3
+import tempfile
 import unittest
 from unittest.mock import call, mock_open, patch
 import panki.file
@@ -268,7 +270,8 @@ class TestFile(unittest.TestCase):
             file.contents,
             _file,
             ensure_ascii=False,
-            indent=2
+            indent=2,
+            default=panki.file.json_default
         )
 
     def test_write_json_file_compact(self):
@@ -298,15 +301,15 @@ class TestFile(unittest.TestCase):
         self.assertEqual(file.contents, self.yaml_contents)
         _open.assert_called_with(file.path, 'r')
 
-    @patch('panki.file.yaml')
-    def test_write_yaml_file(self, _yaml):
+    @patch('yaml.dump')
+    def test_write_yaml_file(self, _dump):
         file = panki.file.YamlFile('file.yaml', self.yaml_contents)
         _open = mock_open()
         with patch('panki.file.open', _open):
             file.write()
         _open.assert_called_with(file.path, 'w')
         _file = _open()
-        _yaml.dump.assert_called_with(file.contents, _file, indent=2)
+        _dump.assert_called_with(file.contents, _file, indent=2)
 
     def test_read_csv_file(self):
         file = panki.file.CsvFile('file.csv')
@@ -358,6 +361,121 @@ class TestFile(unittest.TestCase):
             call('six,five\n')
         ])
 
+    def test_write_csv_file_rows(self):
+        file = panki.file.CsvFile('file.csv')
+        file.fields = ['Foo', 'Bar']
+        _open = mock_open()
+        with patch('panki.file.open', _open):
+            file.write_rows(iter([('one', 'two'), ('three', 'four')]))
+        _open.assert_called_with(file.path, 'w')
+        _file = _open()
+        _file.write.assert_has_calls([
+            call('Foo,Bar\n'),
+            call('one,two\n'),
+            call('three,four\n')
+        ])
+
+    def test_read_json_lines_file(self):
+        file = panki.file.JsonLinesFile('file.jsonl')
+        _open = mock_open(read_data='{"Foo": "one"}\n\n{"Foo": "水"}\n')
+        with patch('panki.file.open', _open):
+            file.read()
+        self.assertEqual(file.contents, [{'Foo': 'one'}, {'Foo': '水'}])
+        _open.assert_called_with(file.path, 'r')
+
+    def test_write_json_lines_file(self):
+        file = panki.file.JsonLinesFile(
+            'file.jsonl',
+            [{'Foo': 'one'}, {'Foo': '水'}]
+        )
+        _open = mock_open()
+        with patch('panki.file.open', _open):
+            file.write()
+        _open.assert_called_with(file.path, 'w')
+        _file = _open()
+        _file.write.assert_has_calls([
+            call('{"Foo": "one"}\n'),
+            call('{"Foo": "水"}\n')
+        ])
+
+    def test_write_json_lines_file_rows(self):
+        file = panki.file.JsonLinesFile('file.jsonl', fields=['Foo', 'Bar'])
+        _open = mock_open()
+        with patch('panki.file.open', _open):
+            file.write_rows(iter([('one', b'two'), ('three', None)]))
+        _file = _open()
+        _file.write.assert_has_calls([
+            call('{"Foo": "one", "Bar": "dHdv"}\n'),
+            call('{"Foo": "three", "Bar": null}\n')
+        ])
+
+    def test_iter_csv_file_records(self):
+        file = panki.file.CsvFile('file.csv')
+        _open = mock_open(read_data='Foo,Bar\none,two\nthree,four\n')
+        with patch('panki.file.open', _open):
+            records = list(file.iter_records())
+        self.assertEqual(records, [
+            {'Foo': 'one', 'Bar': 'two'},
+            {'Foo': 'three', 'Bar': 'four'}
+        ])
+        self.assertEqual(file.contents, [])
+        file.contents = [{'Foo': 'five'}]
+        self.assertEqual(list(file.iter_records()), [{'Foo': 'five'}])
+
+    def test_iter_json_lines_file_records(self):
+        file = panki.file.JsonLinesFile('file.jsonl')
+        _open = mock_open(read_data='{"Foo": "one"}\n\n{"Foo": "水"}\n')
+        with patch('panki.file.open', _open):
+            records = list(file.iter_records())
+        self.assertEqual(records, [{'Foo': 'one'}, {'Foo': '水'}])
+        self.assertEqual(file.contents, [])
+
+    def test_iter_json_file_records(self):
+        file = panki.file.JsonFile('file.json')
+        _open = mock_open(read_data='[{"Foo": "one"}]')
+        with patch('panki.file.open', _open):
+            records = list(file.iter_records())
+        self.assertEqual(records, [{'Foo': 'one'}])
+
+    def test_iter_sqlite_file_records(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'file.db')
+            conn = sqlite3.connect(path)
+            with conn:
+                conn.execute('CREATE TABLE "my notes" (Foo, Bar, Baz)')
+                conn.executemany(
+                    'INSERT INTO "my notes" VALUES (?, ?, ?)',
+                    [('one', 2, None), ('three', 4.5, b'two')]
+                )
+            conn.close()
+            file = panki.file.load_data_file(path, table='my notes')
+            self.assertIsInstance(file, panki.file.SqliteFile)
+            self.assertEqual(file.columns(), ['Foo', 'Bar', 'Baz'])
+            self.assertEqual(list(file.iter_records()), [
+                {'Foo': 'one', 'Bar': '2', 'Baz': ''},
+                {'Foo': 'three', 'Bar': '4.5', 'Baz': 'dHdv'}
+            ])
+            self.assertEqual(file.contents, [])
+            file = panki.file.load_data_file(
+                path,
+                query='SELECT Foo AS Front FROM "my notes" ORDER BY Bar DESC;'
+            )
+            self.assertEqual(file.columns(), ['Front'])
+            file.read()
+            self.assertEqual(file.contents, [
+                {'Front': 'three'},
+                {'Front': 'one'}
+            ])
+            with self.assertRaises(ValueError):
+                file.write()
+            with self.assertRaises(ValueError):
+                panki.file.load_data_file(path)
+            with self.assertRaises(FileNotFoundError):
+                panki.file.load_data_file(
+                    os.path.join(temp_dir, 'other.sqlite'),
+                    table='my notes'
+                )
+
     def test_prettify_css_file(self):
         file = panki.file.CssFile('file.css', self.css_contents)
         file.prettify()
@@ -500,9 +618,82 @@ class TestFile(unittest.TestCase):
                 self.assertIsInstance(file, cls)
                 _open.assert_called_with(file.path, 'r')
 
+    @patch('panki.file.os.path.exists')
+    def test_load_data_file_lazy(self, _exists):
+        _exists.return_value = True
+        _open = mock_open(read_data=self.csv_str)
+        with patch('panki.file.open', _open):
+            file = panki.file.load_data_file('file.csv', lazy=True)
+        self.assertIsInstance(file, panki.file.CsvFile)
+        self.assertEqual(file.contents, [])
+        _open.assert_not_called()
+        _exists.return_value = False
+        with self.assertRaises(FileNotFoundError):
+            panki.file.load_data_file('file.csv', lazy=True)
+
+    def test_data_file_columns(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name, records in (
+                    ('file.csv', [{'Back': 'b', 'Front': 'a'}]),
+                    ('file.jsonl', [{'Front': 'a'}, {'Back': 'b'}]),
+                    ('file.json', [{'Front': 'a', 'Back': 'b'}]),
+                    ('empty.jsonl', [])):
+                with self.subTest(name=name):
+                    path = os.path.join(temp_dir, name)
+                    panki.file.create_data_file(path, records).write()
+                    file = panki.file.load_data_file(path, lazy=True)
+                    self.assertEqual(
+                        file.columns(),
+                        list(records[0]) if records else None
+                    )
+                    # the contents of lazily loaded files are not kept
+                    self.assertEqual(file.contents, [])
+
     def test_load_data_file_bad_format(self):
         with self.assertRaises(ValueError):
             panki.file.load_data_file('file.asdf')
+        with self.assertRaises(ValueError):
+            panki.file.load_data_file('file.gz')
+        with self.assertRaises(ValueError):
+            panki.file.load_data_file('file.db.gz', table='notes')
+
+    def test_compressed_data_files(self):
+        records = [{'Front': 'one', 'Back': '水'}, {'Front': 'two'}]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name, cls in (
+                    ('file.csv.gz', panki.file.CsvFile),
+                    ('file.json.bz2', panki.file.JsonFile),
+                    ('file.jsonl.xz', panki.file.JsonLinesFile),
+                    ('file.yaml.gz', panki.file.YamlFile)):
+                with self.subTest(name=name):
+                    path = os.path.join(temp_dir, name)
+                    file = panki.file.create_data_file(path, records)
+                    self.assertIsInstance(file, cls)
+                    if cls is panki.file.CsvFile:
+                        file.fields = ['Front', 'Back']
+                    file.write()
+                    with open(path, 'rb') as raw:
+                        self.assertNotIn(b'Front', raw.read())
+                    expected = [
+                        {**record, 'Back': record.get('Back', '')}
+                        for record in records
+                    ] if cls is panki.file.CsvFile else records
+                    self.assertEqual(
+                        panki.file.load_data_file(path).contents,
+                        expected
+                    )
+                    file = panki.file.load_data_file(path, lazy=True)
+                    self.assertEqual(list(file.iter_records()), expected)
+
+    def test_file_extension(self):
+        self.assertEqual(panki.file.file_extension('file.csv'), '.csv')
+        self.assertEqual(panki.file.file_extension('file.csv.gz'), '.csv')
+        self.assertEqual(panki.file.file_extension('file.gz'), None)
+        self.assertEqual(
+            panki.file.compression_extension('file.csv.xz'),
+            '.xz'
+        )
+        self.assertIsNone(panki.file.compression_extension('file.csv'))
 
     @patch('panki.file.os.path.abspath')
     def test_create_data_file(self, _abspath):
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import panki.manifest
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_collection(self, rows):
+        collection = MagicMock()
+        collection.decks.deck_and_child_ids.return_value = [123, 124]
+        collection.db.execute.return_value = rows
+        collection.media.dir.return_value = self.dir
+        collection.models.get.return_value = {
+            'name': 'Foo',
+            'flds': [{'name': 'Front'}, {'name': 'Back'}],
+            'tmpls': [
+                {'name': 'Card 1', 'qfmt': '{{Front}}', 'afmt': '{{Back}}'}
+            ],
+            'css': '.card { background: url(bg.png) }'
+        }
+        return collection
+
+    def write(self, name, contents):
+        with open(os.path.join(self.dir, name), 'w') as file:
+            file.write(contents)
+
+    def test_package_manifest(self):
+        self.write('foo.png', 'foo')
+        self.write('bg.png', 'bg')
+        rows = [
+            ('foo', 10, '<img src="foo.png">\x1fbar', ''),
+            ('bar', 10, 'baz\x1fqux', ' tag ')
+        ]
+        collection = self.create_collection(rows)
+        manifest = panki.manifest.package_manifest(collection, 123)
+        collection.decks.deck_and_child_ids.assert_called_with(123)
+        self.assertIn('IN (123,124)', collection.db.execute.call_args[0][0])
+        self.assertEqual(sorted(manifest['notes']), ['bar', 'foo'])
+        self.assertEqual(
+            manifest,
+            panki.manifest.package_manifest(collection, 123)
+        )
+        # changing a referenced media file changes the note's hash
+        self.write('foo.png', 'changed')
+        changed = panki.manifest.package_manifest(collection, 123)
+        self.assertNotEqual(changed['notes']['foo'], manifest['notes']['foo'])
+        self.assertEqual(changed['notes']['bar'], manifest['notes']['bar'])
+        # changing a note type's media changes every note's hash
+        self.write('bg.png', 'changed')
+        changed = panki.manifest.package_manifest(collection, 123)
+        self.assertNotEqual(changed['notes']['bar'], manifest['notes']['bar'])
+
+    def test_changed_notes(self):
+        self.assertEqual(
+            panki.manifest.changed_notes(
+                {'notes': {'foo': '1', 'bar': '2', 'baz': '3'}},
+                {'notes': {'foo': '1', 'bar': '1', 'qux': '1'}}
+            ),
+            {'bar', 'baz'}
+        )
+        self.assertEqual(
+            panki.manifest.changed_notes({'notes': {'foo': '1'}}, {}),
+            {'foo'}
+        )
+
+    def test_save_and_load_build_manifest(self):
+        path = os.path.join(self.dir, 'build', 'manifest.json')
+        manifest = {'packages': {'foo.apkg': {'notes': {'foo': '1'}}}}
+        panki.manifest.save_build_manifest(path, manifest)
+        self.assertEqual(panki.manifest.load_build_manifest(path), manifest)
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import panki.media
+
+
+class TestMedia(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, path, contents):
+        path = os.path.join(self.dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(contents)
+        return path
+
+    def test_scan_media_dir(self):
+        self.write(os.path.join('media', 'b.png'), 'b')
+        self.write(os.path.join('media', 'a.png'), 'a')
+        self.write(os.path.join('media', 'sub', 'c.png'), 'c')
+        entries = panki.media.scan_media_dir(os.path.join(self.dir, 'media'))
+        self.assertEqual(
+            [entry.name for entry in entries],
+            ['a.png', 'b.png', 'c.png']
+        )
+
+    def test_hash_file(self):
+        path = self.write('foo.txt', 'foo')
+        self.assertEqual(
+            panki.media.hash_file(path),
+            hashlib.sha1(b'foo').hexdigest()
+        )
+
+    def test_hash_media_files(self):
+        foo = self.write('foo.txt', 'foo')
+        bar = self.write('bar.txt', 'bar')
+        manifest = {'files': {}}
+        entries = list(panki.media.scan_media_dir(self.dir))
+        hashes = panki.media.hash_media_files(entries, manifest)
+        self.assertEqual(hashes[foo], hashlib.sha1(b'foo').hexdigest())
+        self.assertEqual(hashes[bar], hashlib.sha1(b'bar').hexdigest())
+        self.assertEqual(manifest['files'][foo]['hash'], hashes[foo])
+        self.assertEqual(manifest['files'][foo]['size'], 3)
+
+    @patch('panki.media.hash_file')
+    def test_hash_media_files_cached(self, _hash_file):
+        foo = self.write('foo.txt', 'foo')
+        stat = os.stat(foo)
+        manifest = {
+            'files': {
+                foo: {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime_ns,
+                    'hash': 'abc'
+                }
+            }
+        }
+        entries = list(panki.media.scan_media_dir(self.dir))
+        hashes = panki.media.hash_media_files(entries, manifest)
+        self.assertEqual(hashes, {foo: 'abc'})
+        _hash_file.assert_not_called()
+
+    def test_link_file(self):
+        src = self.write('foo.txt', 'foo')
+        dst = os.path.join(self.dir, 'bar.txt')
+        panki.media.link_file(src, dst)
+        self.assertTrue(os.path.samefile(src, dst))
+
+    @patch('panki.media.reflink_file')
+    @patch('panki.media.os.link')
+    def test_link_file_copy(self, _link, _reflink_file):
+        _link.side_effect = OSError
+        _reflink_file.side_effect = OSError
+        src = self.write('foo.txt', 'foo')
+        dst = os.path.join(self.dir, 'bar.txt')
+        panki.media.link_file(src, dst)
+        with open(dst, 'r') as file:
+            self.assertEqual(file.read(), 'foo')
+
+    def test_save_and_load_media_manifest(self):
+        path = os.path.join(self.dir, 'cache', 'media.json')
+        self.assertEqual(panki.media.load_media_manifest(path), {'files': {}})
+        manifest = {
+            'files': {
+                'foo.txt': {'size': 1, 'mtime': 2, 'hash': 'abc'},
+                'bar.txt': {'size': 3, 'mtime': 4, 'hash': 'def'}
+            }
+        }
+        panki.media.save_media_manifest(path, manifest, {'foo.txt'})
+        self.assertEqual(
+            panki.media.load_media_manifest(path),
+            {'files': {'foo.txt': {'size': 1, 'mtime': 2, 'hash': 'abc'}}}
+        )
+
+    def test_find_media_references(self):
+        text = ''.join([
+            '<img src="foo bar.png"><img src=\'baz.jpg\'><img src=qux.gif>',
+            '[sound:hello.mp3]',
+            '@font-face { src: url("_font.woff"); }',
+            '.a { background: url(bg.png) } .b { background: url(\'b.png\') }',
+            '<img src="https://example.com/remote.png">',
+            '<img src="data:image/png;base64,AAAA">',
+            '<img src="caf%C3%A9.png">'
+        ])
+        self.assertEqual(
+            panki.media.find_media_references(text),
+            {
+                'foo bar.png', 'baz.jpg', 'qux.gif', 'hello.mp3',
+                '_font.woff', 'bg.png', 'b.png', 'café.png'
+            }
+        )
+
+    def test_media_references(self):
+        collection = MagicMock()
+        collection.decks.deck_and_child_ids.return_value = [123, 124]
+        collection.db.execute.return_value = [
+            (1, 10, '<img src="foo.png">\x1fbar'),
+            (2, 10, '[sound:baz.mp3]\x1fqux')
+        ]
+        collection.models.get.return_value = {
+            'css': '.card { background: url(bg.png) }',
+            'tmpls': [
+                {'qfmt': '<img src="front.png">{{Front}}', 'afmt': '{{Back}}'}
+            ]
+        }
+        self.assertEqual(
+            panki.media.media_references(collection, 123),
+            {'foo.png', 'baz.mp3', 'bg.png', 'front.png'}
+        )
+        collection.decks.deck_and_child_ids.assert_called_with(123)
+        self.assertIn('IN (123,124)', collection.db.execute.call_args[0][0])
+        collection.models.get.assert_called_once_with(10)
@@ -1,73 +1,449 @@
+import json
+import os
+import sqlite3
+import tempfile
 import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, call, patch
+import panki.collection
 import panki.package
 
 
 class TestPackage(unittest.TestCase):
 
-    @patch('panki.package.export_package')
-    @patch('panki.package.build_collection')
-    def test_build_project(self, _build_collection, _export_package):
+    def create_project(self):
         project = MagicMock()
-        project.resolve_path = lambda p, relative_to=None: p
+        project.file.path = '/project/project.json'
+        project.build_dir = '/project/build'
+        project.resolve_path = \
+            lambda p, relative_to=None: os.path.join('/project', p)
         project.package = 'project.apkg'
         project.decks = [
             MagicMock(id=123, package='deck1.apkg'),
             MagicMock(id=124, package=None),
             MagicMock(id=125, package='deck3.apkg')
         ]
+        return project
+
+    @patch('panki.package.save_build_manifest')
+    @patch('panki.package.package_manifest')
+    @patch('panki.package.export_package')
+    @patch('panki.package.build_collection')
+    def test_build_project(
+            self, _build_collection, _export_package, _package_manifest,
+            _save_build_manifest):
+        project = self.create_project()
         collection = MagicMock()
         _build_collection.return_value = collection
+        _package_manifest.side_effect = \
+            lambda c, deck_id: {'notes': {'guid': str(deck_id)}}
         panki.package.build_project(project)
-        _build_collection.assert_called_with(project)
-        _export_package.assert_has_calls([
-            call(collection, 'project.apkg'),
-            call(collection, 'deck1.apkg', 123),
-            call(collection, 'deck3.apkg', 125)
+        _build_collection.assert_called_with(
+            project, temp_dir=None, profiler=None, chunk_size=None,
+            max_memory=None, shards=None,
+            update=False, prune=False, stable_ids=False, timestamp=None
+        )
+        self.assertEqual(_export_package.call_args_list, [
+            call(
+                collection, '/project/project.apkg', deck_id=None,
+                compression_level=6, timestamp=None, keep_note_mods=False,
+                profiler=None
+            ),
+            call(
+                collection, '/project/deck1.apkg', deck_id=123,
+                compression_level=6, timestamp=None, keep_note_mods=False,
+                profiler=None
+            ),
+            call(
+                collection, '/project/deck3.apkg', deck_id=125,
+                compression_level=6, timestamp=None, keep_note_mods=False,
+                profiler=None
+            )
         ])
+        _save_build_manifest.assert_called_with(
+            '/project/build/manifest.json',
+            {'packages': {
+                'project.apkg': {'notes': {'guid': 'None'}},
+                'deck1.apkg': {'notes': {'guid': '123'}},
+                'deck3.apkg': {'notes': {'guid': '125'}}
+            }}
+        )
+
+    @patch('panki.package.save_build_manifest')
+    @patch('panki.package.package_manifest')
+    @patch('panki.package.export_package')
+    @patch('panki.package.build_collection')
+    def test_build_project_reproducible(
+            self, _build_collection, _export_package, _package_manifest,
+            _save_build_manifest):
+        project = self.create_project()
+        project.decks = []
+        project.source_paths.return_value = []
+        with patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1600000000'}):
+            panki.package.build_project(project, reproducible=True)
+        _export_package.assert_called_with(
+            _build_collection.return_value, '/project/project.apkg',
+            deck_id=None, compression_level=6, timestamp=1600000000,
+            keep_note_mods=False, profiler=None
+        )
+
+    @patch('panki.package.os.unlink')
+    @patch('panki.package.os.path.exists')
+    @patch('panki.package.load_build_manifest')
+    @patch('panki.package.save_build_manifest')
+    @patch('panki.package.package_manifest')
+    @patch('panki.package.export_package')
+    @patch('panki.package.build_collection')
+    def test_build_project_delta(
+            self, _build_collection, _export_package, _package_manifest,
+            _save_build_manifest, _load_build_manifest, _exists, _unlink):
+        project = self.create_project()
+        collection = _build_collection.return_value
+        _package_manifest.side_effect = lambda c, deck_id: {'notes': {
+            'foo': '1',
+            'bar': '2' if deck_id == 123 else '1'
+        }}
+        _load_build_manifest.return_value = {'packages': {
+            'project.apkg': {'notes': {'foo': '1'}},
+            'deck1.apkg': {'notes': {'foo': '1', 'bar': '1'}},
+            'deck3.apkg': {'notes': {'foo': '1', 'bar': '1'}}
+        }}
+        _exists.return_value = True
+        panki.package.build_project(project, delta_from='manifest.json')
+        _load_build_manifest.assert_called_with('manifest.json')
+        delta_calls = [
+            c for c in _export_package.call_args_list if 'guids' in c[1]
+        ]
+        self.assertEqual(delta_calls, [
+            call(
+                collection, '/project/project.delta.apkg', deck_id=None,
+                guids={'bar'}, compression_level=6, timestamp=None,
+                keep_note_mods=False, profiler=None
+            ),
+            call(
+                collection, '/project/deck1.delta.apkg', deck_id=123,
+                guids={'bar'}, compression_level=6, timestamp=None,
+                keep_note_mods=False, profiler=None
+            )
+        ])
+        _unlink.assert_called_once_with('/project/deck3.delta.apkg')
+
+    @patch('panki.package.build_project')
+    @patch('panki.package.validate_project')
+    @patch('panki.package.load_project')
+    def test_build_project_directory(
+            self, _load_project, _validate_project, _build_project):
+        _validate_project.return_value = []
+        elapsed, error = panki.package.build_project_directory(
+            'foo', compression_level=9
+        )
+        self.assertIsNone(error)
+        _load_project.assert_called_with('foo', lazy_data=False)
+        _validate_project.assert_called_with(_load_project.return_value)
+        _build_project.assert_called_with(
+            _load_project.return_value,
+            compression_level=9
+        )
+        _validate_project.return_value = ['a: bad', 'b: worse']
+        elapsed, error = panki.package.build_project_directory('foo')
+        self.assertEqual(error, '2 problems: a: bad; b: worse')
+        _build_project.reset_mock()
+        elapsed, error = panki.package.build_project_directory(
+            'foo', check=False
+        )
+        self.assertIsNone(error)
+        _build_project.assert_called_with(_load_project.return_value)
+        _validate_project.return_value = []
+        _build_project.side_effect = Exception('bad project')
+        elapsed, error = panki.package.build_project_directory('foo')
+        self.assertEqual(error, 'bad project')
+        _load_project.return_value = None
+        elapsed, error = panki.package.build_project_directory('foo')
+        self.assertIn('does not contain a project', error)
+
+    @patch('concurrent.futures.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('panki.package.build_project_directory')
+    def test_build_projects(self, _build_project_directory):
+        _build_project_directory.side_effect = lambda d, **kwargs: (
+            (1.0, 'failed' if d == 'bar' else None)
+        )
+        results = panki.package.build_projects(
+            ['foo', 'bar'], max_workers=2, reproducible=True
+        )
+        self.assertEqual(
+            sorted(results),
+            [('bar', 1.0, 'failed'), ('foo', 1.0, None)]
+        )
+        _build_project_directory.assert_any_call('foo', reproducible=True)
 
-    @patch('panki.package.anki')
-    def test_import_package(self, _anki):
+    @patch('anki.importing.AnkiPackageImporter')
+    def test_import_package(self, _importer):
         collection = MagicMock()
         importer = MagicMock()
-        _anki.importing.AnkiPackageImporter.return_value = importer
+        _importer.return_value = importer
         panki.package.import_package('foo.apkg', collection)
-        _anki.importing.AnkiPackageImporter.assert_called_with(
+        _importer.assert_called_with(
             collection,
             'foo.apkg'
         )
         importer.run.assert_called_with()
 
-    @patch('panki.package.create_file')
-    @patch('panki.package.anki')
-    def test_export_package(self, _anki, _create_file):
-        file = MagicMock()
-        file.path = 'foo.apkg'
-        _create_file.return_value = file
+    @patch('panki.exporters.PackageExporter')
+    def test_export_package(self, _exporter):
         collection = MagicMock()
-        collection.path = 'collection.anki2'
         exporter = MagicMock()
-        _anki.exporting.AnkiPackageExporter.return_value = exporter
-        panki.package.export_package(collection, 'foo.apkg')
-        _anki.exporting.AnkiPackageExporter.assert_called_with(collection)
-        exporter.exportInto.assert_called_with('foo.apkg')
-        file.move.assert_called_with('foo.apkg')
-
-    @patch('panki.package.create_file')
-    @patch('panki.package.anki')
-    def test_export_package_specific_deck(self, _anki, _create_file):
-        file = MagicMock()
-        file.path = 'foo.apkg'
-        _create_file.return_value = file
+        exporter.exportInto.side_effect = \
+            lambda p: open(p, 'w').write('package')
+        _exporter.return_value = exporter
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'packages', 'foo.apkg')
+            panki.package.export_package(
+                collection, path, compression_level=9
+            )
+            _exporter.assert_called_with(collection)
+            self.assertTrue(exporter.prune_media)
+            self.assertEqual(exporter.compression_level, 9)
+            temp_path = exporter.exportInto.call_args[0][0]
+            self.assertEqual(os.path.dirname(temp_path), os.path.dirname(path))
+            self.assertFalse(os.path.exists(temp_path))
+            with open(path, 'r') as file:
+                self.assertEqual(file.read(), 'package')
+
+    @patch('panki.exporters.PackageExporter')
+    def test_export_package_unchanged(self, _exporter):
+        exporter = MagicMock()
+        exporter.exportInto.side_effect = \
+            lambda p: open(p, 'w').write('package')
+        _exporter.return_value = exporter
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'foo.apkg')
+            with open(path, 'w') as file:
+                file.write('package')
+            os.utime(path, (0, 0))
+            written = panki.package.export_package(
+                MagicMock(), path, timestamp=1600000000
+            )
+            self.assertFalse(written)
+            self.assertEqual(exporter.timestamp, 1600000000)
+            self.assertEqual(os.stat(path).st_mtime, 0)
+            self.assertEqual(os.listdir(temp_dir), ['foo.apkg'])
+            exporter.exportInto.side_effect = \
+                lambda p: open(p, 'w').write('changed')
+            written = panki.package.export_package(MagicMock(), path)
+            self.assertTrue(written)
+            with open(path, 'r') as file:
+                self.assertEqual(file.read(), 'changed')
+
+    @patch('panki.package.note_card_ids')
+    @patch('panki.exporters.PackageExporter')
+    def test_export_package_guids(self, _exporter, _note_card_ids):
         collection = MagicMock()
-        collection.path = 'collection.anki2'
         exporter = MagicMock()
-        _anki.exporting.AnkiPackageExporter.return_value = exporter
-        panki.package.export_package(collection, 'foo.apkg', deck_id=123)
-        _anki.exporting.AnkiPackageExporter.assert_called_with(collection)
+        exporter.exportInto.side_effect = \
+            lambda p: open(p, 'w').write('package')
+        _exporter.return_value = exporter
+        _note_card_ids.return_value = [1, 2]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'foo.apkg')
+            panki.package.export_package(
+                collection, path, deck_id=123, guids={'foo'}
+            )
+        _note_card_ids.assert_called_with(collection, {'foo'}, 123)
+        self.assertEqual(exporter.cids, [1, 2])
+
+    @patch('panki.exporters.PackageExporter')
+    def test_export_package_specific_deck(self, _exporter):
+        collection = MagicMock()
+        exporter = MagicMock()
+        exporter.exportInto.side_effect = \
+            lambda p: open(p, 'w').write('package')
+        _exporter.return_value = exporter
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'foo.apkg')
+            panki.package.export_package(collection, path, deck_id=123)
+        _exporter.assert_called_with(collection)
         self.assertEqual(exporter.did, 123)
-        exporter.exportInto.assert_called_with('foo.apkg')
-        file.move.assert_called_with('foo.apkg')
+
+    def test_package_writer(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = {}
+            for name in ('collection.anki2', 'foo.mp3', 'bar.svg'):
+                paths[name] = os.path.join(temp_dir, name)
+                with open(paths[name], 'w') as file:
+                    file.write(name * 100)
+            path = os.path.join(temp_dir, 'package.apkg')
+            with panki.package.PackageWriter(path, 9) as writer:
+                writer.write_file(
+                    paths['collection.anki2'],
+                    'collection.anki2'
+                )
+                media = writer.write_media([
+                    ('foo.mp3', paths['foo.mp3']),
+                    ('bar.svg', paths['bar.svg'])
+                ])
+            self.assertEqual(media, {'0': 'foo.mp3', '1': 'bar.svg'})
+            with zipfile.ZipFile(path) as package:
+                infos = {info.filename: info for info in package.infolist()}
+                self.assertEqual(
+                    infos['collection.anki2'].compress_type,
+                    zipfile.ZIP_DEFLATED
+                )
+                self.assertEqual(infos['0'].compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(
+                    infos['1'].compress_type,
+                    zipfile.ZIP_DEFLATED
+                )
+                self.assertEqual(json.loads(package.read('media')), media)
+                self.assertEqual(package.read('0'), b'foo.mp3' * 100)
+
+    def test_package_writer_store_only(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'package.apkg')
+            with panki.package.PackageWriter(path, 0) as writer:
+                writer.write_bytes('collection.anki2', b'foo')
+                writer.write_media([])
+            with zipfile.ZipFile(path) as package:
+                for info in package.infolist():
+                    self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+
+    def test_package_writer_timestamp(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'foo.mp3')
+            with open(file_path, 'w') as file:
+                file.write('foo')
+            hashes = set()
+            for i in range(2):
+                os.utime(file_path, (i, i))
+                path = os.path.join(temp_dir, 'package{}.apkg'.format(i))
+                with panki.package.PackageWriter(
+                        path, timestamp=1600000000) as writer:
+                    writer.write_bytes('collection.anki2', b'foo')
+                    writer.write_media([('foo.mp3', file_path)])
+                with zipfile.ZipFile(path) as package:
+                    for info in package.infolist():
+                        self.assertEqual(
+                            info.date_time,
+                            (2020, 9, 13, 12, 26, 40)
+                        )
+                        self.assertEqual(info.external_attr, 0o644 << 16)
+                with open(path, 'rb') as file:
+                    hashes.add(file.read())
+            self.assertEqual(len(hashes), 1)
+
+    def test_package_writer_timestamp_large_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'collection.anki2')
+            data = os.urandom(1024) * 4096
+            with open(file_path, 'wb') as file:
+                file.write(data)
+            reads = []
+            real_open = open
+
+            def tracked_open(*args, **kwargs):
+                file = real_open(*args, **kwargs)
+                read = file.read
+
+                def tracked_read(size=-1):
+                    reads.append(size)
+                    return read(size)
+                file.read = tracked_read
+                return file
+
+            path = os.path.join(temp_dir, 'package.apkg')
+            with panki.package.PackageWriter(
+                    path, 1, timestamp=1600000000) as writer:
+                writer.copy_buffer_size = 64 * 1024
+                with patch('panki.package.open', tracked_open, create=True):
+                    writer.write_file(file_path, 'collection.anki2')
+            self.assertTrue(reads)
+            self.assertTrue(all(0 < size <= 64 * 1024 for size in reads))
+            with zipfile.ZipFile(path) as package:
+                info = package.getinfo('collection.anki2')
+                self.assertEqual(info.date_time, (2020, 9, 13, 12, 26, 40))
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(package.read('collection.anki2'), data)
+
+    def create_package(self, temp_dir, collection_name='collection.anki2'):
+        db_path = os.path.join(temp_dir, 'source.anki2')
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE notes (id INTEGER, flds TEXT)')
+        conn.execute("INSERT INTO notes VALUES (1, 'foo')")
+        conn.commit()
+        conn.close()
+        path = os.path.join(temp_dir, 'package.apkg')
+        with zipfile.ZipFile(path, 'w') as package:
+            package.write(db_path, collection_name, zipfile.ZIP_DEFLATED)
+            package.writestr('0', b'stored', zipfile.ZIP_STORED)
+            package.writestr('1', b'deflated' * 100, zipfile.ZIP_DEFLATED)
+            package.writestr('media', json.dumps({
+                '0': 'foo.png',
+                '1': 'bar.svg',
+                '2': 'missing.png'
+            }))
+        return path
+
+    def test_package_reader(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.create_package(temp_dir, 'collection.anki21')
+            with panki.package.PackageReader(path) as reader:
+                self.assertEqual(
+                    reader.collection_entry.filename,
+                    'collection.anki21'
+                )
+                self.assertEqual(
+                    [name for name, _ in reader.media()],
+                    ['foo.png', 'bar.svg']
+                )
+                media_dir = os.path.join(temp_dir, 'media')
+                reader.extract_media(media_dir)
+            with open(os.path.join(media_dir, 'foo.png'), 'rb') as file:
+                self.assertEqual(file.read(), b'stored')
+            with open(os.path.join(media_dir, 'bar.svg'), 'rb') as file:
+                self.assertEqual(file.read(), b'deflated' * 100)
+
+    @patch('panki.package.os_sendfile')
+    @patch('panki.package.os_copy_file_range')
+    def test_package_reader_without_zero_copy(self, _copy, _sendfile):
+        _copy.side_effect = OSError
+        _sendfile.side_effect = OSError
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.create_package(temp_dir)
+            with panki.package.PackageReader(path) as reader:
+                media_dir = os.path.join(temp_dir, 'media')
+                reader.extract_media(media_dir)
+            with open(os.path.join(media_dir, 'foo.png'), 'rb') as file:
+                self.assertEqual(file.read(), b'stored')
+
+    def test_dump_package(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.create_package(temp_dir)
+            dump_dir = os.path.join(temp_dir, 'dump')
+            panki.package.dump_package(path, dump_dir)
+            self.assertTrue(os.path.exists(
+                os.path.join(dump_dir, 'collection.media', 'foo.png')
+            ))
+            rows_path = os.path.join(dump_dir, 'tables', 'notes', 'rows.csv')
+            with open(rows_path, 'r') as file:
+                self.assertEqual(file.read(), 'flds,id\nfoo,1\n')
+
+    def test_dump_package_tables(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.create_package(temp_dir)
+            dump_dir = os.path.join(temp_dir, 'dump')
+            files = sorted(os.listdir(temp_dir))
+            # nothing is written if a table is not in the collection
+            with self.assertRaises(panki.collection.UnknownTablesError):
+                panki.package.dump_package(
+                    path, dump_dir, tables=['notes', 'foo']
+                )
+            self.assertEqual(sorted(os.listdir(temp_dir)), files)
+            # media files are not needed to dump some of the tables
+            panki.package.dump_package(path, dump_dir, tables=['notes'])
+            self.assertEqual(
+                sorted(os.listdir(dump_dir)),
+                ['collection.anki2', 'tables']
+            )
 
     def test_is_anki_package(self):
         self.assertTrue(panki.package.is_anki_package('file.apkg'))
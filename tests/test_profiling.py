@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import panki.profiling
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profiler(self):
+        profiler = panki.profiling.Profiler()
+        with profiler.phase('build'):
+            with profiler.phase('add_decks') as phase:
+                with profiler.phase('deck: Foo', path='foo') as deck_phase:
+                    deck_phase['count'] = 2
+                phase['count'] = 3
+            with profiler.phase('add_media'):
+                pass
+        phases = profiler.finished_phases()
+        self.assertEqual(
+            [(p['name'], p['depth'], p['count']) for p in phases],
+            [
+                ('build', 0, None),
+                ('add_decks', 1, 3),
+                ('deck: Foo', 2, 2),
+                ('add_media', 1, None)
+            ]
+        )
+        self.assertEqual(phases[2]['args'], {'path': 'foo'})
+        for phase in phases:
+            self.assertGreaterEqual(phase['wall'], 0)
+            self.assertGreaterEqual(phase['cpu'], 0)
+            self.assertGreater(phase['max_rss'], 0)
+        self.assertGreaterEqual(phases[0]['wall'], phases[1]['wall'])
+
+    def test_profiler_worker_threads(self):
+        profiler = panki.profiling.Profiler()
+
+        def work():
+            with profiler.phase('table: notes'):
+                pass
+
+        with profiler.phase('dump'):
+            with profiler.phase('dump_tables'):
+                thread = threading.Thread(target=work)
+                thread.start()
+                thread.join()
+        phases = profiler.finished_phases()
+        self.assertEqual(
+            [(p['name'], p['depth']) for p in phases],
+            [('dump', 0), ('dump_tables', 1), ('table: notes', 2)]
+        )
+        trace = profiler.trace()
+        events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual([e['tid'] for e in events], [1, 1, 2])
+        names = {
+            e['tid']: e['args']['name']
+            for e in trace['traceEvents'] if e['ph'] == 'M'
+        }
+        self.assertEqual(names, {1: 'main', 2: 'worker 2'})
+
+    def test_profiler_summary(self):
+        profiler = panki.profiling.Profiler()
+        with profiler.phase('build'):
+            with profiler.phase('add_decks') as phase:
+                phase['count'] = 1234
+        lines = profiler.summary()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(
+            lines[0].split(),
+            ['Phase', 'Wall', 'CPU', 'Peak', 'RSS', 'Items']
+        )
+        self.assertTrue(lines[1].startswith('build '))
+        self.assertTrue(lines[2].startswith('  add_decks '))
+        self.assertTrue(lines[2].endswith(' 1234'))
+
+    def test_profiler_trace(self):
+        profiler = panki.profiling.Profiler()
+        with profiler.phase('build'):
+            with profiler.phase('add_decks') as phase:
+                phase['count'] = 5
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'trace.json')
+            profiler.save_trace(path)
+            with open(path) as file:
+                trace = json.load(file)
+        events = trace['traceEvents']
+        self.assertEqual(events[0]['name'], 'build')
+        self.assertEqual(events[1]['name'], 'add_decks')
+        self.assertEqual(events[1]['ph'], 'X')
+        self.assertEqual(events[1]['args']['count'], 5)
+        self.assertLessEqual(events[0]['ts'], events[1]['ts'])
+        self.assertGreaterEqual(events[0]['dur'], events[1]['dur'])
+
+    def test_profile_phase(self):
+        profiler = panki.profiling.Profiler()
+        with panki.profiling.profile_phase(profiler, 'foo') as phase:
+            phase['count'] = 1
+        self.assertEqual(profiler.phases[0]['count'], 1)
+        with panki.profiling.profile_phase(None, 'foo') as phase:
+            phase['count'] = 1
+        self.assertEqual(len(profiler.phases), 1)
@@ -0,0 +1,55 @@
+import unittest
+from panki.records import Records
+
+
+class TestRecords(unittest.TestCase):
+
+    def test_from_rows(self):
+        records = Records.from_rows(
+            ['Front', 'Back'],
+            [['one', 'two'], ['three', 'two'], ['four']]
+        )
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records.fields, ('Front', 'Back'))
+        self.assertEqual(records[0]['Front'], 'one')
+        self.assertEqual(records[1]['Back'], 'two')
+        self.assertIsNone(records[2]['Back'])
+        # repeated values are only stored once
+        self.assertIs(records.rows[0][1], records.rows[1][1])
+        self.assertEqual(records, [
+            {'Front': 'one', 'Back': 'two'},
+            {'Front': 'three', 'Back': 'two'},
+            {'Front': 'four', 'Back': None}
+        ])
+
+    def test_from_dicts(self):
+        records = Records.from_dicts([
+            {'Front': 'one', 'Back': 'two'},
+            {'Back': 'three', 'Extra': 4}
+        ])
+        self.assertEqual(records.fields, ('Front', 'Back', 'Extra'))
+        self.assertEqual(dict(records[0]), {'Front': 'one', 'Back': 'two'})
+        self.assertEqual(dict(records[1]), {'Back': 'three', 'Extra': 4})
+        self.assertNotIn('Extra', records[0])
+        self.assertNotIn('Front', records[1])
+        with self.assertRaises(KeyError):
+            records[1]['Front']
+        self.assertEqual(records[0].get('Extra', 'default'), 'default')
+
+    def test_record_mapping(self):
+        records = Records.from_rows(['Front', 'Back'], [['one', 'two']])
+        record = records[0]
+        self.assertEqual(list(record.keys()), ['Front', 'Back'])
+        self.assertEqual(len(record), 2)
+        self.assertEqual('{Front}:{Back}'.format(**record), 'one:two')
+        self.assertEqual(record, {'Front': 'one', 'Back': 'two'})
+
+    def test_slice(self):
+        records = Records.from_rows(['Front'], [['a'], ['b'], ['c']])
+        self.assertEqual(records[1:], [{'Front': 'b'}, {'Front': 'c'}])
+        self.assertEqual([r['Front'] for r in records], ['a', 'b', 'c'])
+
+    def test_empty(self):
+        records = Records.from_dicts([])
+        self.assertFalse(records)
+        self.assertEqual(records, [])
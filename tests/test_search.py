@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import panki.config
+import panki.file
+import panki.search
+
+
+class TestSearch(unittest.TestCase):
+
+    def create_project(self, directory):
+        project = panki.config.ProjectConfig(
+            path=os.path.join(directory, 'project.json')
+        )
+        deck = project.add_deck(id=1, name='Elements')
+        for name, records in (
+                ('symbols.csv', [
+                    {'Element': 'Hydrogen', 'Symbol': 'H'},
+                    {'Element': 'Helium', 'Symbol': 'He'}
+                ]),
+                ('names.csv', [
+                    {'Element': 'Neon', 'Symbol': 'Ne'}
+                ])):
+            path = os.path.join(directory, name)
+            file = panki.file.create_file(path, records)
+            file.write()
+            note_group = deck.add_notes(type='Element')
+            note_group.add_data(name, panki.file.load_data_file(path))
+        return project
+
+    def test_search(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project = self.create_project(temp_dir)
+            path = panki.search.index_path(project)
+            self.assertEqual(panki.search.update_index(project, path), (2, 2))
+            symbols_path = os.path.join(temp_dir, 'symbols.csv')
+            self.assertEqual(
+                panki.search.search_index(path, 'helium'),
+                [(
+                    symbols_path, 'Elements', 'Element', 2,
+                    {'Element': 'Helium', 'Symbol': 'He'}
+                )]
+            )
+            self.assertEqual(
+                len(panki.search.search_index(path, 'he* OR neon')), 2
+            )
+            self.assertEqual(
+                len(panki.search.search_index(path, 'he*', limit=1)), 1
+            )
+
+    def test_update_index(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project = self.create_project(temp_dir)
+            path = panki.search.index_path(project)
+            panki.search.update_index(project, path)
+            # unchanged files are not indexed again
+            project = self.create_project(temp_dir)
+            self.assertEqual(panki.search.update_index(project, path), (2, 0))
+            # changed files are
+            symbols_path = os.path.join(temp_dir, 'symbols.csv')
+            file = panki.file.create_file(symbols_path, [
+                {'Element': 'Lithium', 'Symbol': 'Li'}
+            ])
+            file.write()
+            project.decks[0].notes[0].data[0].file = \
+                panki.file.load_data_file(symbols_path)
+            self.assertEqual(panki.search.update_index(project, path), (2, 1))
+            self.assertEqual(panki.search.search_index(path, 'helium'), [])
+            self.assertEqual(
+                panki.search.search_index(path, 'lithium')[0][3], 1
+            )
+            # removed files are removed from the index
+            del project.decks[0].notes[1]
+            self.assertEqual(panki.search.update_index(project, path), (1, 0))
+            self.assertEqual(panki.search.search_index(path, 'neon'), [])
+
+    def test_update_index_database(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'words.db')
+            conn = sqlite3.connect(db_path)
+            with conn:
+                conn.execute('CREATE TABLE a (Word TEXT)')
+                conn.execute('CREATE TABLE b (Word TEXT)')
+                conn.execute("INSERT INTO a VALUES ('alpha'), ('beta')")
+                conn.execute("INSERT INTO b VALUES ('gamma')")
+            conn.close()
+            project = panki.config.ProjectConfig(
+                path=os.path.join(temp_dir, 'project.json')
+            )
+            note_group = project.add_deck(id=1, name='Words').add_notes(
+                type='Word'
+            )
+            for table in ('a', 'b'):
+                note_group.add_data(
+                    'words.db',
+                    panki.file.SqliteFile(db_path, table=table)
+                )
+            path = panki.search.index_path(project)
+            # each query of a database is a source of its own
+            self.assertEqual(panki.search.update_index(project, path), (2, 2))
+            self.assertEqual(
+                panki.search.search_index(path, 'gamma'),
+                [(db_path, 'Words', 'Word', 1, {'Word': 'gamma'})]
+            )
+            # changing a query indexes its records again
+            note_group.data[1].file = panki.file.SqliteFile(
+                db_path,
+                query="SELECT Word FROM a WHERE Word = 'beta'"
+            )
+            self.assertEqual(panki.search.update_index(project, path), (2, 1))
+            self.assertEqual(panki.search.search_index(path, 'gamma'), [])
+            self.assertEqual(
+                len(panki.search.search_index(path, 'beta')), 2
+            )
+
+    def test_connect_index_without_queries(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'index.db')
+            conn = sqlite3.connect(path)
+            conn.execute(
+                'CREATE TABLE sources (id INTEGER PRIMARY KEY, path TEXT, '
+                'deck TEXT, note_type TEXT, mtime_ns INTEGER, size INTEGER, '
+                'digest TEXT)'
+            )
+            conn.commit()
+            conn.close()
+            conn = panki.search.connect_index(path)
+            try:
+                columns = [
+                    row[1]
+                    for row in conn.execute('PRAGMA table_info(sources)')
+                ]
+            finally:
+                conn.close()
+            self.assertIn('query', columns)
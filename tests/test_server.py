@@ -0,0 +1,139 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import panki.server
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def start_server(self):
+        path = os.path.join(self.dir, 'panki.sock')
+        server = panki.server.Server(path)
+        thread = threading.Thread(
+            target=server.serve_forever,
+            kwargs={'poll_interval': 0.01}
+        )
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+        self.addCleanup(stop)
+        return server, path
+
+    @patch('panki.server.project_fingerprint')
+    @patch('panki.server.load_project')
+    def test_project_cache(self, _load_project, _project_fingerprint):
+        _load_project.side_effect = lambda d: MagicMock(directory=d)
+        _project_fingerprint.return_value = 1
+        cache = panki.server.ProjectCache(idle_timeout=60)
+        with cache.project(self.dir) as project:
+            self.assertEqual(project.directory, os.path.realpath(self.dir))
+        with cache.project(self.dir) as same_project:
+            self.assertIs(same_project, project)
+        # projects are reloaded when their files change
+        _project_fingerprint.return_value = 2
+        with cache.project(self.dir) as changed_project:
+            self.assertIsNot(changed_project, project)
+        self.assertEqual(_load_project.call_count, 2)
+        cache.evict_idle()
+        self.assertEqual(list(cache.entries), [os.path.realpath(self.dir)])
+        cache.idle_timeout = 0
+        time.sleep(0.01)
+        cache.evict_idle()
+        self.assertEqual(cache.entries, {})
+
+    @patch('panki.server.load_project')
+    def test_project_cache_no_project(self, _load_project):
+        _load_project.return_value = None
+        cache = panki.server.ProjectCache()
+        with self.assertRaises(ValueError):
+            with cache.project(self.dir):
+                pass
+
+    @patch('panki.server.project_fingerprint')
+    @patch('panki.server.validate_project')
+    @patch('panki.server.build_project')
+    @patch('panki.server.load_project')
+    def test_build_request(
+            self, _load_project, _build_project, _validate_project,
+            _project_fingerprint):
+        _validate_project.return_value = []
+        server, path = self.start_server()
+        result = panki.server.send_request(
+            path, 'build', directory=self.dir, compression_level=9
+        )
+        self.assertIn('elapsed', result)
+        self.assertEqual(result['problems'], [])
+        _load_project.assert_called_with(os.path.realpath(self.dir))
+        _validate_project.assert_called_with(_load_project.return_value)
+        _build_project.assert_called_with(
+            _load_project.return_value,
+            compression_level=9
+        )
+        # projects with problems are not built
+        _build_project.reset_mock()
+        _validate_project.return_value = ['Foo Deck: unknown note type: Bar']
+        result = panki.server.send_request(path, 'build', directory=self.dir)
+        self.assertEqual(result, {
+            'problems': ['Foo Deck: unknown note type: Bar']
+        })
+        _build_project.assert_not_called()
+        result = panki.server.send_request(
+            path, 'build', directory=self.dir, check=False
+        )
+        _build_project.assert_called_with(_load_project.return_value)
+        status = panki.server.send_request(path, 'status')
+        self.assertEqual(status['pid'], os.getpid())
+        self.assertEqual(status['projects'], [os.path.realpath(self.dir)])
+
+    @patch('panki.server.dump_package')
+    def test_dump_request(self, _dump_package):
+        def dump_package(package, path, progress, **kwargs):
+            progress('notes', 10, 0.5, False)
+            progress('notes', 20, 1.0, True)
+
+        _dump_package.side_effect = dump_package
+        server, path = self.start_server()
+        directory = os.path.join(self.dir, 'dump')
+        result = panki.server.send_request(
+            path, 'dump', package='foo.apkg', directory=directory,
+            tables=['notes']
+        )
+        self.assertEqual(result, {'tables': [['notes', 20, 1.0]]})
+        self.assertEqual(_dump_package.call_args[0], ('foo.apkg', directory))
+
+    def test_request_error(self):
+        server, path = self.start_server()
+        with self.assertRaises(panki.server.RequestError) as cm:
+            panki.server.send_request(path, 'foo')
+        self.assertEqual(str(cm.exception), 'unknown command: foo')
+        self.assertEqual(cm.exception.type, 'ValueError')
+
+    def test_is_serving(self):
+        path = os.path.join(self.dir, 'panki.sock')
+        self.assertFalse(panki.server.is_serving(path))
+        server, path = self.start_server()
+        self.assertTrue(panki.server.is_serving(path))
+
+    def test_default_socket_path(self):
+        with patch.dict(os.environ, {'PANKI_SOCKET': 'foo.sock'}):
+            self.assertEqual(panki.server.default_socket_path(), 'foo.sock')
+        env = {'PANKI_SOCKET': '', 'XDG_RUNTIME_DIR': '/run/user/1000'}
+        with patch.dict(os.environ, env):
+            self.assertEqual(
+                panki.server.default_socket_path(),
+                '/run/user/1000/panki.sock'
+            )
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+class TestStartup(unittest.TestCase):
+
+    # modules that are only imported by the commands that need them
+    lazy_modules = ('anki', 'bs4', 'yaml', 'urllib.request')
+
+    # the cumulative import time of the cli, in microseconds
+    import_time_budget = 150000
+
+    def import_times(self, module='panki.main'):
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root_dir)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            env=env,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+        return times
+
+    def test_lazy_imports(self):
+        times = self.import_times()
+        self.assertIn('panki.cli', times)
+        for module in self.lazy_modules:
+            self.assertNotIn(module, times)
+
+    def test_import_time_budget(self):
+        # take the best of a few runs to smooth out noise
+        import_time = min(
+            self.import_times()['panki.main'] for _ in range(3)
+        )
+        self.assertLess(import_time, self.import_time_budget)
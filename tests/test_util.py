@@ -1,5 +1,8 @@
+import os
+import tempfile
 import unittest
 from datetime import datetime, timezone
+from unittest.mock import patch
 import click
 import panki.util
 
@@ -25,6 +28,50 @@ class TestUtil(unittest.TestCase):
             panki.util.generate_id()
         )
 
+    def test_stable_id(self):
+        id = panki.util.stable_id('foo', 1)
+        self.assertEqual(id, panki.util.stable_id('foo', 1))
+        self.assertNotEqual(id, panki.util.stable_id('foo', 2))
+        # IDs are creation times, and are never in the future
+        self.assertLess(id, panki.util.generate_id())
+        self.assertGreaterEqual(id, panki.util.stable_id_end - 10 ** 12)
+        self.assertEqual(panki.util.stable_id('foo', end=6, span=1), 5)
+        self.assertLess(panki.util.stable_id('foo', end=3), 3)
+        with self.assertRaises(ValueError):
+            panki.util.stable_id('foo', end=0)
+
+    def test_stable_ids(self):
+        ids = panki.util.stable_ids([('b',), ('a',)], end=7, span=2)
+        self.assertEqual(sorted(ids.values()), [5, 6])
+        # colliding IDs wrap around within the range
+        ids = panki.util.stable_ids([('c',), ('b',), ('a',)], end=8, span=3)
+        self.assertEqual(sorted(ids.values()), [5, 6, 7])
+        with self.assertRaises(ValueError):
+            panki.util.stable_ids([('b',), ('a',)], end=6, span=1)
+
+    def test_stable_id_end_before(self):
+        self.assertEqual(
+            panki.util.stable_id_end_before(1600000000),
+            1600000000000
+        )
+        self.assertEqual(
+            panki.util.stable_id_end_before(1700000000),
+            panki.util.stable_id_end
+        )
+
+    def test_source_date_epoch(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i, name in enumerate(('foo', 'bar')):
+                paths.append(os.path.join(temp_dir, name))
+                open(paths[-1], 'w').close()
+                os.utime(paths[-1], (i * 1000, i * 1000))
+            with patch.dict(os.environ, {'SOURCE_DATE_EPOCH': ''}):
+                self.assertEqual(panki.util.source_date_epoch(paths), 1000)
+                self.assertEqual(panki.util.source_date_epoch(), 0)
+            with patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '123'}):
+                self.assertEqual(panki.util.source_date_epoch(paths), 123)
+
     def test_timestamp(self):
         self.assertWithinMilliseconds(
             datetime.now(timezone.utc).timestamp() * 1000,